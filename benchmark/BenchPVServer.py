@@ -0,0 +1,149 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+#################################################################
+# In-process stand-in of the CA server for the benchmarks
+# Note:
+#   1. install() replaces epics.PV by BenchPV, so RemotePV and LocalPV
+#      work without IOC and network
+#   2. The values are kept in a dict shared by all PVs of the same name.
+#      A put notifies the monitors by a dispatcher thread as the CA
+#      callbacks of pyepics
+#   3. An optional delay simulates the round trip of get/put
+#################################################################
+import threading
+import queue
+import time
+
+import epics
+
+from ooepics.MonRecorder import char_str
+
+# =================================
+# stand-in of epics.PV
+# =================================
+class BenchPV:
+    def __init__(self, pvname, connection_timeout = None, auto_monitor = None, **kw):
+        self.pvname    = pvname
+        self.host      = BenchPVServer.HOST
+        self.status    = 0
+        self.severity  = 0
+        self.callbacks = {}
+        BenchPVServer.register(self)
+
+    def connect(self, timeout = None):
+        return True
+
+    def wait_for_connection(self, timeout = None):
+        return True
+
+    def get_with_metadata(self, form = 'time', as_string = False, use_monitor = True, timeout = None, **kw):
+        if not use_monitor:
+            BenchPVServer.round_trip()
+        value, ts = BenchPVServer.get(self.pvname)
+        return {'value':     str(value) if as_string else value,
+                'timestamp': ts,
+                'severity':  0,
+                'status':    0}
+
+    def get(self, **kw):
+        return self.get_with_metadata(**kw)['value']
+
+    def put(self, value, wait = False, timeout = None, **kw):
+        BenchPVServer.round_trip()
+        BenchPVServer.put(self.pvname, value)
+        return 1
+
+    def add_callback(self, callback = None, **kw):
+        idx = len(self.callbacks) + 1
+        self.callbacks[idx] = callback
+        return idx
+
+# =================================
+# the server
+# =================================
+class BenchPVServer:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    HOST        = "bench:5064"
+    delay       = 0.0                   # simulated round trip, s
+    lock        = threading.Lock()
+    values      = {}                    # pvname -> [value, timestamp]
+    pvs         = {}                    # pvname -> list of BenchPV
+    eventQ      = queue.Queue()         # monitor events to be dispatched
+    thread      = None
+    orig_pv     = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # install the stand-in (before creating the PVs)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def install(cls, delay = 0.0):
+        cls.delay = delay
+        if cls.orig_pv is None:
+            cls.orig_pv = epics.PV
+            epics.PV    = BenchPV
+        if cls.thread is None:
+            cls.thread = threading.Thread(target = cls._thrd_func, daemon = True, name = "TRD-BenchCA")
+            cls.thread.start()
+
+    @classmethod
+    def uninstall(cls):
+        if cls.orig_pv is not None:
+            epics.PV    = cls.orig_pv
+            cls.orig_pv = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # access the values
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def register(cls, pv):
+        with cls.lock:
+            cls.pvs.setdefault(pv.pvname, []).append(pv)
+            cls.values.setdefault(pv.pvname, [0, time.time()])
+
+    @classmethod
+    def round_trip(cls):
+        if cls.delay > 0:
+            time.sleep(cls.delay)
+
+    @classmethod
+    def get(cls, pvname):
+        with cls.lock:
+            return cls.values[pvname]
+
+    @classmethod
+    def put(cls, pvname, value):
+        ts = time.time()
+        with cls.lock:
+            cls.values[pvname] = [value, ts]
+            monitored = any(pv.callbacks for pv in cls.pvs.get(pvname, []))
+        if monitored:
+            cls.eventQ.put([pvname, value, ts])
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # wait until all monitor events are dispatched
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def flush(cls):
+        cls.eventQ.join()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # dispatch the monitor events
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def _thrd_func(cls):
+        while True:
+            pvname, value, ts = cls.eventQ.get()
+            with cls.lock:
+                callbacks = [cb for pv in cls.pvs.get(pvname, []) for cb in pv.callbacks.values()]
+            for cb in callbacks:
+                try:
+                    cb(pvname = pvname, value = value, char_value = char_str(value),
+                       timestamp = ts, severity = 0, status = 0)
+                except Exception as e:
+                    print("ERROR: monitor callback of {} failed: {}".format(pvname, e))
+            cls.eventQ.task_done()
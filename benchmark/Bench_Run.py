@@ -0,0 +1,307 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+#################################################################
+# Micro-benchmarks of ooepics, run offline with the stand-in CA server
+# Note:
+#   1. Run in the top folder:
+#           python benchmark/Bench_Run.py               compare with the baseline
+#           python benchmark/Bench_Run.py --save        save a new baseline
+#      or use "make bench" / "make bench-baseline"
+#   2. The baseline is machine specific, it is not committed. A metric
+#      is flagged as regression if it is worse than the baseline by more
+#      than the tolerance, the exit code is then 1
+#   3. The CA round trip is not simulated (delay 0), so the numbers are
+#      the overhead of ooepics and pyepics-like callbacks, not of the
+#      network
+#################################################################
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import threading
+import platform
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from BenchPVServer import *
+BenchPVServer.install()
+
+from ooepics.Application import *
+from ooepics.FSMLite import *
+from ooepics.Clock import *
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+MOD_NAME      = "BENCH"
+REPEAT        = 3                       # runs of the rate benchmarks, the best is taken
+
+# =================================
+# collect the metrics
+# =================================
+class BenchResult:
+    def __init__(self):
+        self.metrics = {}               # name -> {"value", "unit", "better", "tol"}
+
+    # better: "higher" or "lower"; tol: relative tolerance, None for the default
+    def add(self, name, value, unit, better = "higher", tol = None):
+        self.metrics[name] = {"value": value, "unit": unit, "better": better, "tol": tol}
+        print("  {:36s} {:14.3f} {}".format(name, value, unit))
+
+# =================================
+# helpers
+# =================================
+def percentile(data, p):
+    if not data:
+        return 0.0
+    data = sorted(data)
+    return data[min(len(data) - 1, int(len(data) * p))]
+
+# best rate of several runs, the noise of the machine only makes it slower
+def best_rate(func, num):
+    best = 0.0
+    for r in range(REPEAT):
+        t0 = time.perf_counter()
+        for i in range(num):
+            func(i)
+        best = max(best, num / (time.perf_counter() - t0))
+    return best
+
+# percentile of the latency of single calls
+def latency(func, num, p):
+    lat = []
+    for i in range(num):
+        t0 = time.perf_counter()
+        func(i)
+        lat.append(time.perf_counter() - t0)
+    return percentile(lat, p)
+
+class BenchJob(Job):
+    def __init__(self, modName, jobName, total):
+        Job.__init__(self, modName, jobName)
+        self.total = total
+        self.cnt   = 0
+        self.done  = threading.Event()
+
+    def execute(self, cmdId = 0, dataBus = None):
+        self.cnt += 1
+        if self.cnt >= self.total:
+            self.done.set()
+        return True
+
+# =================================
+# RemotePV read/write
+# =================================
+def bench_remote_pv(res, num):
+    rpv = RemotePV("BENCH-RPV:VAL")
+    rpv.create()
+    rpv.write(1.0)
+
+    res.add("rpv_read_rate",    best_rate(lambda i: rpv.read(), num),           "ops/s")
+    res.add("rpv_read_p99",     latency(lambda i: rpv.read(), num, 0.99) * 1e6, "us", "lower", 0.5)
+    res.add("rpv_write_rate",   best_rate(lambda i: rpv.write(float(i)), num),  "ops/s")
+    res.add("rpv_write_p99",    latency(lambda i: rpv.write(float(i)), num, 0.99) * 1e6, "us", "lower", 0.5)
+
+    # local PVs are not limited by the admission control
+    lpv = LocalPV(MOD_NAME, "LPV", "VAL", "", "", 1, "ao", "benchmark")
+    lpv.pv.create()
+    res.add("lpv_write_read_rate", best_rate(lambda i: (lpv.write(float(i)), lpv.read()), num), "ops/s")
+
+# =================================
+# RemotePV monitor
+# =================================
+def bench_monitor(res, num):
+    rpv   = RemotePV("BENCH-RPV:MON")
+    lat   = []
+    cnt   = [0]
+    done  = threading.Event()
+    event = threading.Event()
+
+    def mon_cb(args):
+        lat.append(time.time() - args[-1][1])
+        cnt[0] += 1
+        if cnt[0] >= num:
+            done.set()
+        event.set()
+
+    rpv.monitor(mon_cb, meta = True)
+
+    # throughput: burst of updates
+    t0 = time.perf_counter()
+    for i in range(num):
+        rpv.pv.put(i)
+    done.wait(60)
+    dt = time.perf_counter() - t0
+    res.add("mon_event_rate",   cnt[0] / dt,               "events/s")
+
+    # latency: one update after another (no queueing)
+    del lat[:]
+    for i in range(num // 10):
+        event.clear()
+        rpv.pv.put(i)
+        event.wait(1.0)
+    res.add("mon_latency_p50",  percentile(lat, 0.5) * 1e6,  "us", "lower", 1.0)
+    res.add("mon_latency_p99",  percentile(lat, 0.99) * 1e6, "us", "lower", 1.0)
+
+# =================================
+# Application command dispatch (command PV -> queue -> thread -> job)
+# =================================
+def bench_dispatch(res, num):
+    cmds = ["C{}".format(i) for i in range(32)]
+    job  = BenchJob(MOD_NAME, "DISP", num)
+    app  = Application("BENCHAPP", MOD_NAME, queue_depth = len(cmds))
+    app.registJob(job, cmds)
+    for job_config in app.jobList:
+        job_config["cmd"].pv.create()
+    app.letGoing()
+
+    # each round sends every command once, wait until they are executed
+    best = 0.0
+    for r in range(REPEAT):
+        job.cnt = 0
+        job.done.clear()
+        t0 = time.perf_counter()
+        while not job.done.is_set():
+            target = job.cnt + len(cmds)
+            for job_config in app.jobList:
+                job_config["cmd"].write(1)
+            BenchPVServer.flush()
+            while job.cnt < target and not job.done.is_set():
+                time.sleep(0)
+        best = max(best, job.cnt / (time.perf_counter() - t0))
+    res.add("app_dispatch_rate", best,                     "cmds/s")
+
+# =================================
+# RepeatedTimer jitter in fixed rate mode
+# =================================
+def bench_timer(res, duration):
+    timers = []
+    for i in range(10):
+        tm = RepeatedTimer(0.01, lambda: None)
+        tm.set_fixed_rate(True, "skip")
+        timers.append(tm)
+    for tm in timers:
+        tm.start()
+    time.sleep(duration)
+    for tm in timers:
+        tm.stop()
+
+    stats = [tm.get_stat() for tm in timers]
+    res.add("timer_jitter_avg", sum(s["jitter_avg"] for s in stats) / len(stats) * 1e6, "us", "lower", 1.0)
+    res.add("timer_jitter_max", max(s["jitter_max"] for s in stats) * 1e6,              "us", "lower", 2.0)
+    res.add("timer_late_avg",   sum(s["late_avg"] for s in stats) / len(stats) * 1e6,   "us", "lower", 1.0)
+
+# =================================
+# FSMLite ticks with the virtual clock (no waiting for the timers)
+# =================================
+def bench_fsm(res, num_fsm, sim_time):
+    class Toggle:
+        def __init__(self):
+            self.ticks = 0
+
+        def transit(self):
+            self.ticks += 1
+            return 'B' if self.fsm.current_state == 'A' else 'A'
+
+    Clock.set_virtual(True)
+    toggles = []
+    for i in range(num_fsm):
+        tg       = Toggle()
+        state_tr = {s: {'entry': None, 'exit': None, 'transit': tg.transit} for s in ['A', 'B']}
+        tg.fsm   = FSMLite(MOD_NAME, "FSM{}".format(i), timer_intv = 0.1, states = ['A', 'B'], state_tr = state_tr)
+        tg.fsm.letGoing()
+        toggles.append(tg)
+
+    t0 = time.perf_counter()
+    for tg in toggles:
+        tg.fsm.start()
+    Clock.advance(sim_time)
+    dt = time.perf_counter() - t0
+    for tg in toggles:
+        tg.fsm.stop()
+    Clock.set_virtual(False)
+    res.add("fsm_tick_rate",    sum(tg.ticks for tg in toggles) / dt, "ticks/s")
+
+# =================================
+# gen_db
+# =================================
+def bench_gen_db(res, num):
+    for i in range(num):
+        LocalPV(MOD_NAME, "DB{}".format(i // 100), "VAL{}".format(i % 100), "", "mm", 1, "ao", "benchmark record")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        LocalPV.gen_db(os.path.join(tmp, "bench.template"))
+        dt = time.perf_counter() - t0
+    res.add("gen_db_rate",      len(LocalPV.LPVList) / dt, "records/s")
+
+# =================================
+# compare with the baseline, return the list of regressions
+# =================================
+def compare(res, baseline, tol_default):
+    regressions = []
+    print("\n{:36s} {:>14s} {:>14s} {:>9s}".format("metric", "baseline", "current", "change"))
+    for name, m in res.metrics.items():
+        base = baseline["metrics"].get(name)
+        if base is None or base["value"] == 0:
+            print("{:36s} {:>14s} {:14.3f}".format(name, "-", m["value"]))
+            continue
+
+        change = (m["value"] - base["value"]) / base["value"]
+        tol    = m["tol"] if m["tol"] is not None else tol_default
+        worse  = -change if m["better"] == "higher" else change
+        flag   = "  REGRESSION" if worse > tol else ""
+        print("{:36s} {:14.3f} {:14.3f} {:+8.1f}%{}".format(name, base["value"], m["value"], change * 100, flag))
+        if flag:
+            regressions.append(name)
+    return regressions
+
+# =================================
+# main
+# =================================
+def main():
+    parser = argparse.ArgumentParser(description = "ooepics micro-benchmarks")
+    parser.add_argument("--save",      action = "store_true", help = "save the results as baseline")
+    parser.add_argument("--baseline",  default = BASELINE_FILE, help = "baseline file")
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "default relative tolerance")
+    parser.add_argument("--quick",     action = "store_true", help = "fewer iterations")
+    args = parser.parse_args()
+
+    scale = 0.1 if args.quick else 1.0
+    res   = BenchResult()
+
+    print("ooepics micro-benchmarks (python {})".format(platform.python_version()))
+    bench_remote_pv(res, int(50000 * scale))
+    bench_monitor  (res, int(50000 * scale))
+    bench_dispatch (res, int(20000 * scale))
+    bench_timer    (res, max(1.0, 3.0 * scale))
+    bench_fsm      (res, 20, 500.0 * scale)
+    bench_gen_db   (res, int(50000 * scale))
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({"time":     time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "python":   platform.python_version(),
+                       "machine":  platform.node(),
+                       "metrics":  res.metrics}, f, indent = 2)
+        print("\nBaseline saved to " + args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("\nNo baseline found, run with --save to create " + args.baseline)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(res, baseline, args.tolerance)
+    if regressions:
+        print("\n{} regression(s): {}".format(len(regressions), ", ".join(regressions)))
+        return 1
+    print("\nNo regression")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+#################################################################
+# Scale test with synthetic soft IOCs
+# Note:
+#   1. A synthetic soft IOC has "apps" applications, each with "jobs"
+#      command driven jobs. Each job has "lpvs" LocalPVs (ai) and "rpvs"
+#      monitored RemotePVs. There are "fsms" FSMs in addition
+#   2. For each scale factor the soft IOC is built in a new process (the
+#      PV lists are class variables), and the following are measured:
+#       - construction time of the objects
+#       - generateSoftIOC time (files written to a temporary folder)
+#       - connect time (create the RemotePVs and start the monitors)
+#       - letGoing time, resident memory and number of threads
+#   3. The CA is the stand-in BenchPVServer, so the connect time is the
+#      overhead of ooepics and not the CA search
+#   4. The results are printed as a table and written to a CSV file, with
+#      the cost of each PV (slope of the linear fit) for capacity planning
+#   5. Example (20 to 200 thousand PVs):
+#           python benchmark/Bench_Scale.py --scales 1,2,5,10
+#################################################################
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import threading
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+MOD_NAME  = "SCALE"
+METRICS   = [["construct_s",  "construction time",    "s"],
+             ["gen_ioc_s",    "generateSoftIOC time", "s"],
+             ["connect_s",    "connect time",         "s"],
+             ["start_s",      "letGoing time",        "s"],
+             ["rss_mb",       "resident memory",      "MB"],
+             ["threads",      "number of threads",    ""]]
+
+# =================================
+# resident memory of the process, MB
+# =================================
+def get_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0     # peak on Linux, KB
+
+# =================================
+# build and measure one synthetic soft IOC (in the child process)
+# =================================
+def run_point(cfg):
+    sys.path.insert(0, os.path.dirname(BENCH_DIR))
+    sys.path.insert(0, BENCH_DIR)
+    from BenchPVServer import BenchPVServer
+    BenchPVServer.install()
+
+    from ooepics.Application import Application, Job, LocalPV, RemotePV
+    from ooepics.FSMLite import FSMLite
+    from ooepics.FSMExecutor import FSMExecutor
+
+    class SynJob(Job):
+        def __init__(self, modName, jobName, lpvNum, rpvNum):
+            Job.__init__(self, modName, jobName)
+            self.lpvs = [LocalPV(modName, jobName, "VAL{}".format(i), "", "mV", 1, "ai", "synthetic value") for i in range(lpvNum)]
+            self.rpvs = [RemotePV("SYN-{}:IN{}".format(jobName, i)) for i in range(rpvNum)]
+
+        def execute(self, cmdId = 0, dataBus = None):
+            return True
+
+    def transit():
+        return None
+
+    result = {"rss_base_mb": get_rss_mb()}
+
+    # construction
+    t0    = time.perf_counter()
+    apps  = []
+    jobs  = []
+    fsms  = []
+    for a in range(cfg["apps"]):
+        app = Application("APP{}".format(a), MOD_NAME)
+        for j in range(cfg["jobs"]):
+            job = SynJob(MOD_NAME, "A{}J{}".format(a, j), cfg["lpvs"], cfg["rpvs"])
+            app.registJob(job)
+            jobs.append(job)
+        apps.append(app)
+    states   = ['IDLE', 'RUN', 'FAULT']
+    state_tr = {s: {'entry': None, 'exit': None, 'transit': transit} for s in states}
+    for f in range(cfg["fsms"]):
+        fsms.append(FSMLite(MOD_NAME, "FSM{}".format(f), states = states, state_tr = state_tr))
+    result["construct_s"] = time.perf_counter() - t0
+    result["lpvs"]        = len(LocalPV.LPVList)
+    result["rpvs"]        = len(RemotePV.RPVList) - len(LocalPV.LPVList)
+
+    # generate the soft IOC files
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        t0 = time.perf_counter()
+        Application.generateSoftIOC("SCALE-TEST")
+        result["gen_ioc_s"] = time.perf_counter() - t0
+        os.chdir(cwd)
+
+    # connect the PVs and monitor the remote ones
+    t0 = time.perf_counter()
+    RemotePV.connect()
+    for job in jobs:
+        for rpv in job.rpvs:
+            rpv.monitor(None)
+    result["connect_s"] = time.perf_counter() - t0
+
+    # start the threads
+    executor = FSMExecutor(workers = cfg["workers"]) if cfg["workers"] > 0 else None
+    t0 = time.perf_counter()
+    for app in apps:
+        app.letGoing()
+    for fsm in fsms:
+        fsm.letGoing(executor)
+    if executor is not None:
+        executor.letGoing()
+    result["start_s"] = time.perf_counter() - t0
+
+    time.sleep(0.5)
+    result["rss_mb"]  = get_rss_mb()
+    result["threads"] = threading.active_count()
+    return result
+
+# =================================
+# least square fit y = a * x + b
+# =================================
+def linear_fit(xs, ys):
+    n = len(xs)
+    if n < 2:
+        return [0.0, ys[0] if ys else 0.0]
+    mx  = sum(xs) / n
+    my  = sum(ys) / n
+    sxx = sum((x - mx) ** 2 for x in xs)
+    if sxx == 0:
+        return [0.0, my]
+    a = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx
+    return [a, my - a * mx]
+
+# =================================
+# print the curve of a metric with text bars
+# =================================
+def print_curve(points, key, title, unit):
+    vmax = max(p[key] for p in points) or 1.0
+    print("\n{} ({})".format(title, unit if unit else "count"))
+    for p in points:
+        bar = "#" * int(round(50 * p[key] / vmax))
+        print("  {:>8d} PVs {:12.3f} |{}".format(p["pvs"], p[key], bar))
+
+# =================================
+# main
+# =================================
+def main():
+    parser = argparse.ArgumentParser(description = "ooepics scale test with synthetic soft IOCs")
+    parser.add_argument("--apps",    type = int, default = 10,  help = "applications at scale 1")
+    parser.add_argument("--jobs",    type = int, default = 20,  help = "jobs per application")
+    parser.add_argument("--lpvs",    type = int, default = 50,  help = "LocalPVs per job")
+    parser.add_argument("--rpvs",    type = int, default = 50,  help = "RemotePVs per job")
+    parser.add_argument("--fsms",    type = int, default = 20,  help = "FSMs at scale 1")
+    parser.add_argument("--workers", type = int, default = 0,   help = "FSMExecutor workers (0 for a thread per FSM)")
+    parser.add_argument("--scales",  default = "1,2,5",         help = "scale factors of apps and FSMs")
+    parser.add_argument("--csv",     default = "scale_output.csv", help = "CSV file of the results")
+    parser.add_argument("--point",   default = None,            help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # child process: one point, result as the last line
+    if args.point is not None:
+        result = run_point(json.loads(args.point))
+        print("RESULT " + json.dumps(result))
+        return 0
+
+    # parent: run each scale in a new process
+    points = []
+    for scale in [float(s) for s in args.scales.split(",")]:
+        cfg = {"apps":    max(1, int(args.apps * scale)),
+               "jobs":    args.jobs,
+               "lpvs":    args.lpvs,
+               "rpvs":    args.rpvs,
+               "fsms":    int(args.fsms * scale),
+               "workers": args.workers}
+        print("Scale {}: {} apps, {} jobs, {} FSMs ...".format(scale, cfg["apps"], cfg["apps"] * cfg["jobs"], cfg["fsms"]))
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--point", json.dumps(cfg)],
+                              stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+        lines = [l for l in proc.stdout.splitlines() if l.startswith("RESULT ")]
+        if proc.returncode != 0 or not lines:
+            print(proc.stdout[-2000:])
+            print("ERROR: scale {} failed!".format(scale))
+            return 1
+
+        point = json.loads(lines[-1][7:])
+        point.update({"scale": scale, "apps": cfg["apps"], "fsms": cfg["fsms"]})
+        point["pvs"] = point["lpvs"] + point["rpvs"]
+        points.append(point)
+
+    # table
+    keys = ["scale", "apps", "fsms", "lpvs", "rpvs"] + [m[0] for m in METRICS]
+    print("\n" + " ".join("{:>12s}".format(k) for k in keys))
+    for p in points:
+        print(" ".join("{:12.3f}".format(p[k]) if isinstance(p[k], float) else "{:12d}".format(p[k]) for k in keys))
+
+    # curves and the cost of each PV
+    for key, title, unit in METRICS:
+        print_curve(points, key, title, unit)
+    print("\nLinear fit over the number of PVs:")
+    xs = [p["pvs"] for p in points]
+    for key, title, unit in METRICS:
+        a, b = linear_fit(xs, [p[key] for p in points])
+        print("  {:22s} {:12.6f} {} per 1000 PVs {:+.3f} {}".format(title, a * 1000, unit, b, unit))
+
+    with open(args.csv, "w") as f:
+        f.write(",".join(keys) + "\n")
+        for p in points:
+            f.write(",".join(str(p[k]) for k in keys) + "\n")
+    print("\nResults written to " + args.csv)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
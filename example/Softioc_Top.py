@@ -86,6 +86,7 @@ class Softioc_Top:
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     def run(self):
         self.appTest.letGoing()             # each application is driven by a thread
+        self.srvLog.letGoing()              # publish the messages
         self.fsmTrafficLight.letGoing()     # each FSM is driven by a thread
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
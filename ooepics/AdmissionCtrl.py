@@ -0,0 +1,171 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Process-wide admission control for job executions and CA operations
+# Note:
+#   1. Disabled by default, enable it with AdmissionCtrl.config()
+#   2. Command driven jobs wait for a free slot when max jobs are in
+#      flight. Periodic jobs are never blocked but shed: when the load
+#      reaches shed_level, the ones with priority <= shed_priority are
+#      skipped, when the load reaches 1, all periodic jobs are skipped
+#   3. CA operations (RemotePV read/write, not the local PVs) wait for a
+#      free slot up to their timeout, otherwise they fail
+#   4. The load is the max ratio of jobs or CA operations in flight to
+#      their limits
+# -------------------------------------------------
+import threading
+import time
+
+from ooepics.RepeatedTimer import *
+
+class AdmissionCtrl:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    enabled         = False
+    max_jobs        = 0             # max jobs in flight, 0 for no limit
+    max_ca_ops      = 0             # max CA operations in flight, 0 for no limit
+    shed_level      = 0.8           # load to start shedding low priority periodic jobs
+    shed_priority   = 0             # periodic jobs with priority <= this are shed first
+
+    cond            = threading.Condition()
+    jobs_in_flight  = 0
+    ca_in_flight    = 0
+    cnt_shed        = 0             # periodic jobs skipped
+    cnt_job_wait    = 0             # jobs waited for a free slot
+    cnt_ca_reject   = 0             # CA operations failed without a free slot
+
+    lpvs            = None          # local PVs of the state
+    timer           = None          # timer to publish the state
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # configure and enable the admission control
+    #   modName     - string, module name of the local PVs (None for no PVs)
+    #   pub_intv    - float, interval to publish the state, s
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def config(cls, modName = None, max_jobs = 0, max_ca_ops = 0, shed_level = 0.8, shed_priority = 0, pub_intv = 1.0):
+        with cls.cond:
+            cls.max_jobs      = max(0, max_jobs)
+            cls.max_ca_ops    = max(0, max_ca_ops)
+            cls.shed_level    = shed_level
+            cls.shed_priority = shed_priority
+            cls.enabled       = True
+            cls.cond.notify_all()
+
+        # create the local PVs (import here, LocalPV depends on RemotePV which uses this class)
+        if (modName is not None) and (cls.lpvs is None):
+            from ooepics.LocalPV import LocalPV
+            cls.lpvs = {"jobs":   LocalPV(modName, "ADMCTRL", "JOBS-IN-FLIGHT", "", "", 1, "longin", "jobs in flight"),
+                        "ca":     LocalPV(modName, "ADMCTRL", "CA-IN-FLIGHT",   "", "", 1, "longin", "CA operations in flight"),
+                        "load":   LocalPV(modName, "ADMCTRL", "LOAD",           "", "", 1, "ai",     "load of jobs and CA operations"),
+                        "ok":     LocalPV(modName, "ADMCTRL", "LOAD-OK",        "", "", 1, "bi",     "load below shedding level"),
+                        "shed":   LocalPV(modName, "ADMCTRL", "SHED-CNT",       "", "", 1, "longin", "periodic jobs shed"),
+                        "wait":   LocalPV(modName, "ADMCTRL", "JOB-WAIT-CNT",   "", "", 1, "longin", "jobs waited for slot"),
+                        "reject": LocalPV(modName, "ADMCTRL", "CA-REJECT-CNT",  "", "", 1, "longin", "CA operations rejected")}
+            cls.timer = RepeatedTimer(pub_intv, cls.publish)
+            cls.timer.start()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the load (must be called with the lock)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def _load(cls):
+        load = 0.0
+        if cls.max_jobs > 0:
+            load = max(load, cls.jobs_in_flight / cls.max_jobs)
+        if cls.max_ca_ops > 0:
+            load = max(load, cls.ca_in_flight / cls.max_ca_ops)
+        return load
+
+    @classmethod
+    def load(cls):
+        with cls.cond:
+            return cls._load()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # admit a job execution, return False if the job is shed. Call
+    # job_exit() after the execution if admitted
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def job_enter(cls, priority = 0, periodic = False):
+        if not cls.enabled:
+            return True
+
+        with cls.cond:
+            load = cls._load()
+            if periodic:
+                if load >= 1.0 or (load >= cls.shed_level and priority <= cls.shed_priority):
+                    cls.cnt_shed += 1
+                    return False
+            elif cls.max_jobs > 0 and cls.jobs_in_flight >= cls.max_jobs:
+                cls.cnt_job_wait += 1
+                while cls.enabled and cls.max_jobs > 0 and cls.jobs_in_flight >= cls.max_jobs:
+                    cls.cond.wait()
+            cls.jobs_in_flight += 1
+            return True
+
+    @classmethod
+    def job_exit(cls):
+        with cls.cond:
+            if cls.jobs_in_flight > 0:
+                cls.jobs_in_flight -= 1
+            cls.cond.notify_all()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # admit a CA operation, wait up to timeout for a free slot. Return
+    # False if rejected. Call ca_exit() after the operation if admitted
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def ca_enter(cls, timeout = 1.0):
+        if not cls.enabled:
+            return True
+
+        with cls.cond:
+            if cls.max_ca_ops > 0 and cls.ca_in_flight >= cls.max_ca_ops:
+                deadline = time.monotonic() + timeout
+                while cls.ca_in_flight >= cls.max_ca_ops:
+                    remain = deadline - time.monotonic()
+                    if remain <= 0 or not cls.enabled:
+                        cls.cnt_ca_reject += 1
+                        return False
+                    cls.cond.wait(remain)
+            cls.ca_in_flight += 1
+            return True
+
+    @classmethod
+    def ca_exit(cls):
+        with cls.cond:
+            if cls.ca_in_flight > 0:
+                cls.ca_in_flight -= 1
+            cls.cond.notify_all()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the state as a dict
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def get_stat(cls):
+        with cls.cond:
+            load = cls._load()
+            return {"jobs":   cls.jobs_in_flight,
+                    "ca":     cls.ca_in_flight,
+                    "load":   load,
+                    "ok":     0 if load >= cls.shed_level else 1,
+                    "shed":   cls.cnt_shed,
+                    "wait":   cls.cnt_job_wait,
+                    "reject": cls.cnt_ca_reject}
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # write the state to the local PVs (only the changed ones)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def publish(cls):
+        if cls.lpvs is None:
+            return
+
+        stat = cls.get_stat()
+        for key, lpv in cls.lpvs.items():
+            lpv.write_changed(stat[key])
@@ -16,6 +16,15 @@ import traceback
 from ooepics.RepeatedTimer import *
 from ooepics.LocalPV import *
 from ooepics.Job import *
+from ooepics.JobQueue import *
+from ooepics.JobStat import *
+from ooepics.JobCache import *
+from ooepics.Pipeline import *
+from ooepics.CorrTrigger import *
+from ooepics.AdmissionCtrl import *
+from ooepics.ExcAggregator import *
+from ooepics.Tracer import *
+from ooepics.Watchdog import *
 
 # =================================
 # function for the thread
@@ -30,7 +39,7 @@ def AppThreadFunc(app):
             mutex  = jobEnt[2]
 
             if mutex is not None: mutex.acquire()
-            job.execute(cmdId, None)
+            app.executeJob(job, cmdId, jobEnt[6], jobEnt[5], jobEnt[3])
             if mutex is not None: mutex.release()
 
             app.msgQ.task_done()
@@ -38,12 +47,9 @@ def AppThreadFunc(app):
             if mutex is not None:
                 if mutex.locked(): mutex.release()
 
-            print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
-            print("Exception in job execution: " + jobEnt[0].jobName + "\n")
-            excInfo = sys.exc_info()
-            traceback.print_tb(excInfo[2])
-            print(excInfo)
-            print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n")
+            app.msgQ.task_done()
+
+            ExcAggregator.report("job " + jobEnt[0].jobName)
         
 # callback function for commands executing jobs
 def JobCmdCbFunc(cbArgs):
@@ -53,19 +59,37 @@ def JobCmdCbFunc(cbArgs):
     cmdId   = cbArgs[1]["cid"]              # id of the command
     extCmd  = cbArgs[1]["extpv"]            # if it is external command or not
     mutex   = cbArgs[1]["mutex"]            # mutex for job execution
+    prio    = cbArgs[1]["prio"]             # priority of the command
     cmdVal  = cbArgs[-1]                    # command PV value
 
-    if extCmd:
-        if app.msgQ.empty():                # if there is one command waiting, do not put new
-            app.msgQ.put([job, cmdId, mutex])
-    else:
-        if cmdVal == 1:
-            if not app.msgQ.full():
-                app.msgQ.put([job, cmdId, mutex])
+    # external trigger always queue the command, command PV only when set to 1
+    if extCmd or cmdVal == 1:
+        result, evicted = app.msgQ.put(job, cmdId, mutex, prio)
+        if result == JobQueue.MERGED:
+            app.getJobStat(job).count_merge()
+        elif result == JobQueue.DROPPED:
+            app.getJobStat(job).count_drop()
+        if evicted is not None:
+            app.getJobStat(evicted[0]).count_drop()
+
+# main function of the thread executing the periodic jobs
+def AppPeriodicThreadFunc(app):
+    while True:
+        jobEnt = app.periodicQ.get()
+        pjob   = jobEnt[6]                  # config of the periodic job (the job gets no dataBus)
+        app.executePeriodicJob(pjob, jobEnt[5])
+        app.periodicQ.task_done()
+        app.periodicJobDone(pjob)
 
 # callback function for timer-driven jobs
-def RunPeriodicJob(job):
-    job.execute(0, None)                    # execute the job, no subcommand supported
+def RunPeriodicJob(job, app = None, pjob = None):
+    try:
+        if app is None:
+            job.execute(0, None)            # execute the job, no subcommand supported
+        else:                               # queued to the periodic job thread of the app
+            app.queuePeriodicJob(pjob)
+    except:
+        ExcAggregator.report("job " + job.jobName)
 
 # =================================
 # class for application 
@@ -79,8 +103,14 @@ class Application:
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # create the object
+    #
+    # inputs:
+    #   appName     - string, application name
+    #   modName     - string, module name
+    #   queue_depth - int, max number of commands waiting for execution
+    #   stat_intv   - float, interval to publish the job statistics, s
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
-    def __init__(self, appName, modName):
+    def __init__(self, appName, modName, queue_depth = 2, stat_intv = 1.0):
         # save the input info 
         self.appName = appName
         self.modName = modName
@@ -88,22 +118,120 @@ class Application:
         # create the list to store the jobs and command PVs
         self.jobList         = []       
         self.periodicJobList = []
+        self.pipelineList    = []
+        self.corrTrigList    = []
+        self.jobStat         = {}       # statistics of jobs, key is the job name
+        self.jobCache        = {}       # result cache of jobs, key is the job name
                            
-        # message queue
-        self.msgQ = queue.Queue(2)
+        # message queue (commands with priority and coalescing)
+        self.msgQ = JobQueue(queue_depth)
+
+        # queue of the periodic jobs (created in letGoing, none with the virtual clock)
+        self.periodicQ    = None
+        self.periodicLock = threading.Lock()
+
+        # timer to publish the job statistics (will be started later)
+        self.statTimer = RepeatedTimer(stat_intv, self.publishStat)
+
+        # PVs of the watchdog
+        self.wdogOwner = Watchdog.add_owner(self.modName, self.appName)
 
         # add to the application list
         Application.appList.append(self)
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the statistics object of a job (created if not exist)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~       
+    def getJobStat(self, job):
+        if job.jobName not in self.jobStat:
+            self.jobStat[job.jobName] = JobStat(self.modName, job.jobName)
+        return self.jobStat[job.jobName]
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # declare the input PVs of a job. The job will be skipped if its inputs
+    # are not changed since an earlier execution (see JobCache)
+    #   inPVs:      list of LocalPV/RemotePV, inputs of the job
+    #   outPVs:     list of LocalPV, outputs restored from the cache
+    #   mode:       "timestamp" or "value", how to compare the inputs
+    #   cache_size: max number of results in the cache (0 to disable)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~       
+    def setJobInputs(self, job, inPVs, outPVs = [], mode = "timestamp", cache_size = 16):
+        # check the input
+        if (not job) or (not isinstance(inPVs, list)) or len(inPVs) < 1:
+            print("Failed to set job inputs!")
+            return
+
+        self.jobCache[job.jobName] = JobCache(inPVs, outPVs, mode, cache_size)
+        self.getJobStat(job).set_cache(self.jobCache[job.jobName])
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # execute a job with the statistics, the result cache and the admission
+    # control, return the return value of execute(). The cache is only used
+    # when no dataBus. A shed periodic job is counted as dropped
+    #   tPut:       time when the command was put to the queue (time.monotonic())
+    #   priority:   priority of the job for the admission control
+    #   periodic:   True for periodic jobs, which are shed under overload
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~       
+    def executeJob(self, job, cmdId = 0, dataBus = None, tPut = None, priority = 0, periodic = False):
+        stat  = self.getJobStat(job)
+        cache = self.jobCache.get(job.jobName) if dataBus is None else None
+
+        # skip the execution if the inputs are not changed
+        key = None
+        if cache is not None:
+            key = cache.input_key(cmdId)
+            hit, ret = cache.lookup(key)
+            if hit:
+                return ret
+
+        # admission control
+        if not AdmissionCtrl.job_enter(priority, periodic):
+            stat.count_drop()
+            return None
+
+        # execute the job
+        tStart = time.monotonic()
+        status = False
+        wdog   = Watchdog.begin(self.wdogOwner, "job " + job.jobName, "job") if Watchdog.enabled else None
+        try:
+            ret    = job.execute(cmdId, dataBus)
+            status = JobExeStatus(ret)
+        finally:
+            Watchdog.end(wdog)
+            tEnd = time.monotonic()
+            AdmissionCtrl.job_exit()
+            stat.count_exe(None if tPut is None else tStart - tPut, tEnd - tStart, status)
+            if Tracer.enabled:
+                Tracer.add_span(job.jobName, "job", tStart, tEnd, {"cmdId": cmdId, "status": status})
+                if tPut is not None:
+                    Tracer.add_async("wait " + job.jobName, "queue", tPut, tStart)
+
+        if (cache is not None) and status:
+            cache.store(key, ret)
+        return ret
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # publish the statistics of all jobs to local PVs
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~       
+    def publishStat(self):
+        for stat in list(self.jobStat.values()):
+            stat.publish()
+        for trig in self.corrTrigList:
+            trig.publish()
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # register a job object and create the command PV
+    #   priority: int or list of int (one for each command), commands
+    #             with larger value will be executed first
     # ~~~~~~~~~~~~~~~~~~~~~~~~~       
-    def registJob(self, job, cmdStr = "EXE", mutex = None):
+    def registJob(self, job, cmdStr = "EXE", mutex = None, priority = 0):
         # check the input
         if not job:
             print("Failed to regist job!")
             return
 
+        self.getJobStat(job)
+
         # there is only one command for the job
         if isinstance(cmdStr, str):
             self.jobList.append({"job": job,
@@ -117,12 +245,19 @@ class Application:
                                                 "command to execute job"),
                                  "cid": 0,
                                  "extpv": False,
-                                 "mutex": mutex})
+                                 "mutex": mutex,
+                                 "prio": priority if not isinstance(priority, list) else priority[0]})
 
         # there are multiple commands for the job
         elif isinstance(cmdStr, list):
             cmdId = 0
             for cmd in cmdStr:               
+                # priority of this command
+                if isinstance(priority, list):
+                    prio = priority[cmdId] if cmdId < len(priority) else 0
+                else:
+                    prio = priority
+
                 self.jobList.append({"job": job,
                                      "cmd": LocalPV(self.modName,
                                                     job.jobName,
@@ -134,13 +269,14 @@ class Application:
                                                     "command to execute job"),
                                      "cid": cmdId,
                                      "extpv": False,
-                                     "mutex": mutex})
+                                     "mutex": mutex,
+                                     "prio": prio})
                 cmdId = cmdId + 1
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # register a job object with external trigger PV
     # ~~~~~~~~~~~~~~~~~~~~~~~~~       
-    def registJobExtTrigPV(self, job, extPVList = [], mutex = None):
+    def registJobExtTrigPV(self, job, extPVList = [], mutex = None, priority = 0):
         # check the input
         if not job:
             print("Failed to register job with external trigger PV!")
@@ -150,40 +286,169 @@ class Application:
             print("Failed to register job with external trigger PV!")
             return
 
+        self.getJobStat(job)
+
         cmdId = 0
         for extpv in extPVList:
             self.jobList.append({"job":   job,
                                  "cmd":   extpv,
                                  "cid":   cmdId,
                                  "extpv": True,
-                                 "mutex": mutex})
+                                 "mutex": mutex,
+                                 "prio":  priority})
             cmdId = cmdId + 1
                 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # register a job triggered by the monitor events of several PVs with 
+    # matched timestamps (see CorrTrigger). The job gets the aligned values
+    # as dataBus: {"timestamp": ts, "values": {pvName: value}}
+    #   tolerance:  max difference of the timestamps, s
+    #   bufDepth:   max number of events buffered for each PV
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~       
+    def registJobCorrTrigPV(self, job, pvList = [], tolerance = 0.001, bufDepth = 10, mutex = None, priority = 0):
+        # check the input
+        if (not job) or (not isinstance(pvList, list)) or len(pvList) < 1:
+            print("Failed to register job with correlated trigger PVs!")
+            return None
+
+        self.getJobStat(job)
+        trig = CorrTrigger(self, job, pvList, tolerance, bufDepth, 0, mutex, priority)
+        self.corrTrigList.append(trig)
+        return trig
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # register a job executed periodicly. This is a special case, 
-    # the job will not be added to the list, but will be executed by a timer 
+    # the job will not be added to the list, but will be queued by a timer
+    # and executed by the periodic job thread of the application
+    #   fixed_rate: True to execute on a fixed rate grid (see RepeatedTimer),
+    #               periods shorter than 0.1 s are only allowed in this mode
+    #   overrun:    overrun policy for fixed rate, what to do with the ticks
+    #               when the job is still waiting or running: "skip" drops
+    #               them (counted in DROP-CNT), "merge" executes the job once
+    #               more after it finishes (further ticks counted in 
+    #               MERGE-CNT), "catchup" executes the job once for each tick.
+    #               In fixed delay mode the timer is re-armed when the job
+    #               finishes, so the period is the interval plus the waiting
+    #               and execution time
+    #   priority:   jobs with lower priority are shed first under overload
     # ~~~~~~~~~~~~~~~~~~~~~~~~~       
-    def registJobPeriodic(self, job, period_s = 1.0):
+    def registJobPeriodic(self, job, period_s = 1.0, fixed_rate = False, overrun = "skip", priority = 0):
         # check the input
         if not job:
             print("Failed to regist periodic job!")
             return
 
         # limit the period
-        if period_s < 0.1:
+        min_period = RepeatedTimer.MIN_INTV_FR if fixed_rate else RepeatedTimer.MIN_INTV
+        if period_s < min_period:
             period_s = 1.0
         
         # save to list
-        self.periodicJobList.append({"job":    job,
-                                     "period": period_s,
-                                     "timer":  None})       # timer is defined below
+        self.getJobStat(job)
+        self.periodicJobList.append({"job":     job,
+                                     "period":  period_s,
+                                     "fixed":   fixed_rate,
+                                     "overrun": overrun,
+                                     "prio":    priority,
+                                     "busy":    False,      # waiting or running
+                                     "missed":  0,          # ticks to execute after it finishes
+                                     "vtick":   0.0,        # last tick handled by the job (virtual clock)
+                                     "timer":   None})      # timer is defined below
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # queue a periodic job at a tick of its timer (called by the timer)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def queuePeriodicJob(self, pjob):
+        with self.periodicLock:
+            if pjob["busy"]:
+                if not pjob["fixed"] or pjob["overrun"] == "skip":
+                    self.getJobStat(pjob["job"]).count_drop()
+                elif pjob["overrun"] == "merge" and pjob["missed"] > 0:
+                    self.getJobStat(pjob["job"]).count_merge()
+                elif pjob["missed"] < RepeatedTimer.MAX_CATCHUP:
+                    pjob["missed"] += 1
+                else:
+                    self.getJobStat(pjob["job"]).count_drop()
+                return
+            pjob["busy"] = True
+        self._dispatchPeriodicJob(pjob)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # a periodic job finished, queue it again for the missed ticks (fixed
+    # rate) or re-arm its timer (fixed delay)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def periodicJobDone(self, pjob):
+        with self.periodicLock:
+            again = pjob["missed"] > 0
+            if again:
+                pjob["missed"] -= 1
+            else:
+                pjob["busy"] = False
+        if again:
+            self._dispatchPeriodicJob(pjob)
+        elif not pjob["fixed"] and not pjob["timer"].cmd_stop:
+            pjob["timer"].start()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # execute a periodic job (called by the periodic job thread, or by the
+    # timer with the virtual clock), periodicJobDone() is called after it
+    #   tPut:       time when the job was queued, None if not queued
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def executePeriodicJob(self, pjob, tPut = None):
+        try:
+            self.executeJob(pjob["job"], 0, None, tPut, pjob["prio"], periodic = True)
+        except:
+            ExcAggregator.report("job " + pjob["job"].jobName)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # queue a periodic job to the periodic job thread. If the clock was 
+    # virtual in letGoing (no thread), execute it in the calling timer 
+    # callback, so it follows Clock.advance() deterministically. The ticks
+    # of the fixed rate grid passed during the execution are then handled
+    # as if they came while the job was running in the thread
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _dispatchPeriodicJob(self, pjob):
+        if self.periodicQ is not None:
+            self.periodicQ.put(pjob["job"], 0, None, pjob["prio"], pjob)
+            return
+
+        self.executePeriodicJob(pjob)
+        if pjob["fixed"]:
+            tm            = pjob["timer"]
+            pjob["vtick"] = max(pjob["vtick"], tm.next_time)
+            while pjob["vtick"] + tm.interval < Clock.monotonic():     # a tick at now is fired by the timer
+                pjob["vtick"] += tm.interval
+                self.queuePeriodicJob(pjob)
+        self.periodicJobDone(pjob)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # register a pipeline of jobs, the dataBus returned by a job is passed
+    # to the next one (see Pipeline). The command PVs are named with the 
+    # pipeline name, the command id is passed to all stages
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~       
+    def registPipeline(self, pplName, stages, cmdStr = "EXE", queue_depth = 2):
+        # check the input
+        if (not isinstance(stages, list)) or len(stages) < 1:
+            print("Failed to regist pipeline!")
+            return None
+
+        ppl = Pipeline(self, pplName, stages, queue_depth)
+
+        # create the command PVs
+        cmdList = [cmdStr] if isinstance(cmdStr, str) else cmdStr
+        cmdPVs  = []
+        for cmd in cmdList:
+            cmdPVs.append(LocalPV(self.modName, pplName, "CMD-"+cmd, "", "", 1, "bo", "command to execute pipeline"))
+
+        self.pipelineList.append({"ppl": ppl, "cmd": cmdPVs})
+        return ppl
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # start the thread for job execution 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~       
     def letGoing(self):
         # start the thread with trigger PVs
-        if len(self.jobList) > 0:
+        if len(self.jobList) > 0 or len(self.corrTrigList) > 0:
             # start the thread for this application
             self.appThread = threading.Thread(target = AppThreadFunc,
                                               args   = (self,),
@@ -198,12 +463,41 @@ class Application:
                 cbArgList.append(self)
                 cbArgList.append(job_config)
                 job_config["cmd"].monitor(JobCmdCbFunc, cbArgList)
+
+            # monitor the correlated trigger PVs
+            for trig in self.corrTrigList:
+                trig.letGoing()
         
-        # start the periodic timers
+        # start the pipelines and monitor their command PVs
+        for ppl_config in self.pipelineList:
+            ppl_config["ppl"].letGoing()
+            for cmdId, cmdPV in enumerate(ppl_config["cmd"]):
+                cmdPV.monitor(PipelineCmdCbFunc, [ppl_config["ppl"], cmdId])
+
+        # start the thread of the periodic jobs and the timers (the timers 
+        # only queue the jobs, so the scheduler workers are never blocked).
+        # With the virtual clock, the jobs are executed by the timers
         if len(self.periodicJobList) > 0:
+            if not Clock.virtual:
+                self.periodicQ      = JobQueue(len(self.periodicJobList))
+                self.periodicThread = threading.Thread(target = AppPeriodicThreadFunc,
+                                                       args   = (self,),
+                                                       daemon = True,
+                                                       name   = "TRD-" + self.appName + "-PJOB")
+                print("Thread " + self.periodicThread.name + " started.")
+                self.periodicThread.start()
+
             for pjob in self.periodicJobList:
-                pjob["timer"] = RepeatedTimer(pjob["period"], RunPeriodicJob, pjob["job"])
+                pjob["timer"] = RepeatedTimer(pjob["period"], RunPeriodicJob, pjob["job"], self, pjob)
+                if pjob["fixed"]:
+                    pjob["timer"].set_fixed_rate(True, "skip")
+                else:
+                    pjob["timer"].auto_rearm = False    # re-armed when the job finishes
                 pjob["timer"].start()
+
+        # start publishing the job statistics
+        if len(self.jobStat) > 0:
+            self.statTimer.start()
   
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # generate necessary files 
@@ -312,6 +606,7 @@ def exit():
         for tm in app.periodicJobList:
             if not tm["timer"] == None:
                 tm["timer"].stop()
+        app.statTimer.stop()
     sys.exit()
 
 def quit():
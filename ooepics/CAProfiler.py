@@ -0,0 +1,192 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Profiler of the CA operations of RemotePV and LocalPV
+# Note:
+#   1. CAProfiler.enable() switches the profiling on and off at runtime,
+#      the counters are kept until reset(). RemotePV takes the latency
+#      timestamps only while it is on
+#   2. For each PV, the gets, puts and monitor callbacks are counted with
+#      the histograms of their latency (for monitors the time of the user
+#      callback). Failed gets/puts (timeout, not connected or rejected by
+#      the admission control) are counted separately. Gets of monitored
+#      values are only counted, they are not CA operations
+#   3. The totals of each IOC are summed by the host of the PVs
+#   4. Use dump_json()/dump_csv() or print_top() in the python shell
+# -------------------------------------------------
+import threading
+import time
+import bisect
+import json
+import csv
+
+# =================================
+# statistics of an operation type
+# =================================
+class CAOpStat:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    EDGES = [1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 0.1, 0.3, 1.0, 3.0, 10.0]   # upper edges of the bins, s
+
+    def __init__(self):
+        self.cnt    = 0                                 # number of operations
+        self.fail   = 0                                 # number of failed operations
+        self.total  = 0.0                               # total latency, s
+        self.max    = 0.0                               # max latency, s
+        self.hist   = [0] * (len(CAOpStat.EDGES) + 1)   # last bin for overflow
+
+    def add(self, latency, ok = True):
+        self.cnt   += 1
+        self.total += latency
+        self.max    = max(self.max, latency)
+        self.hist[bisect.bisect_left(CAOpStat.EDGES, latency)] += 1
+        if not ok:
+            self.fail += 1
+
+    def merge(self, other):
+        self.cnt   += other.cnt
+        self.fail  += other.fail
+        self.total += other.total
+        self.max    = max(self.max, other.max)
+        self.hist   = [a + b for a, b in zip(self.hist, other.hist)]
+
+    def to_dict(self):
+        return {"cnt":  self.cnt,
+                "fail": self.fail,
+                "avg":  self.total / self.cnt if self.cnt > 0 else 0.0,
+                "max":  self.max,
+                "hist": list(self.hist)}
+
+# =================================
+# class of the profiler
+# =================================
+class CAProfiler:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    OPS         = ["get", "put", "mon"]
+
+    enabled     = False
+    lock        = threading.Lock()
+    pvs         = {}                    # pvName -> {"host", "local", "cached", "get", "put", "mon"}
+    start_time  = time.time()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # enable/disable the profiler, reset the statistics
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def enable(cls, enabled = True):
+        cls.enabled = enabled
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.pvs.clear()
+            cls.start_time = time.time()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # record an operation (called by RemotePV)
+    #   rpv         - object of RemotePV
+    #   op          - string, "get", "put" or "mon"
+    #   latency     - float, time of the operation, s
+    #   ok          - bool, operation successful or not
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def record(cls, rpv, op, latency, ok = True):
+        with cls.lock:
+            rec = cls._get_rec(rpv)
+            rec[op].add(latency, ok)
+
+    @classmethod
+    def record_cached(cls, rpv):
+        with cls.lock:
+            cls._get_rec(rpv)["cached"] += 1
+
+    @classmethod
+    def _get_rec(cls, rpv):
+        rec = cls.pvs.get(rpv.pvName)
+        if rec is None:
+            rec = {"host": None, "local": rpv.local, "cached": 0}
+            for op in CAProfiler.OPS:
+                rec[op] = CAOpStat()
+            cls.pvs[rpv.pvName] = rec
+        if rec["host"] is None and rpv.pv is not None:
+            rec["host"] = getattr(rpv.pv, "host", None)
+        return rec
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the statistics as dicts
+    #   by          - string, "pv" for each PV, "host" for the totals of IOCs
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def get_stat(cls, by = "pv"):
+        result = {}
+        with cls.lock:
+            if by == "host":
+                totals = {}
+                for rec in cls.pvs.values():
+                    host = "local" if rec["local"] else str(rec["host"])
+                    tot  = totals.setdefault(host, {"pvs": 0, "cached": 0, "get": CAOpStat(), "put": CAOpStat(), "mon": CAOpStat()})
+                    tot["pvs"]    += 1
+                    tot["cached"] += rec["cached"]
+                    for op in CAProfiler.OPS:
+                        tot[op].merge(rec[op])
+                for host, tot in totals.items():
+                    result[host] = {"pvs": tot["pvs"], "cached": tot["cached"]}
+                    for op in CAProfiler.OPS:
+                        result[host][op] = tot[op].to_dict()
+            else:
+                for pvName, rec in cls.pvs.items():
+                    result[pvName] = {"host": rec["host"], "local": rec["local"], "cached": rec["cached"]}
+                    for op in CAProfiler.OPS:
+                        result[pvName][op] = rec[op].to_dict()
+        return result
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # dump the statistics to a JSON file (return the string if no file)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def dump_json(cls, fileName = None):
+        data = {"start_time": cls.start_time,
+                "dump_time":  time.time(),
+                "bin_edges":  CAOpStat.EDGES,
+                "pvs":        cls.get_stat("pv"),
+                "hosts":      cls.get_stat("host")}
+        if fileName is None:
+            return json.dumps(data, indent = 2)
+        with open(fileName, "w") as f:
+            json.dump(data, f, indent = 2)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # dump the statistics to a CSV file, one line per PV (or host)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def dump_csv(cls, fileName, by = "pv"):
+        stat   = cls.get_stat(by)
+        header = [by, "cached"]
+        for op in CAProfiler.OPS:
+            header += [op + "_cnt", op + "_fail", op + "_avg", op + "_max"]
+
+        with open(fileName, "w", newline = "") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for name, rec in stat.items():
+                row = [name, rec["cached"]]
+                for op in CAProfiler.OPS:
+                    row += [rec[op]["cnt"], rec[op]["fail"], rec[op]["avg"], rec[op]["max"]]
+                writer.writerow(row)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # print the PVs with most operations (key: "get", "put" or "mon")
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def print_top(cls, num = 20, key = "get"):
+        stat = cls.get_stat("pv")
+        rank = sorted(stat.items(), key = lambda kv: kv[1][key]["cnt"], reverse = True)[:num]
+        print("{:50s} {:>8s} {:>6s} {:>12s} {:>12s}".format("PV", key, "fail", "avg (s)", "max (s)"))
+        for pvName, rec in rank:
+            print("{:50s} {:8d} {:6d} {:12.6f} {:12.6f}".format(pvName, rec[key]["cnt"], rec[key]["fail"], rec[key]["avg"], rec[key]["max"]))
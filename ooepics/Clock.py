@@ -0,0 +1,102 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Clock used by the timers and FSMs
+# Note:
+#   1. By default the wall clock (time.time) and the monotonic clock
+#      (time.monotonic) are used
+#   2. In virtual mode, the time only moves with advance(). The timers
+#      due in the advanced time are executed one after another in the
+#      calling thread in the order of their deadlines, and the clock is
+#      set to the deadline of each timer before executing it. So the
+#      simulation runs as fast as possible and is deterministic
+#   3. The FSMs and the periodic jobs of the Application started in
+#      virtual mode are executed in the timer callbacks (see FSMExecutor 
+#      with 0 workers), the command driven jobs of the Application are 
+#      still executed by its thread
+#   4. When leaving virtual mode, the pending timers are shifted by the
+#      difference of the real and the virtual monotonic time, so they keep
+#      their remaining time instead of firing in a burst or stalling
+# -------------------------------------------------
+import threading
+import time
+
+class Clock:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    virtual     = False                 # virtual mode or not
+    lock        = threading.Lock()
+    v_mono      = 0.0                   # virtual monotonic time, s
+    v_offset    = 0.0                   # wall time minus monotonic time in virtual mode, s
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the time
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def time(cls):
+        if cls.virtual:
+            return cls.v_offset + cls.v_mono
+        return time.time()
+
+    @classmethod
+    def monotonic(cls):
+        if cls.virtual:
+            return cls.v_mono
+        return time.monotonic()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # switch the virtual mode
+    #   enable      - bool, True for virtual mode
+    #   start_time  - float, wall time (s since epoch) at the start, None
+    #                 to continue from the current time
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def set_virtual(cls, enable = True, start_time = None):
+        from ooepics.TimerScheduler import TimerScheduler
+
+        with TimerScheduler.cond:
+            with cls.lock:
+                # the monotonic time continues, so the scheduled timers are kept
+                delta = 0.0
+                if enable and not cls.virtual:
+                    cls.v_mono   = time.monotonic()
+                    cls.v_offset = time.time() - cls.v_mono
+                if enable and start_time is not None:
+                    cls.v_offset = start_time - cls.v_mono
+                if not enable and cls.virtual:
+                    delta = time.monotonic() - cls.v_mono
+                cls.virtual = enable
+
+            # rebase the timers to the real time and wake up the scheduler
+            # thread to follow the new clock
+            if delta != 0.0:
+                TimerScheduler._shift(delta)
+            TimerScheduler.cond.notify_all()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # advance the virtual time and execute the timers due, return the
+    # number of timers executed
+    #   dt          - float, time to advance, s (None to run until no timer
+    #                 is scheduled, limited by max_steps)
+    #   max_steps   - int, max number of timers to execute (None for no limit)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def advance(cls, dt = None, max_steps = None):
+        from ooepics.TimerScheduler import TimerScheduler
+
+        if not cls.virtual:
+            print("ERROR: Clock.advance() only works in virtual mode!")
+            return 0
+        return TimerScheduler.run_virtual(dt, max_steps)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # set the virtual time (used by the scheduler), never goes back
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def _set_virtual_time(cls, t):
+        with cls.lock:
+            cls.v_mono = max(cls.v_mono, t)
@@ -0,0 +1,141 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Trigger a job with monitor events of several PVs matched by timestamp
+# Note:
+#   1. The monitor events of each PV are buffered. When all PVs have an
+#      event within the tolerance of the same timestamp, the job is put
+#      to the queue of the Application with the aligned values as the
+#      dataBus: {"timestamp": ts, "values": {pvName: value}}
+#   2. Events older than a matched timestamp and events pushed out of a
+#      full buffer are dropped and counted
+#   3. The matched events are queued without merging, so each one is
+#      executed with its own data. If the queue is full, the events of the
+#      match are dropped and counted
+#   4. The counters are written to the local PVs by the Application timer
+# -------------------------------------------------
+import threading
+import collections
+
+from ooepics.LocalPV import *
+from ooepics.JobQueue import *
+
+# =================================
+# callback function for the monitored PVs
+# =================================
+def CorrTrigCbFunc(cbArgs):
+    trig   = cbArgs[0]                      # object of the trigger
+    pvId   = cbArgs[1]                      # id of the PV in the list
+    val, ts, _, status = cbArgs[-1]         # value with metadata
+    if status and ts is not None:
+        trig.addEvent(pvId, ts, val)
+
+# =================================
+# class of the trigger
+# =================================
+class CorrTrigger:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the object
+    #
+    # inputs:
+    #   app         - object of the Application executing the job
+    #   job         - object of the job
+    #   pvList      - list of RemotePV/LocalPV, the PVs to be correlated
+    #   tolerance   - float, max difference of the timestamps, s
+    #   bufDepth    - int, max number of events buffered for each PV
+    #   cmdId       - int, command id passed to the job
+    #   mutex       - mutex for job execution
+    #   priority    - int, priority of the command
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, app, job, pvList, tolerance = 0.001, bufDepth = 10, cmdId = 0, mutex = None, priority = 0):
+        # save the input info
+        self.app        = app
+        self.job        = job
+        self.pvList     = pvList
+        self.tolerance  = tolerance
+        self.bufDepth   = bufDepth if bufDepth >= 1 else 10
+        self.cmdId      = cmdId
+        self.mutex      = mutex
+        self.priority   = priority
+
+        # buffers of events: [timestamp, value]
+        self.lock       = threading.Lock()
+        self.buffers    = [collections.deque() for pv in pvList]
+        self.cnt_match  = 0                 # number of matched timestamps
+        self.cnt_drop   = 0                 # number of dropped events
+
+        # local PVs for the counters
+        self.lpv_matchCnt = LocalPV(app.modName, job.jobName, "CORR-MATCH-CNT", "", "", 1, "longin", "matched timestamps")
+        self.lpv_dropCnt  = LocalPV(app.modName, job.jobName, "CORR-DROP-CNT",  "", "", 1, "longin", "events not matched")
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # start monitoring the PVs
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def letGoing(self):
+        for pvId, pv in enumerate(self.pvList):
+            pv.monitor(CorrTrigCbFunc, [self, pvId], meta = True)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # add an event and try to match
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def addEvent(self, pvId, ts, val):
+        with self.lock:
+            buf = self.buffers[pvId]
+            if len(buf) >= self.bufDepth:
+                buf.popleft()
+                self.cnt_drop += 1
+            buf.append([ts, val])
+            matched = self._match()
+
+        # put the jobs out of the lock (never merged)
+        for dataBus in matched:
+            result, evicted = self.app.msgQ.put(self.job, self.cmdId, self.mutex, self.priority, dataBus, merge = False)
+            if result == JobQueue.DROPPED:
+                self.app.getJobStat(self.job).count_drop()
+                with self.lock:
+                    self.cnt_drop += len(self.pvList)
+            if evicted is not None:
+                self.app.getJobStat(evicted[0]).count_drop()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # match the buffered events, return the list of the aligned data
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _match(self):
+        matched = []
+        while all(self.buffers):
+            # the latest of the oldest events is the reference
+            tRef = max(buf[0][0] for buf in self.buffers)
+
+            # drop the events which can never be matched
+            for buf in self.buffers:
+                while buf and buf[0][0] < tRef - self.tolerance:
+                    buf.popleft()
+                    self.cnt_drop += 1
+
+            # all PVs have an event at the reference timestamp
+            if all(buf and abs(buf[0][0] - tRef) <= self.tolerance for buf in self.buffers):
+                values = {}
+                for pv, buf in zip(self.pvList, self.buffers):
+                    values[pv.pvName] = buf.popleft()[1]
+                matched.append({"timestamp": tRef, "values": values})
+                self.cnt_match += 1
+        return matched
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the counters
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def get_stat(self):
+        with self.lock:
+            return {"match": self.cnt_match,
+                    "drop":  self.cnt_drop}
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # write the counters to the local PVs (only the changed ones)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def publish(self):
+        stat = self.get_stat()
+        self.lpv_matchCnt.write_changed(stat["match"])
+        self.lpv_dropCnt.write_changed (stat["drop"])
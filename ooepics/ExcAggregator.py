@@ -0,0 +1,164 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Aggregation of the exceptions of jobs, FSMs and timers
+# Note:
+#   1. The exceptions are grouped by the source (e.g. the job name) and
+#      the signature (exception type and the code lines of the traceback,
+#      not the message which may contain changing data)
+#   2. The full traceback is printed when a signature is seen the first
+#      time. Later only a summary line is printed, at most once per
+#      report interval for each signature
+#   3. The counters are written to the local PVs by a timer if enabled
+#      with config()
+# -------------------------------------------------
+import threading
+import time
+import sys
+import traceback
+
+from ooepics.Clock import *
+
+class ExcAggregator:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    report_intv = 60.0                  # min interval to print the same signature, s
+    max_records = 1000                  # max number of signatures kept
+
+    lock        = threading.Lock()
+    records     = {}                    # (source, signature) -> record dict
+    cnt_total   = 0                     # total number of exceptions
+    last_str    = ''                    # the last exception
+
+    lpvs        = None                  # local PVs of the counters
+    timer       = None                  # timer to publish the counters
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # configure the aggregation
+    #   modName     - string, module name of the local PVs (None for no PVs)
+    #   report_intv - float, min interval to print the same signature, s
+    #   pub_intv    - float, interval to publish the counters, s
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def config(cls, modName = None, report_intv = 60.0, pub_intv = 1.0):
+        cls.report_intv = report_intv if report_intv >= 0 else 60.0
+
+        # create the local PVs (import here, the timers report to this class)
+        if (modName is not None) and (cls.lpvs is None):
+            from ooepics.LocalPV import LocalPV
+            from ooepics.RepeatedTimer import RepeatedTimer
+            cls.lpvs = {"total": LocalPV(modName, "EXC", "CNT",     "", "", 1,   "longin",        "number of exceptions"),
+                        "sigs":  LocalPV(modName, "EXC", "SIG-CNT", "", "", 1,   "longin",        "different exceptions"),
+                        "last":  LocalPV(modName, "EXC", "LAST",    "", "", 256, "waveform-text", "last exception")}
+            cls.timer = RepeatedTimer(pub_intv, cls.publish)
+            cls.timer.start()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # report an exception, call it in the except block
+    #   source      - string, where the exception happened (e.g. job name)
+    #   excInfo     - exception info as sys.exc_info(), None for the current
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def report(cls, source, excInfo = None):
+        if excInfo is None:
+            excInfo = sys.exc_info()
+        frames    = traceback.extract_tb(excInfo[2])
+        signature = (excInfo[0].__name__ if excInfo[0] else 'None',) + \
+                    tuple((f.filename, f.lineno, f.name) for f in frames)
+        cur_time  = Clock.time()
+
+        with cls.lock:
+            cls.cnt_total += 1
+            cls.last_str   = "{}: {}: {}".format(source, signature[0], excInfo[1])
+
+            # find or create the record
+            key = (source, signature)
+            rec = cls.records.get(key)
+            if rec is None:
+                if len(cls.records) >= cls.max_records:
+                    cls.records.pop(min(cls.records, key = lambda k: cls.records[k]["last"]))
+                rec = {"source":     source,
+                       "type":       signature[0],
+                       "message":    str(excInfo[1]),
+                       "location":   "{}:{} {}".format(*signature[-1][0:3]) if frames else '',
+                       "count":      0,
+                       "first":      cur_time,
+                       "last":       cur_time,
+                       "last_print": None,
+                       "suppressed": 0}
+                cls.records[key] = rec
+
+            rec["count"]  += 1
+            rec["last"]    = cur_time
+            rec["message"] = str(excInfo[1])
+
+            # check if to print
+            first = rec["last_print"] is None
+            if first or cur_time - rec["last_print"] >= cls.report_intv:
+                suppressed         = rec["suppressed"]
+                rec["last_print"]  = cur_time
+                rec["suppressed"]  = 0
+            else:
+                rec["suppressed"] += 1
+                return
+
+        # print out of the lock
+        if first:
+            print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+            print("Exception in " + source + ":\n")
+            traceback.print_tb(excInfo[2])
+            print(excInfo)
+            print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n")
+        else:
+            print("Exception in {} repeated ({} times not printed, {} in total): {}: {}".format(
+                  source, suppressed, rec["count"], rec["type"], rec["message"]))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the records, the latest first
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def get_records(cls):
+        with cls.lock:
+            recs = [dict(rec) for rec in cls.records.values()]
+        return sorted(recs, key = lambda r: r["last"], reverse = True)
+
+    @classmethod
+    def print_records(cls):
+        for rec in cls.get_records():
+            print("{:30s} {:8d}  {}  {}  {}: {} ({})".format(rec["source"], rec["count"],
+                  time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(rec["first"])),
+                  time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(rec["last"])),
+                  rec["type"], rec["message"], rec["location"]))
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.records.clear()
+            cls.cnt_total = 0
+            cls.last_str  = ''
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the counters as a dict
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def get_stat(cls):
+        with cls.lock:
+            return {"total": cls.cnt_total,
+                    "sigs":  len(cls.records),
+                    "last":  cls.last_str}
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # write the counters to the local PVs (only the changed ones)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def publish(cls):
+        if cls.lpvs is None:
+            return
+
+        stat = cls.get_stat()
+        for key, lpv in cls.lpvs.items():
+            lpv.write_changed(stat[key])
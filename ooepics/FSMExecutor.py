@@ -0,0 +1,212 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Execute many FSMLite objects with a small pool of threads
+# Note:
+#   1. The FSMs given to an executor do not start their own threads. The
+#      events of an FSM (ticks, commands, monitoring) are put to its mail
+#      box, which is scheduled to the ready queue of the workers
+#   2. A mail box is at most once in the ready queue and a worker handles
+#      one event of it before it is scheduled again, so entry, transit and
+#      exit of one FSM are never executed at the same time, and the FSMs
+#      share the workers fairly
+#   3. The ticks of an FSM are merged if one is still waiting, so a slow
+#      FSM does not block the timers. The timers are served by the shared
+#      TimerScheduler
+#   4. The monitoring function of an FSM is executed if it has no event
+#      for 5 times of its timer interval (same as running with a thread)
+#   5. With 0 workers, the events are handled in the thread putting them.
+#      It is used for the virtual clock (see Clock), where the FSMs are
+#      executed in the timer callbacks
+# -------------------------------------------------
+import threading
+import time
+import queue
+import collections
+
+from ooepics.RepeatedTimer import *
+
+# =================================
+# mail box of an FSM, used as the message queue of FSMLite
+# =================================
+class FSMMailBox:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the object
+    #
+    # inputs:
+    #   executor    - object of the FSMExecutor
+    #   fsm         - object of the FSMLite
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, executor, fsm):
+        self.executor   = executor
+        self.fsm        = fsm
+        self.lock       = threading.Lock()
+        self.msgs       = collections.deque()   # events: [] for tick, [msg, running] or None for monitoring
+        self.tick_wait  = False                 # a tick is waiting
+        self.scheduled  = False                 # in the ready queue or handled by a worker
+        self.last_time  = Clock.monotonic()     # time of the last handled event
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # put an event, never blocks (same interface as queue.Queue)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def put(self, msg, block = True, timeout = None):
+        with self.lock:
+            if msg is not None and len(msg) == 0:
+                if self.tick_wait:
+                    return                      # merge the ticks
+                self.tick_wait = True
+            self.msgs.append(msg)
+            run = self._schedule()
+        if run:
+            self._run_sync()
+
+    def put_nowait(self, msg):
+        self.put(msg, block = False)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # put the monitoring event if no other event for the time
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def put_mon(self, idle_time):
+        with self.lock:
+            if self.scheduled or Clock.monotonic() - self.last_time < idle_time:
+                return
+            self.msgs.append(None)
+            run = self._schedule()
+        if run:
+            self._run_sync()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the next event (called by the worker)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def get(self):
+        with self.lock:
+            msg = self.msgs.popleft()
+            if msg is not None and len(msg) == 0:
+                self.tick_wait = False
+            return msg
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # the event is handled, schedule again if there are more (called by the worker)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def task_done(self):
+        with self.lock:
+            self.last_time = Clock.monotonic()
+            self.scheduled = False
+            if self.msgs:
+                self._schedule()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # schedule the mail box (must be called with the lock), return True if
+    # the events should be handled by the caller (executor without workers)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _schedule(self):
+        if self.scheduled:
+            return False
+        self.scheduled = True
+        if self.executor.workers == 0:
+            return True
+        self.executor.readyQ.put(self)
+        return False
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # handle the events in the calling thread, the events put meanwhile
+    # (also by the FSM itself) are handled in the same loop
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _run_sync(self):
+        while True:
+            self.fsm._handle_msg(self.get())
+            with self.lock:
+                self.last_time = Clock.monotonic()
+                if not self.msgs:
+                    self.scheduled = False
+                    return
+
+# =================================
+# class of the executor
+# =================================
+class FSMExecutor:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    sync_executor = None                    # executor without workers for virtual clock
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the object
+    #
+    # inputs:
+    #   name        - string, name of the executor (used for thread names)
+    #   workers     - int, number of worker threads (0 to handle the events
+    #                 in the thread putting them)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, name = "FSMX", workers = 4):
+        self.name       = name
+        self.workers    = workers if workers >= 0 else 4
+        self.readyQ     = queue.Queue()         # mail boxes with events
+        self.boxes      = []
+        self.threads    = []
+        self.lock       = threading.Lock()
+        self.mon_timer  = RepeatedTimer(RepeatedTimer.MIN_INTV, self._cb_mon)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the executor without workers (created and started at first use)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def get_sync_executor(cls):
+        if cls.sync_executor is None:
+            cls.sync_executor = FSMExecutor("FSMX-SYNC", workers = 0)
+            cls.sync_executor.letGoing()
+        return cls.sync_executor
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # add an FSM, called by FSMLite.letGoing(executor)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def add(self, fsm):
+        box = FSMMailBox(self, fsm)
+
+        # move the events already in the queue of the FSM (e.g. start before letGoing)
+        while True:
+            try:
+                box.put(fsm.msg_q.get_nowait())
+            except queue.Empty:
+                break
+            except AttributeError:
+                break
+
+        fsm.msg_q = box
+        with self.lock:
+            self.boxes.append(box)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # start the worker threads and the monitoring timer
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def letGoing(self):
+        for wid in range(self.workers):
+            thrd = threading.Thread(target = self._thrd_func,
+                                    daemon = True,
+                                    name   = "{}-{}".format(self.name, wid))
+            print("Thread " + thrd.name + " started.")
+            thrd.start()
+            self.threads.append(thrd)
+        self.mon_timer.start()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # put the monitoring events of the idle FSMs
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _cb_mon(self):
+        with self.lock:
+            boxes = list(self.boxes)
+        for box in boxes:
+            if box.fsm.mon_func is not None:
+                box.put_mon(box.fsm.timer_intv * 5)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # thread function of the workers
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _thrd_func(self):
+        while True:
+            box = self.readyQ.get()
+            box.fsm._handle_msg(box.get())
+            box.task_done()
@@ -9,6 +9,30 @@
 #   1. In the callback function of LocalPV/RemotePV, better not access
 #      other local or remote PVs. Otherwise, a loop may be created in 
 #      pyEpics and make the PV access very slow
+#   2. If trigger PVs are given, the FSM is executed immediately when any
+#      of them changes, the timer is only a fallback (FALLBACK_INTV by
+#      default) and its next tick is pushed back when a trigger executes
+#      the FSM. Note that after() is only updated when the FSM is executed
+#   3. The status PVs are only written when changed, at the end of each
+#      FSM execution and only the last value of each PV (still one put per
+#      PV, pyepics flushes every put). The stay time is written at most
+#      once per stay_pub_intv, MAX-TRY is got from the monitor
+#   4. The time of entry/transit/exit functions and in each state, the
+#      counts of transitions and the latest transitions are recorded, see
+#      get_profile() and get_trace()
+#   5. The time is got from Clock. If the clock is virtual when started,
+#      the FSM is executed in the timer callbacks without its own thread
+#   6. If exe_budget is given, the entry/transit/exit functions are
+#      executed by a caller thread of the FSM (created at the first call),
+#      so a hanging FSM never blocks the others. A function not returned
+#      within the budget is counted as a failure (max_try), it is left
+#      running and its result is discarded. Until it returns, the later
+#      calls of the FSM also fail without being executed
+#   7. A timer tick or trigger is kept as a pending flag, not in the
+#      message queue, so they are merged while an execution is waiting
+#      and are never lost behind a status message. The commands
+#      start/stop/reset never block the caller (a CA callback), their
+#      messages are queued without a limit
 # -------------------------------------------------
 import threading
 import time
@@ -16,14 +40,25 @@ import os
 import queue
 import sys
 import traceback
+import collections
+import concurrent.futures
 
 from ooepics.RepeatedTimer import *
 from ooepics.LocalPV import *
+from ooepics.FSMExecutor import *
+from ooepics.ExcAggregator import *
+from ooepics.Tracer import *
+from ooepics.Watchdog import *
 
 # =================================
 # basic class for FSM 
 # =================================
 class FSMLite:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    FALLBACK_INTV   = 1.0               # default interval of timer if trigger PVs given, s
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # create the object
     #
@@ -35,8 +70,16 @@ class FSMLite:
     #   states      - list of string, the states 
     #   state_tr    - dict, state transit table
     #   mon_func    - function, monitoring function executed when FSM is not running
+    #   trig_pvs    - list of LocalPV/RemotePV, the transitions depend on
+    #   fallback_intv - float, interval of timer if trigger PVs given, s
+    #                 (None for FALLBACK_INTV)
+    #   stay_pub_intv - float, min interval to write the stay time, s
+    #   trace_depth - int, number of latest transitions recorded
+    #   exe_budget  - float, max execution time of entry/transit/exit, s
+    #                 (None for no limit)
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
-    def __init__(self, mod_name = '', fsm_name = '', timer_intv = 1, max_try = 3, states = [], state_tr = {}, mon_func = None):
+    def __init__(self, mod_name = '', fsm_name = '', timer_intv = 1, max_try = 3, states = [], state_tr = {}, mon_func = None,
+                       trig_pvs = [], fallback_intv = None, stay_pub_intv = 1.0, trace_depth = 100, exe_budget = None):
         # save the input info and check
         self.mod_name   = mod_name
         self.fsm_name   = fsm_name
@@ -45,6 +88,12 @@ class FSMLite:
         self.states     = states
         self.state_tr   = state_tr
         self.mon_func   = mon_func
+        self.trig_pvs   = list(trig_pvs)
+        self.fallback_intv = fallback_intv if (fallback_intv is not None and 0.01 < fallback_intv <= 60) else FSMLite.FALLBACK_INTV
+        self.stay_pub_intv = stay_pub_intv if stay_pub_intv >= 0 else 1.0
+        self.exe_budget = exe_budget if (exe_budget is None or exe_budget > 0) else None
+        self.late_call  = None                                                  # function overran the budget, still running
+        self.call_thrd  = None                                                  # caller thread of the functions with budget
 
         if (not isinstance(states, list)) or \
            (not isinstance(state_tr, dict)) or \
@@ -59,12 +108,23 @@ class FSMLite:
         self.current_state  = self.states[0]
         self.last_state     = None
 
-        self.entry_time     = time.time()                                       # time when enter an state
+        self.entry_time     = Clock.time()                                      # time when enter an state
         self.stay_time      = 0.0                                               # time passed staying in a state
         self.try_cnt_entry  = 0                                                 # count how many times tried
         self.try_cnt_trans  = 0
         self.try_cnt_exit   = 0
 
+        # variables for publishing the status
+        self.pub_pending    = []                                                # [lpv, value] to be written
+        self.published      = {}                                                # last written value of the PVs
+        self.stay_pub_time  = 0.0                                               # time when the stay time was written
+        self.max_try_init   = False                                             # MAX-TRY has been read once
+
+        # variables for profiling
+        self.prof_lock      = threading.Lock()
+        self.trace          = collections.deque(maxlen = trace_depth if trace_depth >= 1 else 100)
+        self.reset_profile()
+
         # local PVs for the FSM
         self.lpv_cmdStart = LocalPV(self.mod_name, self.fsm_name, "START",  "", "", 1, "bo", "start/resume FSM")
         self.lpv_cmdStop  = LocalPV(self.mod_name, self.fsm_name, "STOP",   "", "", 1, "bo", "stop FSM")
@@ -80,38 +140,69 @@ class FSMLite:
         self.lpv_exitOK   = LocalPV(self.mod_name, self.fsm_name, "EXIT-OK",   "", "",  1, "bi", "exit function exe OK")
         self.lpv_running  = LocalPV(self.mod_name, self.fsm_name, "RUNNING",   "", "",  1, "bi", "FSM running or not")
 
-        # variables for timer (will be started later)
+        self.lpv_transCnt = LocalPV(self.mod_name, self.fsm_name, "TRANS-CNT",      "", "",  1,  "longin",        "number of transitions")
+        self.lpv_slowFunc = LocalPV(self.mod_name, self.fsm_name, "PROF-SLOW-FUNC", "", "",  40, "waveform-text", "slowest state function")
+        self.lpv_slowTime = LocalPV(self.mod_name, self.fsm_name, "PROF-SLOW-TIME", "", "s", 1,  "ai",            "max time of slowest function")
+
+        self.wdog_owner = Watchdog.add_owner(self.mod_name, self.fsm_name)
+
+        # variables for timer (will be started later), it is only a fallback
+        # if the FSM is triggered by PVs (the interval is set in letGoing)
         self.timer = RepeatedTimer(self.timer_intv, self._cb_timer)             # create the timer
         self.fsm_running = False                                                # indicate if the FSM is running or not
 
-        # define the message queue
-        self.msg_q = queue.Queue(1)                                             # message queue to comm with thread
+        # define the message queue, the ticks are merged with the pending flag
+        self.msg_q        = queue.Queue()                                       # message queue to comm with thread
+        self.tick_lock    = threading.Lock()
+        self.tick_pending = False                                               # an execution of the FSM is waiting
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # post a message
     # ~~~~~~~~~~~~~~~~~~~~~~~~~       
     def postMsg(self, msg):
-        msgStr  = time.strftime("[%Y-%m-%d %H:%M:%S]", time.localtime())
+        msgStr  = time.strftime("[%Y-%m-%d %H:%M:%S]", time.localtime(Clock.time()))
         msgStr += ' | ' + self.fsm_name + ': ' + msg
         print(msgStr)
         status = self.lpv_fsmMsg.write(msgStr)        
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # start the thread for FSM execution 
+    #   executor    - object of FSMExecutor, execute the FSM with its threads
+    #                 instead of starting a thread for this FSM
     # ~~~~~~~~~~~~~~~~~~~~~~~~~       
-    def letGoing(self):
-        # start the thread
-        self.thrd = threading.Thread(target = self._thrd_func,
-                                     args   = [],
-                                     daemon = True,
-                                     name   = "FSM-" + self.fsm_name)
-        self.postMsg("Thread {} started.".format(self.thrd.name))
-        self.thrd.start()
+    def letGoing(self, executor = None):
+        if executor is None and Clock.virtual:
+            executor = FSMExecutor.get_sync_executor()
+
+        if executor is not None:
+            executor.add(self)
+        else:
+            # start the thread
+            self.thrd = threading.Thread(target = self._thrd_func,
+                                         args   = [],
+                                         daemon = True,
+                                         name   = "FSM-" + self.fsm_name)
+            self.postMsg("Thread {} started.".format(self.thrd.name))
+            self.thrd.start()
 
         # define the monitor PVs
         self.lpv_cmdStart.monitor(self._cb_cmd, [self.start])
         self.lpv_cmdStop.monitor (self._cb_cmd, [self.stop])
         self.lpv_cmdReset.monitor(self._cb_cmd, [self.reset])
+        self.lpv_setMaxTry.monitor(self._cb_max_try)
+
+        # monitor the trigger PVs, the timer is only a fallback
+        for pv in self.trig_pvs:
+            pv.monitor(self._cb_trig)
+        if self.trig_pvs:
+            self.timer.interval = self.fallback_intv
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # add trigger PVs (before letGoing), the FSM is executed when they change
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def add_trig_pv(self, pvs):
+        if isinstance(pvs, list): self.trig_pvs.extend(pvs)
+        else:                     self.trig_pvs.append(pvs)
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # start/stop/reset the FSM 
@@ -127,7 +218,7 @@ class FSMLite:
             self.fsm_running = True
 
             # send event to thread for displaying (avoid loop in pyEpics - see Note1)
-            self.msg_q.put(['FSM started.', self.fsm_running])
+            self._post_status('FSM started.')
 
     def stop(self, reason = 'user command'):
         self.timer.stop()
@@ -136,7 +227,7 @@ class FSMLite:
         # Note: the stop will be also called by the _exe_fsm function, we use
         #       different implementation to avoid deadlock
         if reason == 'user command':                # from callback of EPICS
-            self.msg_q.put(['FSM stopped by {}.'.format(reason), self.fsm_running])
+            self._post_status('FSM stopped by {}.'.format(reason))
         else:                                       # from local thread
             self.postMsg('FSM stopped by {}.'.format(reason))
             self.lpv_running.write(self.fsm_running)
@@ -146,13 +237,31 @@ class FSMLite:
         self.current_state  = self.states[0]
         #self.last_state     = None
 
-        self.entry_time     = time.time() 
+        self.entry_time     = Clock.time() 
         self.stay_time      = 0.0
         self.try_cnt_entry  = 0
         self.try_cnt_trans  = 0
         self.try_cnt_exit   = 0
 
-        self.msg_q.put(['FSM reset.', self.fsm_running])
+        self._post_status('FSM reset.')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # send a message and the running status to the thread without blocking
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _post_status(self, msg):
+        self.msg_q.put_nowait([msg, self.fsm_running])
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # request an execution of the FSM, return False if one is already
+    # waiting (merged)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _post_tick(self):
+        with self.tick_lock:
+            if self.tick_pending:
+                return False
+            self.tick_pending = True
+        self.msg_q.put_nowait([])
+        return True
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # check if dt has passed after entering the state
@@ -160,6 +269,119 @@ class FSMLite:
     def after(self, dt):
         return self.stay_time >= dt
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # profile of the FSM
+    #   get_profile() returns {state: {"entry"/"transit"/"exit"/"state":
+    #   [count, total time, max time]}, "trans": {"from->to": count}}
+    #   get_trace() returns the latest transitions [time, from, to]
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def reset_profile(self):
+        with self.prof_lock:
+            self.prof       = {}
+            self.trans_cnt  = {}
+            self.trans_tot  = 0
+            self.cnt_overrun     = 0
+            self.cnt_tick_merged = 0
+            self.trace.clear()
+
+    def get_profile(self):
+        with self.prof_lock:
+            return {"states":      {st: {k: list(v) for k, v in d.items()} for st, d in self.prof.items()},
+                    "trans":       dict(self.trans_cnt),
+                    "overrun":     self.cnt_overrun,
+                    "tick_merged": self.cnt_tick_merged}
+
+    def get_trace(self):
+        with self.prof_lock:
+            return list(self.trace)
+
+    def print_profile(self):
+        prof = self.get_profile()
+        print("{:20s} {:8s} {:>8s} {:>12s} {:>12s}".format("state", "func", "count", "avg (s)", "max (s)"))
+        for st, d in prof["states"].items():
+            for k, (cnt, tot, tmax) in d.items():
+                print("{:20s} {:8s} {:8d} {:12.6f} {:12.6f}".format(st, k, cnt, tot / cnt if cnt else 0.0, tmax))
+        for tr, cnt in prof["trans"].items():
+            print("{:30s} {:8d}".format(tr, cnt))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # record a time of a state, kind is "entry", "transit", "exit" or "state"
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _prof_add(self, state, kind, dt):
+        with self.prof_lock:
+            rec = self.prof.setdefault(state, {}).setdefault(kind, [0, 0.0, 0.0])
+            rec[0] += 1
+            rec[1] += dt
+            rec[2]  = max(rec[2], dt)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # record a transition
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _prof_trans(self, from_state, to_state):
+        with self.prof_lock:
+            key = "{}->{}".format(from_state, to_state)
+            self.trans_cnt[key] = self.trans_cnt.get(key, 0) + 1
+            self.trans_tot     += 1
+            self.trace.append([Clock.time(), from_state, to_state])
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # execute a state function and record its time
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _call_timed(self, kind, func, *args):
+        t0    = time.perf_counter()
+        trace = Tracer.enabled                      # read once, may change meanwhile
+        if trace: tt0 = time.monotonic()
+        wdog = Watchdog.begin(self.wdog_owner, "{}.{}.{}".format(self.fsm_name, self.current_state, kind), "fsm") if Watchdog.enabled else None
+        try:
+            if self.exe_budget is None:
+                return func(*args)
+            return self._call_budget(kind, func, *args)
+        finally:
+            Watchdog.end(wdog)
+            self._prof_add(self.current_state, kind, time.perf_counter() - t0)
+            if trace:
+                Tracer.add_span("{}.{}.{}".format(self.fsm_name, self.current_state, kind), "fsm", tt0, time.monotonic())
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # execute a state function within the budget, return None (failure) if
+    # it overruns or the last overrun function is still running
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _call_budget(self, kind, func, *args):
+        if self.late_call is not None:
+            if not self.late_call.done():
+                self.postMsg('state {} {}() skipped, last function still running'.format(self.current_state, kind))
+                return None
+            self.late_call = None
+
+        # one thread is enough, as only one function of the FSM is in flight
+        if self.call_thrd is None:
+            self.call_thrd = concurrent.futures.ThreadPoolExecutor(max_workers        = 1,
+                                                                   thread_name_prefix = "FSM-CALL-" + self.fsm_name)
+        call = self.call_thrd.submit(func, *args)
+        try:
+            return call.result(timeout = self.exe_budget)
+        except concurrent.futures.TimeoutError:
+            self.late_call = call
+            with self.prof_lock:
+                self.cnt_overrun += 1
+            self.postMsg('state {} {}() overran budget {} s'.format(self.current_state, kind, self.exe_budget))
+            return None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # publish the summary of the profile
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _publish_prof(self):
+        slow_func, slow_time = '', 0.0
+        with self.prof_lock:
+            trans_tot = self.trans_tot
+            for st, d in self.prof.items():
+                for k in ("entry", "transit", "exit"):
+                    if k in d and d[k][2] > slow_time:
+                        slow_func, slow_time = st + '.' + k, d[k][2]
+        self._publish(self.lpv_transCnt, trans_tot)
+        self._publish(self.lpv_slowFunc, slow_func)
+        self._publish(self.lpv_slowTime, slow_time)
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # set init state
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -181,12 +403,32 @@ class FSMLite:
         if cmd == 1:
             fun()
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # max try PV callback
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _cb_max_try(self, arg):
+        mtry = arg[-1]
+        if mtry is not None and mtry >= 1:
+            self.max_try = int(mtry)
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # timer callback
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     def _cb_timer(self):
-        # send event to the thread
-        self.msg_q.put([])
+        # send event to the thread, merge the tick if one is still waiting
+        if not self._post_tick():
+            with self.prof_lock:
+                self.cnt_tick_merged += 1
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # trigger PV callback, wake up the thread if the FSM is running (do 
+    # nothing if an execution is already waiting) and push back the 
+    # fallback timer
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _cb_trig(self, arg):
+        if self.fsm_running:
+            self.timer.postpone()
+            self._post_tick()
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # thread function
@@ -196,64 +438,104 @@ class FSMLite:
         while True:
             try: 
                 msg = self.msg_q.get(timeout = self.timer_intv * 5)
-                if len(msg) == 2:
-                    self.postMsg(msg[0])
-                    self.lpv_running.write(msg[1])
-                else:
-                    self._exe_fsm()
-                self.msg_q.task_done()
             except queue.Empty:
+                self._handle_msg(None)
+                continue
+            self._handle_msg(msg)
+            self.msg_q.task_done()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # handle a message (also called by FSMExecutor)
+    #   msg         - None: execute the monitoring function
+    #                 [msg, running]: display the message and running status
+    #                 []: execute the FSM
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _handle_msg(self, msg):
+        try:
+            if msg is None:
                 if self.mon_func is not None:
                     self.mon_func()
-            except:
-                print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
-                print("Exception in FSM execution:\n")
-                excInfo = sys.exc_info()
-                traceback.print_tb(excInfo[2])
-                print(excInfo)
-                print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n")        
+            elif len(msg) == 2:
+                self.postMsg(msg[0])
+                self.lpv_running.write(msg[1])
+            else:
+                # the ticks and triggers from now on need another execution
+                with self.tick_lock:
+                    self.tick_pending = False
+                try:
+                    self._exe_fsm()
+                finally:
+                    self._publish_prof()
+                    self._flush_pub()
+        except:
+            ExcAggregator.report("FSM " + self.fsm_name)        
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # publish the status PVs, only the last changed value of each PV is
+    # written at the end of the FSM execution
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _publish(self, lpv, value):
+        if self.published.get(lpv.pvName) != value:
+            self.pub_pending.append([lpv, value])
+
+    def _flush_pub(self):
+        if not self.pub_pending:
+            return
+        pending, self.pub_pending = self.pub_pending, []
+        failed = RemotePV.write_latest(pending)
+        for lpv, value in pending:
+            if lpv in failed:
+                self.published.pop(lpv.pvName, None)
+            else:
+                self.published[lpv.pvName] = value
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # function to execute the FSM
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     def _exe_fsm(self):
-        # get the max try number
-        mtry, _, _, status = self.lpv_setMaxTry.read(use_monitor = True)
-        if status:
-            if mtry >= 1:
-                self.max_try = mtry
+        # get the max try number (later updated by the monitor)
+        if not self.max_try_init:
+            mtry, _, _, status = self.lpv_setMaxTry.read(use_monitor = True)
+            if status:
+                self.max_try_init = True
+                if mtry >= 1:
+                    self.max_try = mtry
 
         # --------------------
         # execute the entry if enter a new state
         # --------------------
         if self.current_state != self.last_state:
             # indicate the current state that we are working on
-            self.lpv_curState.write(self.current_state)
+            self._publish(self.lpv_curState, self.current_state)
 
             # execute the entry function
             if self.state_tr[self.current_state]['entry']:
-                status = self.state_tr[self.current_state]['entry'](self.last_state)
+                status = self._call_timed('entry', self.state_tr[self.current_state]['entry'], self.last_state)
                 if not status:
                     self.try_cnt_entry += 1
                     self.postMsg('state {} entry() failed, try again...'.format(self.current_state))
                     if self.try_cnt_entry > self.max_try:
                         self.postMsg('state {} entry() failed, tried max {} times, stop!'.format(self.current_state, self.max_try))
                         self.stop(reason = '{} entry() failure'.format(self.current_state))
-                    self.lpv_entryOK.write(False)
+                    self._publish(self.lpv_entryOK, False)
                     return
                 else:
                     self.try_cnt_entry = 0                        
                         
             # remember the entry time and update the states
-            self.entry_time = time.time()           # in second since the epoch of UTC
+            self.entry_time = Clock.time()           # in second since the epoch of UTC
             self.last_state = self.current_state
-            self.lpv_entryOK.write(True)
+            self.stay_pub_time = 0.0
+            self._publish(self.lpv_entryOK, True)
 
         # --------------------
         # update the stay time
         # --------------------
-        self.stay_time = time.time() - self.entry_time
-        self.lpv_stayTime.write(self.stay_time)
+        cur_time = Clock.time()
+        self.stay_time = cur_time - self.entry_time
+        if cur_time - self.stay_pub_time >= self.stay_pub_intv:
+            self.stay_pub_time = cur_time
+            self._publish(self.lpv_stayTime, self.stay_time)
 
         # --------------------
         # perform transition (only when the last exit was correct, or
@@ -261,21 +543,21 @@ class FSMLite:
         # --------------------
         if (self.next_state == self.current_state) or (self.next_state is None):
             if self.state_tr[self.current_state]['transit']:
-                self.next_state = self.state_tr[self.current_state]['transit']()
+                self.next_state = self._call_timed('transit', self.state_tr[self.current_state]['transit'])
                 if not self.next_state:
                     self.try_cnt_trans += 1
                     self.postMsg('state {} transit() failed, try again...'.format(self.current_state))
                     if self.try_cnt_trans > self.max_try:
                         self.postMsg('state {} transit() failed, tried max {} times, stop!'.format(self.current_state, self.max_try))
                         self.stop(reason = '{} transit() failure'.format(self.current_state))
-                    self.lpv_transOK.write(False)
+                    self._publish(self.lpv_transOK, False)
                     return
                 else:
                     self.try_cnt_trans = 0
             else:
                 self.next_state = self.current_state
 
-            self.lpv_transOK.write(True)
+            self._publish(self.lpv_transOK, True)
 
         # --------------------
         # execute the exit if exit from a state
@@ -283,21 +565,23 @@ class FSMLite:
         if self.next_state != self.current_state:
             # execute the exit function
             if self.state_tr[self.current_state]['exit']:
-                status = self.state_tr[self.current_state]['exit'](self.next_state)
+                status = self._call_timed('exit', self.state_tr[self.current_state]['exit'], self.next_state)
                 if not status:
                     self.try_cnt_exit += 1
                     self.postMsg('state {} exit() failed, try again...'.format(self.current_state))
                     if self.try_cnt_exit > self.max_try:
                         self.postMsg('state {} exit() failed, tried max {} times, stop!'.format(self.current_state, self.max_try))
                         self.stop(reason = '{} exit() failure'.format(self.current_state))
-                    self.lpv_exitOK.write(False)
+                    self._publish(self.lpv_exitOK, False)
                     return
                 else:
                     self.try_cnt_exit = 0   
                     
             # update the states
+            self._prof_add(self.current_state, 'state', Clock.time() - self.entry_time)
+            self._prof_trans(self.current_state, self.next_state)
             self.current_state = self.next_state
-            self.lpv_exitOK.write(True)
+            self._publish(self.lpv_exitOK, True)
                     
 
 
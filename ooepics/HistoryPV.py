@@ -0,0 +1,126 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# LocalPV of a scalar with the history of its last updates
+# Note:
+#   1. The last hist_len written values and their times are kept in
+#      preallocated numpy rings. As in LogService, each entry is written
+#      twice, so the history (oldest first) is always a contiguous window
+#      and is published without reordering
+#   2. The history is published to the waveform PVs <valName>-HIST and
+#      <valName>-HIST-TS by a timer, at most once per pub_intv and only if
+#      there are new updates. The timestamps are written first, so a
+#      client monitoring the values gets the matched timestamps
+#   3. Before the ring is full, only the valid entries are published
+#   4. A GUI monitoring the history PVs replaces polling the scalar
+# -------------------------------------------------
+import threading
+import numpy as np
+
+from ooepics.LocalPV import *
+from ooepics.RepeatedTimer import *
+
+class HistoryPV(LocalPV):
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    HistTypes = {"ai", "ao", "longin", "longout", "bi", "bo", "mbbi", "mbbo"}
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the object
+    #
+    # inputs:
+    #   modStr ... initProc - see LocalPV (a scalar record)
+    #   hist_len    - int, number of updates kept in the history
+    #   pub_intv    - float, min interval to publish the history, s
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, modStr, devStr, valStr, selItems, unitStr, recTypeStr, descStr,
+                       enaSR = True, initVal = None, initProc = False, hist_len = 1000, pub_intv = 1.0):
+        if recTypeStr not in HistoryPV.HistTypes:
+            print("ERROR: HistoryPV record type {} not supported!".format(recTypeStr))
+            return
+        LocalPV.__init__(self, modStr, devStr, valStr, selItems, unitStr, 1, recTypeStr, descStr,
+                         enaSR = enaSR, initVal = initVal, initProc = initProc)
+
+        # rings of the values and times (each entry written twice)
+        self.hist_len   = hist_len if hist_len >= 2 else 1000
+        self.hist_val   = np.zeros(2 * self.hist_len)
+        self.hist_ts    = np.zeros(2 * self.hist_len)
+        self.hist_pos   = self.hist_len - 1         # position of the newest entry
+        self.hist_cnt   = 0                         # number of valid entries
+        self.hist_lock  = threading.Lock()
+        self.hist_dirty = False                     # new updates not published
+
+        # PVs of the history
+        self.lpv_hist   = LocalPV(modStr, devStr, valStr + "-HIST",    "", unitStr, self.hist_len, "waveform", "history of " + descStr,    enaSR = False)
+        self.lpv_histTs = LocalPV(modStr, devStr, valStr + "-HIST-TS", "", "s",     self.hist_len, "waveform", "time of history " + descStr, enaSR = False)
+
+        # timer to publish the history (started at the first update)
+        self.pubTimer   = RepeatedTimer(pub_intv, self.publish)
+        self.pub_start  = False
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # write the value and add it to the history if successful
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def write(self, value, wait = False, timeout = 1.0):
+        status = LocalPV.write(self, value, wait = wait, timeout = timeout)
+        if status:
+            self.append(value)
+        return status
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # add a value to the history without writing the PV
+    #   ts          - float, time of the value (Clock.time() if None)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def append(self, value, ts = None):
+        if ts is None:
+            ts = Clock.time()
+        with self.hist_lock:
+            pos = self.hist_pos + 1
+            if pos >= self.hist_len:
+                pos = 0
+            self.hist_val[pos] = self.hist_val[pos + self.hist_len] = value
+            self.hist_ts[pos]  = self.hist_ts[pos + self.hist_len]  = ts
+            self.hist_pos      = pos
+            self.hist_cnt      = min(self.hist_cnt + 1, self.hist_len)
+            self.hist_dirty    = True
+
+        if not self.pub_start:
+            self.pub_start = True
+            self.pubTimer.start()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the history (oldest first), return [values, times]
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def get_history(self):
+        with self.hist_lock:
+            return self._window(copy = True)
+
+    def _window(self, copy = False):
+        end = self.hist_pos + 1 + self.hist_len
+        val = self.hist_val[end - self.hist_cnt : end]
+        ts  = self.hist_ts [end - self.hist_cnt : end]
+        return [val.copy(), ts.copy()] if copy else [val, ts]
+
+    def clear(self):
+        with self.hist_lock:
+            self.hist_cnt   = 0
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # publish the history if there are new updates (called by the timer)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def publish(self):
+        with self.hist_lock:
+            if not self.hist_dirty:
+                return
+            self.hist_dirty = False
+            if self.hist_cnt == 0:
+                return                              # published at the next update
+            val, ts = self._window(copy = True)
+
+        if not (self.lpv_histTs.write(ts) and self.lpv_hist.write(val)):
+            with self.hist_lock:
+                self.hist_dirty = True              # try again next time
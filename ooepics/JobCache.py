@@ -0,0 +1,148 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Cache of job results based on the inputs of the job
+# Note:
+#   1. The key of an execution is built from the command id and the
+#      timestamps (mode "timestamp") or values (mode "value") of the
+#      input PVs. If the key is same as the last execution, the job is
+#      skipped and the outputs are kept as they are
+#   2. If the key is found in the cache (LRU), the job is skipped, the
+#      cached values of the output PVs are written back and the cached
+#      result of execute() is returned
+#   3. If any input cannot be read, the job is always executed
+#   4. The cached output values are the last values written by the job
+#      (LocalPV.last_write), not read back from the PVs, as a put without
+#      wait may not be processed yet. An output never written is read
+#   5. With cache_size 0 nothing is cached and the job is always executed
+# -------------------------------------------------
+import threading
+import collections
+
+import numpy as np
+
+# =================================
+# convert a PV value to a hashable key
+# =================================
+def CacheValueKey(val):
+    if isinstance(val, np.ndarray):
+        return (val.dtype.str, val.shape, val.tobytes())
+    if isinstance(val, (list, tuple)):
+        return tuple(CacheValueKey(v) for v in val)
+    return val
+
+# =================================
+# class for the cache
+# =================================
+class JobCache:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    MODES = {"timestamp", "value"}
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the object
+    #
+    # inputs:
+    #   inPVs       - list of LocalPV/RemotePV, inputs of the job
+    #   outPVs      - list of LocalPV, outputs of the job
+    #   mode        - string, compare "timestamp" or "value" of the inputs
+    #   cache_size  - int, max number of results in the cache (0 to disable)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, inPVs, outPVs = [], mode = "timestamp", cache_size = 16):
+        # save the input info
+        self.inPVs      = inPVs
+        self.outPVs     = outPVs
+        self.mode       = mode if mode in JobCache.MODES else "timestamp"
+        self.cache_size = cache_size if cache_size >= 0 else 16
+
+        # variables
+        self.lock       = threading.Lock()
+        self.lru        = collections.OrderedDict()     # key -> [result, output values]
+        self.last_key   = None                          # key of the last execution
+        self.cnt_hit    = 0
+        self.cnt_miss   = 0
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # build the key of the inputs, return None if any input fails
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def input_key(self, cmdId):
+        key = [cmdId]
+        for pv in self.inPVs:
+            val, ts, _, status = pv.read(use_monitor = True)
+            if not status:
+                return None
+            key.append(ts if self.mode == "timestamp" else CacheValueKey(val))
+        return tuple(key)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # look up the cache, return [hit, result]
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def lookup(self, key):
+        if key is None:
+            return [False, None]
+
+        with self.lock:
+            # inputs not changed since the last execution
+            if key == self.last_key and key in self.lru:
+                self.lru.move_to_end(key)
+                self.cnt_hit += 1
+                return [True, self.lru[key][0]]
+
+            # found in cache, restore the outputs
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                result, outVals = self.lru[key]
+                self.cnt_hit += 1
+            else:
+                self.cnt_miss += 1
+                return [False, None]
+
+            self.last_key = key
+
+        for lpv, val in zip(self.outPVs, outVals):
+            if val is not None:
+                lpv.write(val)
+        return [True, result]
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # save the result of an execution
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def store(self, key, result):
+        if key is None or self.cache_size == 0:
+            return
+
+        outVals = []
+        for lpv in self.outPVs:
+            val = getattr(lpv, "last_write", None)
+            if val is None:
+                val, _, _, status = lpv.read()
+                if not status: val = None
+            outVals.append(np.copy(val) if isinstance(val, np.ndarray) else val)
+
+        with self.lock:
+            self.lru[key] = [result, outVals]
+            self.lru.move_to_end(key)
+            while len(self.lru) > self.cache_size:
+                self.lru.popitem(last = False)
+            self.last_key = key
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # clear the cache
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def clear(self):
+        with self.lock:
+            self.lru.clear()
+            self.last_key = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the counters
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def get_stat(self):
+        with self.lock:
+            return {"hit":  self.cnt_hit,
+                    "miss": self.cnt_miss,
+                    "size": len(self.lru)}
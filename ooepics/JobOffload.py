@@ -0,0 +1,236 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Execute the compute step of jobs in a process pool
+# Note:
+#   1. The compute function runs in another process, it must be a
+#      module-level function and should not access any PVs. The inputs
+#      and outputs are dicts, NumPy arrays in them are transferred via
+#      shared memory, other values are pickled
+#   2. The pool uses "forkserver" by default, so the worker processes are
+#      never forked from the soft IOC process with the threads of Channel
+#      Access running. "fork" is faster to start but only safe if the pool
+#      is started before RemotePV.connect(). Start the pool explicitly with
+#      OffloadPool.start() before Application.letGoing(), run() refuses to
+#      execute before it
+#   3. The outputs are written to the local PVs in the main process
+#   4. If run() times out, the result is discarded when the worker finishes
+#      later, its shared memory is unlinked by a callback of the future
+# -------------------------------------------------
+import concurrent.futures
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+from multiprocessing import resource_tracker
+
+import numpy as np
+
+from ooepics.Job import *
+
+# =================================
+# functions for shared memory transfer
+# =================================
+SHM_TAG = "__ooepics_shm__"
+
+# put the NumPy arrays of a dict to shared memory, return the dict of
+# descriptors and the list of created shared memory objects
+def ShmPack(data):
+    desc    = {}
+    shmList = []
+    for key, val in data.items():
+        if isinstance(val, np.ndarray) and val.nbytes > 0 and val.dtype != object:
+            shm = shared_memory.SharedMemory(create = True, size = val.nbytes)
+            np.ndarray(val.shape, dtype = val.dtype, buffer = shm.buf)[...] = val
+            desc[key] = (SHM_TAG, shm.name, val.shape, val.dtype.str)
+            shmList.append(shm)
+        else:
+            desc[key] = val
+    return desc, shmList
+
+# get the data from the dict of descriptors, return the dict of data and
+# the list of attached shared memory objects. If copy is False, the arrays
+# are views of the shared memory and only valid before the shm is closed
+def ShmUnpack(desc, copy = True):
+    data    = {}
+    shmList = []
+    for key, val in desc.items():
+        if isinstance(val, tuple) and len(val) == 4 and val[0] == SHM_TAG:
+            shm = shared_memory.SharedMemory(name = val[1])
+            arr = np.ndarray(val[2], dtype = np.dtype(val[3]), buffer = shm.buf)
+            data[key] = arr.copy() if copy else arr
+            shmList.append(shm)
+        else:
+            data[key] = val
+    return data, shmList
+
+# release the shared memory objects
+def ShmRelease(shmList, unlink = False):
+    for shm in shmList:
+        try:
+            shm.close()
+            if unlink:
+                shm.unlink()
+        except (BufferError, FileNotFoundError):
+            pass
+
+# function executed in the worker process
+def OffloadWorker(func, cmdId, inDesc):
+    inputs, inShm = ShmUnpack(inDesc, copy = False)
+    try:
+        outputs = func(cmdId, inputs)
+        if outputs is None:
+            outputs = {}
+        outDesc, outShm = ShmPack(outputs)
+        ShmRelease(outShm)                  # the main process will unlink them
+        del outputs
+        return outDesc
+    finally:
+        del inputs
+        ShmRelease(inShm)
+
+# function to make sure the worker process is started
+def OffloadPing():
+    return os.getpid()
+
+# callback of a future not waited for (run() timed out), release the
+# shared memory of the outputs when the worker finishes
+def OffloadDiscard(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    outputs, outShm = ShmUnpack(future.result(), copy = False)
+    del outputs
+    ShmRelease(outShm, unlink = True)
+
+# =================================
+# process pool shared by all jobs
+# =================================
+class OffloadPool:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    executor = None             # object of the process pool executor
+    workers  = 0                # number of worker processes
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # start the pool
+    #   workers     - int, number of processes, default is the number of CPUs
+    #   method      - string, start method of the processes
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def start(cls, workers = None, method = "forkserver"):
+        if cls.executor is not None:
+            return
+
+        # share the resource tracker of shared memory with the worker processes
+        resource_tracker.ensure_running()
+
+        cls.workers  = workers if (workers is not None and workers > 0) else (os.cpu_count() or 1)
+        cls.executor = concurrent.futures.ProcessPoolExecutor(max_workers = cls.workers,
+                                                              mp_context  = multiprocessing.get_context(method))
+
+        # create all worker processes now
+        pings = [cls.executor.submit(OffloadPing) for i in range(cls.workers)]
+        concurrent.futures.wait(pings)
+        print("Offload pool started with {} processes.".format(cls.workers))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # execute func(cmdId, inputs) in the pool and return the outputs (dict).
+    # Raise RuntimeError if the pool is not started, and TimeoutError if 
+    # the results are not ready in timeout seconds
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def run(cls, func, inputs, cmdId = 0, timeout = None):
+        executor = cls.executor
+        if executor is None:
+            raise RuntimeError("offload pool not started, call OffloadPool.start() before letGoing()")
+
+        inDesc, inShm = ShmPack(inputs)
+        try:
+            future = executor.submit(OffloadWorker, func, cmdId, inDesc)
+            try:
+                outDesc = future.result(timeout = timeout)
+            except concurrent.futures.TimeoutError:
+                if not future.cancel():
+                    future.add_done_callback(OffloadDiscard)
+                raise
+        finally:
+            ShmRelease(inShm, unlink = True)
+
+        outputs, outShm = ShmUnpack(outDesc, copy = True)
+        ShmRelease(outShm, unlink = True)
+        return outputs
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # stop the pool
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def shutdown(cls):
+        if cls.executor is not None:
+            cls.executor.shutdown(wait = False, cancel_futures = True)
+            cls.executor = None
+
+# =================================
+# job with the compute step executed in the process pool
+# =================================
+class JobOffload(Job):
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the object
+    #
+    # inputs:
+    #   modName     - string, module name
+    #   jobName     - string, job name
+    #   func        - function, func(cmdId, inputs) -> outputs, executed in the pool
+    #   inPVs       - dict, name -> LocalPV/RemotePV, read as the inputs
+    #   outPVs      - dict, name -> LocalPV, the outputs with same names are written
+    #   timeout     - float, max time waiting for the results, s (None for no limit)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, modName, jobName, func, inPVs = {}, outPVs = {}, timeout = None):
+        # init the parent class
+        Job.__init__(self, modName, jobName)
+        self.func    = func
+        self.inPVs   = inPVs
+        self.outPVs  = outPVs
+        self.timeout = timeout
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # collect the inputs in the main process, return [inputs, status]. It
+    # can be overridden by the derived class
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def prepare(self, cmdId, dataBus):
+        inputs = {}
+        if isinstance(dataBus, dict):
+            inputs.update(dataBus)
+
+        for name, pv in self.inPVs.items():
+            val, _, _, status = pv.read()
+            if not status:
+                print("JobOffload::prepare(): ERROR: failed to read input " + name + " of job " + self.jobName)
+                return [inputs, False]
+            inputs[name] = val
+        return [inputs, True]
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # write the outputs to local PVs in the main process, return status. It
+    # can be overridden by the derived class
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def publish(self, cmdId, outputs):
+        status = True
+        for name, lpv in self.outPVs.items():
+            if name in outputs:
+                status = lpv.write(outputs[name]) and status
+        return status
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # execute the job, the outputs are passed on as the dataBus
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def execute(self, cmdId = 0, dataBus = None):
+        inputs, status = self.prepare(cmdId, dataBus)
+        if not status:
+            return [dataBus, False]
+
+        outputs = OffloadPool.run(self.func, inputs, cmdId = cmdId, timeout = self.timeout)
+        status  = self.publish(cmdId, outputs)
+        return [outputs, status]
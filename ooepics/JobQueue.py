@@ -0,0 +1,102 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Command queue of the Application with priorities and coalescing
+# Note:
+#   1. A command which is already waiting in the queue (same job and
+#      same command id) will not be queued again but merged
+#   2. When the queue is full, a new command with higher priority
+#      replaces the lowest priority command waiting in the queue
+#   3. When merged, the dataBus of the new command replaces the old one
+#   4. A command put with merge = False (e.g. the matched events of 
+#      CorrTrigger, each with its own data) is never merged, and no later
+#      command is merged with it
+# -------------------------------------------------
+import threading
+import time
+
+class JobQueue:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    QUEUED  = 0             # command put to the queue
+    MERGED  = 1             # command merged with a waiting one
+    DROPPED = 2             # command dropped as the queue is full
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the object
+    #
+    # inputs:
+    #   depth       - int, max number of commands waiting in the queue
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, depth = 2):
+        self.depth      = depth if depth >= 1 else 2
+        self.pending    = []                        # entries: [job, cmdId, mutex, priority, seq, time put, dataBus, merge]
+        self.seq        = 0                         # sequence number to keep FIFO for same priority
+        self.unfinished = 0                         # number of commands not finished
+        self.cond       = threading.Condition()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # put a command to the queue. Return [result, evicted entry or None]
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def put(self, job, cmdId, mutex, priority = 0, dataBus = None, merge = True):
+        with self.cond:
+            # merge with the waiting command (keep the time it was put)
+            if merge:
+                for ent in self.pending:
+                    if ent[7] and (ent[0] is job) and (ent[1] == cmdId):
+                        ent[3] = max(ent[3], priority)
+                        ent[6] = dataBus
+                        return [JobQueue.MERGED, None]
+
+            # queue is full, replace the lowest priority (the newest one if same priority)
+            evicted = None
+            if len(self.pending) >= self.depth:
+                low = min(self.pending, key = lambda ent: (ent[3], -ent[4]))
+                if low[3] >= priority:
+                    return [JobQueue.DROPPED, None]
+                self.pending.remove(low)
+                self.unfinished -= 1
+                evicted = low
+
+            # put the new command
+            self.seq += 1
+            self.pending.append([job, cmdId, mutex, priority, self.seq, time.monotonic(), dataBus, merge])
+            self.unfinished += 1
+            self.cond.notify()
+            return [JobQueue.QUEUED, evicted]
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the command with the highest priority (blocking)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def get(self):
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            ent = max(self.pending, key = lambda ent: (ent[3], -ent[4]))
+            self.pending.remove(ent)
+            return ent
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # indicate a command got by get() is finished
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def task_done(self):
+        with self.cond:
+            if self.unfinished > 0:
+                self.unfinished -= 1
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # queue status
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def qsize(self):
+        with self.cond:
+            return len(self.pending)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return self.qsize() >= self.depth
@@ -0,0 +1,218 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Statistics of a job registered to the Application
+# Note:
+#   1. The counters are updated in the PV callbacks and the Application
+#      thread, the local PVs are only written by the Application timer
+#      to avoid accessing PVs in the callbacks (see FSMLite Note1)
+#   2. The histograms and the max values only count the latest samples
+#      (rolling window). HIST-BINS has the finite upper edges of the bins,
+#      the last bin of the histograms counts the samples above all edges
+# -------------------------------------------------
+import threading
+import time
+import bisect
+import collections
+
+from ooepics.LocalPV import *
+
+# =================================
+# get the execution status from the return value of Job.execute()
+#   - [dataBus, status] : status
+#   - None              : no status returned, regarded as successful
+#   - others            : the value converted to bool
+# =================================
+def JobExeStatus(ret):
+    if isinstance(ret, (list, tuple)) and len(ret) == 2:
+        return bool(ret[1])
+    if ret is None:
+        return True
+    return bool(ret)
+
+# =================================
+# histogram of the latest samples
+# =================================
+class RollingHist:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    EDGES = [1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 0.1, 0.3, 1.0, 3.0, 10.0]   # upper edges of the bins, s
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the object
+    #
+    # inputs:
+    #   win_size    - int, number of latest samples counted
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, win_size = 1000):
+        self.samples = collections.deque(maxlen = win_size)     # [value, bin id]
+        self.counts  = [0] * (len(RollingHist.EDGES) + 1)       # last bin for overflow
+        self.total   = 0.0                                      # sum of the samples in window
+        self.max_val = 0.0                                      # max value of the samples in window
+        self.max_q   = collections.deque()                      # [sample id, value] decreasing, for max_val
+        self.cnt     = 0                                        # number of samples added
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # add a sample, the oldest one is removed if the window is full
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def add(self, value):
+        if len(self.samples) == self.samples.maxlen:
+            old_val, old_bin = self.samples[0]
+            self.counts[old_bin] -= 1
+            self.total -= old_val
+
+        bin_id = bisect.bisect_left(RollingHist.EDGES, value)
+        self.samples.append([value, bin_id])
+        self.counts[bin_id] += 1
+        self.total  += value
+
+        # sliding window max: drop the smaller values and the ones out of window
+        while self.max_q and self.max_q[-1][1] <= value:
+            self.max_q.pop()
+        self.max_q.append([self.cnt, value])
+        if self.max_q[0][0] <= self.cnt - self.samples.maxlen:
+            self.max_q.popleft()
+        self.max_val = self.max_q[0][1]
+        self.cnt    += 1
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the results
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def mean(self):
+        return self.total / len(self.samples) if self.samples else 0.0
+
+    def hist(self):
+        return list(self.counts)
+
+# =================================
+# statistics of a job
+# =================================
+class JobStat:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the object
+    #
+    # inputs:
+    #   modName     - string, module name (same as the command PVs)
+    #   jobName     - string, name of the job
+    #   win_size    - int, number of latest samples in the histograms
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, modName, jobName, win_size = 1000):
+        # save the input info
+        self.modName    = modName
+        self.jobName    = jobName
+
+        # counters
+        self.lock       = threading.Lock()
+        self.cnt_drop   = 0                 # commands dropped as the queue is full
+        self.cnt_merge  = 0                 # commands merged with a waiting one
+        self.cnt_ok     = 0                 # successful executions
+        self.cnt_fail   = 0                 # failed executions (including exceptions)
+        self.hist_wait  = RollingHist(win_size)     # time waiting in the queue, s
+        self.hist_exe   = RollingHist(win_size)     # execution time, s
+        self.cache      = None              # result cache of the job (see JobCache)
+
+        # variables to calculate the execution rate
+        self.rate_cnt   = 0
+        self.rate_time  = time.monotonic()
+        self.exe_rate   = 0.0
+
+        # local PVs for the statistics
+        nbins = len(RollingHist.EDGES) + 1
+        self.lpv_dropCnt  = LocalPV(modName, jobName, "DROP-CNT",      "", "",   1, "longin", "commands dropped")
+        self.lpv_mergeCnt = LocalPV(modName, jobName, "MERGE-CNT",     "", "",   1, "longin", "commands merged")
+        self.lpv_okCnt    = LocalPV(modName, jobName, "EXE-OK-CNT",    "", "",   1, "longin", "successful executions")
+        self.lpv_failCnt  = LocalPV(modName, jobName, "EXE-FAIL-CNT",  "", "",   1, "longin", "failed executions")
+        self.lpv_exeRate  = LocalPV(modName, jobName, "EXE-RATE",      "", "Hz", 1, "ai",     "executions per second")
+        self.lpv_exeAvg   = LocalPV(modName, jobName, "EXE-TIME-AVG",  "", "s",  1, "ai",     "mean execution time")
+        self.lpv_exeMax   = LocalPV(modName, jobName, "EXE-TIME-MAX",  "", "s",  1, "ai",     "max execution time")
+        self.lpv_waitAvg  = LocalPV(modName, jobName, "WAIT-TIME-AVG", "", "s",  1, "ai",     "mean time waiting in queue")
+        self.lpv_waitMax  = LocalPV(modName, jobName, "WAIT-TIME-MAX", "", "s",  1, "ai",     "max time waiting in queue")
+        self.lpv_exeHist  = LocalPV(modName, jobName, "EXE-TIME-HIST", "", "",   nbins, "waveform", "histogram of execution time")
+        self.lpv_waitHist = LocalPV(modName, jobName, "WAIT-TIME-HIST","", "",   nbins, "waveform", "histogram of waiting time")
+        self.lpv_histBins = LocalPV(modName, jobName, "HIST-BINS",     "", "s",  nbins - 1, "waveform", "finite upper edges of histogram bins")
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # publish also the counters of the result cache
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def set_cache(self, cache):
+        if self.cache is None:
+            self.lpv_cacheHit  = LocalPV(self.modName, self.jobName, "CACHE-HIT-CNT",  "", "", 1, "longin", "executions skipped by cache")
+            self.lpv_cacheMiss = LocalPV(self.modName, self.jobName, "CACHE-MISS-CNT", "", "", 1, "longin", "executions not in cache")
+        self.cache = cache
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # update the counters
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def count_drop(self):
+        with self.lock:
+            self.cnt_drop += 1
+
+    def count_merge(self):
+        with self.lock:
+            self.cnt_merge += 1
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # record an execution of the job
+    #   wait_time   - float, time waiting in the queue, s (None for periodic jobs)
+    #   exe_time    - float, execution time, s
+    #   status      - bool, execution successful or not
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def count_exe(self, wait_time, exe_time, status):
+        with self.lock:
+            if wait_time is not None:
+                self.hist_wait.add(wait_time)
+            self.hist_exe.add(exe_time)
+            if status: self.cnt_ok   += 1
+            else:      self.cnt_fail += 1
+            self.rate_cnt += 1
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the statistics as a dict
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def get_stat(self):
+        with self.lock:
+            # update the execution rate
+            cur_time = time.monotonic()
+            if cur_time - self.rate_time > 0.1:
+                self.exe_rate  = self.rate_cnt / (cur_time - self.rate_time)
+                self.rate_cnt  = 0
+                self.rate_time = cur_time
+
+            return {"drop":      self.cnt_drop,
+                    "merge":     self.cnt_merge,
+                    "ok":        self.cnt_ok,
+                    "fail":      self.cnt_fail,
+                    "rate":      self.exe_rate,
+                    "exe_avg":   self.hist_exe.mean(),
+                    "exe_max":   self.hist_exe.max_val,
+                    "exe_hist":  self.hist_exe.hist(),
+                    "wait_avg":  self.hist_wait.mean(),
+                    "wait_max":  self.hist_wait.max_val,
+                    "wait_hist": self.hist_wait.hist()}
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # write the statistics to the local PVs (only the changed ones)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def publish(self):
+        stat = self.get_stat()
+        self.lpv_dropCnt.write_changed (stat["drop"])
+        self.lpv_mergeCnt.write_changed(stat["merge"])
+        self.lpv_okCnt.write_changed   (stat["ok"])
+        self.lpv_failCnt.write_changed (stat["fail"])
+        self.lpv_exeRate.write_changed (stat["rate"])
+        self.lpv_exeAvg.write_changed  (stat["exe_avg"])
+        self.lpv_exeMax.write_changed  (stat["exe_max"])
+        self.lpv_waitAvg.write_changed (stat["wait_avg"])
+        self.lpv_waitMax.write_changed (stat["wait_max"])
+        self.lpv_exeHist.write_changed (stat["exe_hist"])
+        self.lpv_waitHist.write_changed(stat["wait_hist"])
+        self.lpv_histBins.write_changed(RollingHist.EDGES)
+
+        if self.cache is not None:
+            cstat = self.cache.get_stat()
+            self.lpv_cacheHit.write_changed (cstat["hit"])
+            self.lpv_cacheMiss.write_changed(cstat["miss"])
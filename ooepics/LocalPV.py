@@ -6,6 +6,8 @@
 # -------------------------------------------------
 # Python based implementation of LocalPV
 # -------------------------------------------------
+import numpy as np
+
 from ooepics.RecordTemplate import generateRecord
 from ooepics.RemotePV import *
 
@@ -67,7 +69,8 @@ class LocalPV:
                                 "initProc":     self.initProc})   
             
         # variables for object
-        self.pv = RemotePV(self.pvName, local = True)   # we use RemotePV to access local PV
+        self.pv         = RemotePV(self.pvName, local = True)   # we use RemotePV to access local PV
+        self.last_write = None                                  # last value written successfully
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # read the value of the local PV   
@@ -79,13 +82,32 @@ class LocalPV:
     # write value to the local PV   
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     def write(self, value, wait = False, timeout = 1.0):
-        return self.pv.write(value, wait = wait, timeout = timeout)
+        status = self.pv.write(value, wait = wait, timeout = timeout)
+        if status:
+            self.last_write = value
+        return status
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # write value to the local PV only if it is different from the last
+    # value written successfully (used to publish counters and states),
+    # return True if the PV has the value
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def write_changed(self, value, timeout = 1.0):
+        last = self.last_write
+        if last is not None:
+            if isinstance(last, np.ndarray) or isinstance(value, np.ndarray):
+                same = np.array_equal(last, value)
+            else:
+                same = (last == value)
+            if same:
+                return True
+        return self.write(value, timeout = timeout)
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # monitor the local PV   
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
-    def monitor(self, cbFun = None, cbArgList = None):
-        self.pv.monitor(cbFun, cbArgList = cbArgList)
+    def monitor(self, cbFun = None, cbArgList = None, meta = False):
+        self.pv.monitor(cbFun, cbArgList = cbArgList, meta = meta)
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # print all local PVs
@@ -0,0 +1,247 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Message logger with a ring buffer published to a waveform-text PV
+# Note:
+#   1. The messages are kept in a preallocated byte ring of fixed size
+#      slots. The ring is allocated twice and each message is written to
+#      both copies, so the newest-first window of all messages is always
+#      a contiguous part of the buffer and never rebuilt
+#   2. The PV is written by a timer (started by letGoing) at most once
+#      per publishing interval, a burst of messages is published together
+#   3. A message takes one line of the PV, the new lines in it are replaced
+#      by spaces. The slots are padded with NUL after the new line, the 
+#      padding is removed from the PV text
+#   4. The messages with a severity lower than min_severity are dropped,
+#      the unknown severities are always kept
+#   5. Optionally the messages are written to a rotating file by a
+#      background thread. If the writer is too slow, the messages are
+#      dropped from the file (not from the PV) and counted
+# -------------------------------------------------
+import threading
+import queue
+import time
+import os
+
+from ooepics.RepeatedTimer import *
+from ooepics.LocalPV import *
+
+# =================================
+# rotating file written by a background thread
+# =================================
+class LogFileSink:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the object
+    #
+    # inputs:
+    #   fileName    - string, path of the log file
+    #   max_bytes   - int, max size of a file before rotating
+    #   backup_cnt  - int, number of rotated files kept (fileName.1, .2, ...)
+    #   queue_depth - int, max number of lines waiting to be written
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, fileName, max_bytes = 10 * 1024 * 1024, backup_cnt = 5, queue_depth = 10000):
+        self.fileName   = fileName
+        self.max_bytes  = max_bytes if max_bytes > 0 else 10 * 1024 * 1024
+        self.backup_cnt = max(0, backup_cnt)
+        self.line_q     = queue.Queue(queue_depth if queue_depth >= 1 else 10000)
+        self.cnt_drop   = 0                 # lines dropped as the queue is full
+        self.file       = open(self.fileName, "a")
+        self.size       = self.file.tell()
+
+        self.thrd = threading.Thread(target = self._thrd_func,
+                                     daemon = True,
+                                     name   = "TRD-LogWriter")
+        self.thrd.start()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # put a line, never blocks
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def put(self, line):
+        try:
+            self.line_q.put_nowait(line)
+        except queue.Full:
+            self.cnt_drop += 1
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # wait until the lines are written and close the file
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        self.line_q.put(None)
+        self.line_q.join()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # rotate the files: fileName -> fileName.1 -> fileName.2 ...
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _rotate(self):
+        self.file.close()
+        if self.backup_cnt > 0:
+            for i in range(self.backup_cnt - 1, 0, -1):
+                src = "{}.{}".format(self.fileName, i)
+                if os.path.exists(src):
+                    os.replace(src, "{}.{}".format(self.fileName, i + 1))
+            os.replace(self.fileName, self.fileName + ".1")
+        self.file = open(self.fileName, "w")
+        self.size = 0
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # thread function, write the lines and flush when the queue is empty
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _thrd_func(self):
+        while True:
+            line = self.line_q.get()
+            try:
+                if line is None:
+                    self.file.close()
+                    return
+                if self.size + len(line) > self.max_bytes and self.size > 0:
+                    self._rotate()
+                self.file.write(line)
+                self.size += len(line)
+                if self.line_q.empty():
+                    self.file.flush()
+            except Exception as e:
+                print("ERROR: failed to write log file {}: {}".format(self.fileName, e))
+            finally:
+                self.line_q.task_done()
+
+# =================================
+# class of the log service
+# =================================
+class LogService:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    SEVERITIES = ["DEBUG", "INFO", "WARN", "ERROR"]     # from low to high
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the object
+    #
+    # inputs:
+    #   modName     - string, module name of the PV
+    #   prefixStr   - string, prefix of all messages
+    #   devName     - string, device name of the PV
+    #   valName     - string, value name of the PV
+    #   msg_num     - int, number of messages in the ring
+    #   msg_len     - int, max length of a message (including the new line)
+    #   pub_intv    - float, min interval to write the PV, s
+    #   echo        - bool, print the messages to stdout
+    #   min_severity - string, lowest severity logged (None for all)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, modName, prefixStr, devName = "LOG", valName = "MON-MSG",
+                       msg_num = 100, msg_len = 110, pub_intv = 0.5, echo = True, min_severity = None):
+        # save the input info
+        self.modName    = modName
+        self.prefixStr  = prefixStr
+        self.msg_num    = msg_num if msg_num >= 1 else 100
+        self.msg_len    = msg_len if msg_len >= 2 else 110
+        self.echo       = echo
+        self.set_min_severity(min_severity)
+
+        # the ring (two copies of msg_num slots), the newest message is in
+        # slot head and head + msg_num
+        self.lock       = threading.Lock()
+        self.ring       = bytearray(2 * self.msg_num * self.msg_len)
+        self.head       = 0
+        self.count      = 0                 # number of messages in the ring
+        self.dirty      = False             # new messages not published
+        self.sink       = None              # file sink
+
+        # local PV and the timer to publish (will be started later)
+        self.lpv_monLogMsg = LocalPV(self.modName, devName, valName, "", "", \
+            self.msg_num * self.msg_len, "waveform-text", "Run-time messages")
+        self.timer = RepeatedTimer(pub_intv, self.publish)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # start publishing the PV
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def letGoing(self):
+        self.timer.start()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # set the lowest severity logged, None for all
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def set_min_severity(self, severity):
+        if severity is None:
+            self.min_level = 0
+        elif severity in LogService.SEVERITIES:
+            self.min_level = LogService.SEVERITIES.index(severity)
+        else:
+            print("ERROR: unknown severity {}, all messages logged".format(severity))
+            self.min_level = 0
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # write the messages to a rotating file
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def set_file_sink(self, fileName, max_bytes = 10 * 1024 * 1024, backup_cnt = 5):
+        sink, self.sink = self.sink, LogFileSink(fileName, max_bytes, backup_cnt)
+        if sink is not None:
+            sink.close()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # post a message
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def postMessage(self, prefix, severity, msg):
+        # drop the messages below the min severity
+        if self.min_level > 0 and severity in LogService.SEVERITIES and \
+           LogService.SEVERITIES.index(severity) < self.min_level:
+            return
+
+        # make up the message string, one line
+        msgStr  = time.strftime("[%Y-%m-%d %H:%M:%S] ", time.localtime(Clock.time()))
+        msgStr += self.prefixStr + "|" + severity + ": " + prefix + ": " + msg
+        msgStr  = msgStr.replace("\r\n", " ").replace("\n", " ").replace("\r", " ")
+
+        if self.echo:
+            print(msgStr)
+        if self.sink is not None:
+            self.sink.put(msgStr + "\n")
+
+        # fixed size slot, padded with NUL after the new line
+        data = msgStr.encode("ascii", "replace")[:self.msg_len - 1] + b"\n"
+        data = data.ljust(self.msg_len, b"\0")
+
+        # write to both copies of the slot
+        with self.lock:
+            self.head = (self.head - 1) % self.msg_num
+            pos1 = self.head * self.msg_len
+            pos2 = pos1 + self.msg_num * self.msg_len
+            self.ring[pos1 : pos1 + self.msg_len] = data
+            self.ring[pos2 : pos2 + self.msg_len] = data
+            self.count = min(self.count + 1, self.msg_num)
+            self.dirty = True
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the messages, newest first (the padding removed)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def get_text(self):
+        with self.lock:
+            pos = self.head * self.msg_len
+            return self.ring[pos : pos + self.count * self.msg_len].replace(b"\0", b"").decode("ascii")
+
+    def get_messages(self):
+        return self.get_text().splitlines()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # write the PV if there are new messages (called by the timer)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def publish(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+        if not self.lpv_monLogMsg.write(self.get_text()):
+            with self.lock:
+                self.dirty = True
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # stop publishing and close the file
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def close(self):
+        self.timer.stop()
+        self.publish()
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
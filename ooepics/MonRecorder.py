@@ -0,0 +1,306 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Record and replay of the monitor events of RemotePV and LocalPV
+# Note:
+#   1. MonRecorder.start() opens a new log (optionally for a subset of
+#      the PVs) and stop() closes it. Outside a recording the monitor
+#      callbacks of RemotePV skip record() entirely
+#   2. Each monitor event (PV name, value, timestamp, severity, status and
+#      the time received) is packed with struct to a binary log. A PV name
+#      is written once and later referred by its id. The values are stored
+#      as float, int, string or numpy array (waveforms)
+#   3. An event is recorded once even if the PV is monitored several
+#      times, and the replay feeds it to all monitor callbacks of the PV,
+#      as the CA does
+#   4. MonReplay feeds the log to the monitor callbacks registered in this
+#      process (RemotePV.monitor), with the original timing, scaled by a
+#      speed factor or as fast as possible. The PVs need not be connected
+# -------------------------------------------------
+import threading
+import struct
+import mmap
+import time
+import math
+import numpy as np
+
+from ooepics.ExcAggregator import *
+
+# =================================
+# format of the log
+# =================================
+MON_MAGIC   = b"OOEPMON1"
+MON_HEADER  = struct.Struct("<8sd")         # magic, start time
+MON_NAME    = struct.Struct("<BIH")         # type, PV id, length of the name
+MON_EVENT   = struct.Struct("<BIddhhc")     # type, PV id, timestamp, time received (monotonic), severity, status, kind of value
+MON_LEN     = struct.Struct("<I")           # length of string/array
+MON_INT     = struct.Struct("<q")
+MON_FLOAT   = struct.Struct("<d")
+
+REC_NAME    = 0
+REC_EVENT   = 1
+
+# =================================
+# recorder
+# =================================
+class MonRecorder:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    enabled     = False
+    lock        = threading.Lock()
+    file        = None
+    fileName    = None
+    pv_ids      = {}                    # pvName -> id in the log
+    owners      = {}                    # pvName -> callback recording the PV
+    pv_filter   = None                  # set of PV names to record, None for all
+    cnt_event   = 0
+    cnt_bytes   = 0
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # start/stop the recording
+    #   fileName    - string, the log file (overwritten)
+    #   pvs         - list of PV names to record, None for all
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def start(cls, fileName, pvs = None):
+        cls.stop()
+        with cls.lock:
+            try:
+                cls.file = open(fileName, "wb", buffering = 1048576)
+            except IOError:
+                print("ERROR: failed to create monitor log " + fileName)
+                return False
+            cls.fileName  = fileName
+            cls.pv_ids    = {}
+            cls.owners    = {}
+            cls.pv_filter = set(pvs) if pvs is not None else None
+            cls.cnt_event = 0
+            cls.cnt_bytes = MON_HEADER.size
+            cls.file.write(MON_HEADER.pack(MON_MAGIC, time.time()))
+            cls.enabled   = True
+        return True
+
+    @classmethod
+    def stop(cls):
+        with cls.lock:
+            cls.enabled = False
+            if cls.file is not None:
+                cls.file.close()
+                cls.file = None
+
+    @classmethod
+    def get_stat(cls):
+        return {"file":   cls.fileName,
+                "events": cls.cnt_event,
+                "pvs":    len(cls.pv_ids),
+                "bytes":  cls.cnt_bytes}
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # record an event (called by the monitor callbacks of RemotePV)
+    #   cb          - the callback calling, only one callback records a PV
+    #   pvName      - string, name of the PV
+    #   value       - value of the event
+    #   kw          - dict, other arguments of the CA callback
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def record(cls, cb, pvName, value, kw):
+        if cls.pv_filter is not None and pvName not in cls.pv_filter:
+            return
+        rtime = time.monotonic()
+        ts    = kw.get('timestamp')
+        kind, data = encode_value(value)
+        with cls.lock:
+            if not cls.enabled or cls.owners.setdefault(pvName, cb) is not cb:
+                return
+            pid = cls.pv_ids.get(pvName)
+            if pid is None:
+                pid  = len(cls.pv_ids)
+                name = pvName.encode()
+                cls.pv_ids[pvName] = pid
+                cls.file.write(MON_NAME.pack(REC_NAME, pid, len(name)) + name)
+                cls.cnt_bytes += MON_NAME.size + len(name)
+            rec = MON_EVENT.pack(REC_EVENT, pid,
+                                 ts if ts is not None else math.nan,
+                                 rtime,
+                                 kw.get('severity') or 0,
+                                 kw.get('status') or 0,
+                                 kind) + data
+            cls.file.write(rec)
+            cls.cnt_event += 1
+            cls.cnt_bytes += len(rec)
+
+# =================================
+# encode/decode the values
+# =================================
+def encode_value(value):
+    if value is None:
+        return [b'n', b'']
+    if isinstance(value, (bool, int, np.integer)):
+        return [b'q', MON_INT.pack(int(value))]
+    if isinstance(value, (float, np.floating)):
+        return [b'd', MON_FLOAT.pack(float(value))]
+    if isinstance(value, (str, bytes)):
+        data = value.encode() if isinstance(value, str) else value
+        return [b's' if isinstance(value, str) else b'b', MON_LEN.pack(len(data)) + data]
+    arr   = np.ascontiguousarray(value)
+    dtype = arr.dtype.str.encode()
+    return [b'a', bytes([len(dtype)]) + dtype + MON_LEN.pack(arr.size) + arr.tobytes()]
+
+def decode_value(kind, buf, pos):
+    if kind == b'n':
+        return [None, pos]
+    if kind == b'q':
+        return [MON_INT.unpack_from(buf, pos)[0], pos + MON_INT.size]
+    if kind == b'd':
+        return [MON_FLOAT.unpack_from(buf, pos)[0], pos + MON_FLOAT.size]
+    if kind in (b's', b'b'):
+        n    = MON_LEN.unpack_from(buf, pos)[0]
+        pos += MON_LEN.size
+        data = bytes(buf[pos : pos + n])
+        return [data.decode() if kind == b's' else data, pos + n]
+    if kind == b'a':
+        dlen  = buf[pos]
+        dtype = np.dtype(bytes(buf[pos + 1 : pos + 1 + dlen]).decode())
+        pos  += 1 + dlen
+        n     = MON_LEN.unpack_from(buf, pos)[0]
+        pos  += MON_LEN.size
+        arr   = np.frombuffer(buf, dtype = dtype, count = n, offset = pos).copy()
+        return [arr, pos + n * dtype.itemsize]
+    raise ValueError("unknown value kind {}".format(kind))
+
+# string of the value as pyepics (converting a waveform is too slow)
+def char_str(value):
+    if isinstance(value, np.ndarray):
+        return "<array size={}, type={}>".format(value.size, value.dtype)
+    return str(value)
+
+# =================================
+# replay
+# =================================
+class MonReplay:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the object
+    #   fileName    - string, the log file
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, fileName):
+        self.fileName   = fileName
+        self.start_time = None          # time when the log was started
+        self.stop_cmd   = False
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # iterate the events of the log, yield
+    #   [pvName, value, timestamp, severity, status, time received]
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def events(self):
+        with open(self.fileName, "rb") as f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as buf:
+            magic, self.start_time = MON_HEADER.unpack_from(buf, 0)
+            if magic != MON_MAGIC:
+                raise ValueError("{} is not a monitor log".format(self.fileName))
+
+            names = {}
+            pos   = MON_HEADER.size
+            while pos < len(buf):
+                try:
+                    if buf[pos] == REC_NAME:
+                        _, pid, n = MON_NAME.unpack_from(buf, pos)
+                        pos      += MON_NAME.size
+                        names[pid] = buf[pos : pos + n].decode()
+                        pos      += n
+                        continue
+                    _, pid, ts, rtime, sevr, stat, kind = MON_EVENT.unpack_from(buf, pos)
+                    value, pos = decode_value(kind, buf, pos + MON_EVENT.size)
+                    pvName     = names[pid]
+                except (struct.error, ValueError, TypeError, KeyError):
+                    print("WARNING: monitor log {} truncated or corrupted".format(self.fileName))
+                    return
+                yield [pvName, value, None if math.isnan(ts) else ts, sevr, stat, rtime]
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # summary of the log: number of events of each PV and the duration
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def summary(self):
+        pvs     = {}
+        t_first = t_last = None
+        for evt in self.events():
+            pvs[evt[0]] = pvs.get(evt[0], 0) + 1
+            if t_first is None: t_first = evt[5]
+            t_last = evt[5]
+        return {"start_time": self.start_time,
+                "events":     sum(pvs.values()),
+                "duration":   0.0 if t_first is None else t_last - t_first,
+                "pvs":        pvs}
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # feed the events to the monitor callbacks, return the statistics
+    #   speed       - float, 1.0 for the original timing, 2.0 for twice as
+    #                 fast, None or 0 as fast as possible
+    #   pvs         - list of PV names to replay, None for all
+    #   use_time    - bool, replace the timestamps by the current time
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def replay(self, speed = 1.0, pvs = None, use_time = False):
+        from ooepics.RemotePV import RemotePV
+
+        # the monitor callbacks of the PVs
+        callbacks = {}
+        for pvConfig in RemotePV.RPVList:
+            callbacks.setdefault(pvConfig["pvName"], []).extend(pvConfig["obj"].mon_cbs)
+
+        pv_filter     = set(pvs) if pvs is not None else None
+        self.stop_cmd = False
+        cnt_event     = 0
+        cnt_fed       = 0
+        missing       = set()
+        max_late      = 0.0
+        t_rec0        = None
+        t_start       = time.monotonic()
+
+        for pvName, value, ts, sevr, stat, rtime in self.events():
+            if self.stop_cmd:
+                break
+            if pv_filter is not None and pvName not in pv_filter:
+                continue
+            cnt_event += 1
+
+            # keep the timing of the log
+            if t_rec0 is None:
+                t_rec0 = rtime
+            if speed:
+                due = t_start + (rtime - t_rec0) / speed
+                dt  = due - time.monotonic()
+                if dt > 0: time.sleep(dt)
+                else:      max_late = max(max_late, -dt)
+
+            cbs = callbacks.get(pvName)
+            if not cbs:
+                missing.add(pvName)
+                continue
+            char_value = char_str(value)
+            for cb in cbs:
+                try:
+                    cb(pvname     = pvName,
+                       value      = value,
+                       char_value = char_value,
+                       timestamp  = time.time() if use_time else ts,
+                       severity   = sevr,
+                       status     = stat)
+                except:
+                    ExcAggregator.report("replay " + pvName)
+                cnt_fed += 1
+
+        elapsed = time.monotonic() - t_start
+        return {"events":   cnt_event,
+                "fed":      cnt_fed,
+                "elapsed":  elapsed,
+                "rate":     cnt_event / elapsed if elapsed > 0 else 0.0,
+                "max_late": max_late,
+                "missing":  sorted(missing)}
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # stop a replay running in another thread
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def stop(self):
+        self.stop_cmd = True
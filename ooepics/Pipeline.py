@@ -0,0 +1,104 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Pipeline of jobs streaming the dataBus between stages
+# Note:
+#   1. Each stage is a job executed by its own thread. The dataBus
+#      returned by a stage (execute() returns [dataBus, status]) is put
+#      to the bounded queue of the next stage, so the stages overlap
+#   2. If a stage fails (status False or exception), the data is not
+#      passed to the next stage. If execute() does not return a list,
+#      the input dataBus is passed on
+#   3. A full queue blocks the previous stage (back pressure), only the
+#      input of the first stage drops data when it is full
+# -------------------------------------------------
+import threading
+import time
+import queue
+
+from ooepics.JobStat import *
+from ooepics.ExcAggregator import *
+
+# =================================
+# callback function for the command PV of the pipeline
+# =================================
+def PipelineCmdCbFunc(cbArgs):
+    ppl    = cbArgs[0]                      # object of the pipeline
+    cmdId  = cbArgs[1]                      # id of the command
+    cmdVal = cbArgs[-1]                     # command PV value
+    if cmdVal == 1:
+        ppl.feed(cmdId)
+
+# =================================
+# class for pipeline
+# =================================
+class Pipeline:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the object
+    #
+    # inputs:
+    #   app         - object of the Application, executes the jobs with statistics
+    #   pplName     - string, name of the pipeline
+    #   stages      - list of jobs, executed one after another
+    #   queue_depth - int, max number of data waiting for each stage
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, app, pplName, stages, queue_depth = 2):
+        # save the input info
+        self.app        = app
+        self.pplName    = pplName
+        self.stages     = stages
+        self.queues     = [queue.Queue(queue_depth if queue_depth >= 1 else 2) for job in stages]
+        self.threads    = []
+
+        # statistics of the stages
+        for job in self.stages:
+            self.app.getJobStat(job)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # feed data to the first stage, return False if the data is dropped
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def feed(self, cmdId = 0, dataBus = None):
+        try:
+            self.queues[0].put_nowait([cmdId, dataBus, time.monotonic()])
+            return True
+        except queue.Full:
+            self.app.getJobStat(self.stages[0]).count_drop()
+            return False
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # start the threads of the stages
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def letGoing(self):
+        for stageId in range(len(self.stages)):
+            thrd = threading.Thread(target = self._thrd_func,
+                                    args   = (stageId,),
+                                    daemon = True,
+                                    name   = "PPL-{}-{}".format(self.pplName, stageId))
+            print("Thread " + thrd.name + " started.")
+            thrd.start()
+            self.threads.append(thrd)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # thread function of a stage
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _thrd_func(self, stageId):
+        job   = self.stages[stageId]
+        inQ   = self.queues[stageId]
+        outQ  = self.queues[stageId + 1] if stageId + 1 < len(self.stages) else None
+
+        while True:
+            cmdId, dataBus, tPut = inQ.get()
+            try:
+                ret = self.app.executeJob(job, cmdId, dataBus, tPut)
+
+                # pass the data to the next stage
+                if JobExeStatus(ret) and outQ is not None:
+                    if isinstance(ret, (list, tuple)) and len(ret) == 2:
+                        dataBus = ret[0]
+                    outQ.put([cmdId, dataBus, time.monotonic()])
+            except:
+                ExcAggregator.report("pipeline " + self.pplName + " stage " + job.jobName)
+            inQ.task_done()
@@ -7,6 +7,12 @@
 # Python based implementation of RemotePV using PyEpics
 # -------------------------------------------------
 import epics
+import time
+
+from ooepics.AdmissionCtrl import *
+from ooepics.CAProfiler import *
+from ooepics.Tracer import *
+from ooepics.MonRecorder import *
 
 class RemotePV:
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -28,9 +34,11 @@ class RemotePV:
         RemotePV.RPVList.append({"obj": self, "pvName": self.pvName, "local": local})
 
         # variables for object
+        self.local      = local     # local PV, not limited by the admission control
         self.pv         = None      # object of epics.PV, be created later
         self.enable_mon = False     # indicate if the PV is monitored or not
         self.auto_mon   = auto_mon
+        self.mon_cbs    = []        # monitor callbacks, used by MonReplay
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # create the PV object - will automatically connect
@@ -82,12 +90,29 @@ class RemotePV:
         # init the results
         results = [None, None, False, False]
 
-        # get the data
+        # get the data (reading the monitored value is not a CA operation)
         if self.pv:
-            data = self.pv.get_with_metadata(form        = 'time',
-                                             as_string   = return_str,
-                                             use_monitor = self.enable_mon or use_monitor,
-                                             timeout     = timeout)
+            cached  = self.enable_mon or use_monitor
+            limited = not (self.local or cached)
+            prof    = CAProfiler.enabled
+            trace   = Tracer.enabled and not cached                     # flags read once, may change meanwhile
+            if prof:  t0  = time.perf_counter()
+            if trace: tt0 = time.monotonic()
+            if limited and not AdmissionCtrl.ca_enter(timeout):
+                if prof: CAProfiler.record(self, "get", time.perf_counter() - t0, False)
+                return results
+            try:
+                data = self.pv.get_with_metadata(form        = 'time',
+                                                 as_string   = return_str,
+                                                 use_monitor = cached,
+                                                 timeout     = timeout)
+            finally:
+                if limited: AdmissionCtrl.ca_exit()
+                if trace:
+                    Tracer.add_span("get " + self.pvName, "ca", tt0, time.monotonic())
+            if prof:
+                if cached: CAProfiler.record_cached(self)
+                else:      CAProfiler.record(self, "get", time.perf_counter() - t0, data is not None)
             if data is not None:
                 results = [data['value'], 
                            data['timestamp'],
@@ -103,6 +128,14 @@ class RemotePV:
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     def write(self, value, wait = False, timeout = 1.0):
         if self.pv:
+            prof   = CAProfiler.enabled
+            trace  = Tracer.enabled                                     # flags read once, may change meanwhile
+            status = None
+            if prof:  t0  = time.perf_counter()
+            if trace: tt0 = time.monotonic()
+            if not (self.local or AdmissionCtrl.ca_enter(timeout)):
+                if prof: CAProfiler.record(self, "put", time.perf_counter() - t0, False)
+                return False
             try:
                 # pv.put return value: 1 for success, -1 on time-out
                 # see: https://github.com/pyepics/pyepics/blob/master/epics/pv.py
@@ -111,24 +144,65 @@ class RemotePV:
                 return status == 1
             except:
                 return False
+            finally:
+                if not self.local: AdmissionCtrl.ca_exit()
+                if prof: CAProfiler.record(self, "put", time.perf_counter() - t0, status == 1)
+                if trace: Tracer.add_span("put " + self.pvName, "ca", tt0, time.monotonic())
         else:
             return False
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # write the latest values of a list, only the last value of each PV is
+    # written. Note that it is a dedup helper and not a CA batch: each 
+    # value is written with write() (pyepics flushes every put)
+    #   pvVals: list of [pv, value], pv is RemotePV or LocalPV
+    #   return the list of PVs failed to write
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def write_latest(cls, pvVals, timeout = 1.0):
+        latest = {}
+        for pv, value in pvVals:
+            latest[id(pv)] = [pv, value]
+
+        failed = []
+        for pv, value in latest.values():
+            if not pv.write(value, timeout = timeout):
+                failed.append(pv)
+        return failed
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # monitor the remote PV   
+    #   meta: if True, the last component of the callback args is 
+    #         [value, timestamp, severity_ok, status_ok] as read(), 
+    #         otherwise it is the value
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
-    def monitor(self, cbFun = None, cbArgList = None):
-        # remember the arg list
-        if cbArgList: self.cbArgs = cbArgList.copy()
-        else:         self.cbArgs = []
-        self.cbArgs.append(0)                   # place holder for the value
+    def monitor(self, cbFun = None, cbArgList = None, meta = False):
+        # remember the arg list (each monitor has its own list)
+        if cbArgList: cbArgs = cbArgList.copy()
+        else:         cbArgs = []
+        cbArgs.append(0)                        # place holder for the value
+        self.cbArgs = cbArgs
 
         # local callback for the monitor
         def py_cb(pvname = None, value = None, char_value = None, **kw):
             if pvname == self.pvName:
-                self.cbArgs[-1] = value
-                if cbFun:
-                    cbFun(self.cbArgs)
+                if MonRecorder.enabled:
+                    MonRecorder.record(py_cb, pvname, value, kw)
+                if meta:
+                    cbArgs[-1] = [value,
+                                  kw.get('timestamp'),
+                                  kw.get('severity') == 0,
+                                  kw.get('status') not in {9, 10, 18, 20}]
+                else:
+                    cbArgs[-1] = value
+                if CAProfiler.enabled:
+                    t0 = time.perf_counter()
+                    try:
+                        if cbFun: cbFun(cbArgs)
+                    finally:
+                        CAProfiler.record(self, "mon", time.perf_counter() - t0)
+                elif cbFun:
+                    cbFun(cbArgs)
 
         # if PV object not created, create it
         self.create()
@@ -136,6 +210,7 @@ class RemotePV:
         # start the monitor by adding the callback function
         try:
             self.pv.add_callback(py_cb)
+            self.mon_cbs.append(py_cb)
             self.enable_mon = True
         except:
             print('ERROR: failed to monitor PV ' + self.pvName)
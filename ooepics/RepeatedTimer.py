@@ -5,19 +5,50 @@
 #####################################################################
 # -------------------------------------------------
 # Timer implementation
+# Note:
+#   1. All timers are served by the central TimerScheduler, no thread is
+#      created for each tick
+#   2. By default the timer is re-armed after the user callback returns
+#      (fixed delay), the period is the interval plus the execution time.
+#      If auto_rearm is False, the owner calls start() to re-arm it, e.g.
+#      when the work queued by the callback is finished.
+#      In fixed rate mode, the ticks are on a grid of the monotonic clock
+#      and the overrun policy defines what to do with the missed ticks:
+#       - "skip"    : the missed ticks are skipped, wait for the next one
+#       - "catchup" : the missed ticks are executed one after another
+#       - "merge"   : the missed ticks are executed once immediately
+#   3. The time is got from Clock, which may be virtual
+#   4. The callbacks are executed by the shared workers of the scheduler
+#      and should be short, long work should be queued to a thread (as the
+#      periodic jobs of Application). The timer is re-armed even if the
+#      callback raises
 # -------------------------------------------------
-from threading import Timer
+import threading
+import time
+
+from ooepics.TimerScheduler import *
+from ooepics.Tracer import *
+from ooepics.Watchdog import *
 
 # =================================
 # class definition
 # =================================
 class RepeatedTimer():
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    MIN_INTV        = 0.1                           # min interval in fixed delay mode, s
+    MIN_INTV_FR     = 0.001                         # min interval in fixed rate mode, s
+    MAX_CATCHUP     = 100                           # max missed ticks to catch up
+    OVERRUN_POLICY  = {"skip", "catchup", "merge"}
+
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # define the timer
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~  
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
     def __init__(self, interval, user_cb, *args, **kwargs):
         # save the input
-        self.interval   = interval if interval >= 0.1 else 1
+        self.req_intv   = interval
+        self.interval   = interval if interval >= RepeatedTimer.MIN_INTV else 1
         self.user_cb    = user_cb
         self.args       = args
         self.kwargs     = kwargs
@@ -25,29 +56,149 @@ class RepeatedTimer():
         # define the object and variables
         self.cmd_stop       = False         # indicate stop command received
         self.timer_waiting  = False         # indicate if the timer is in waiting stage
-        self.timer          = None          # object of the timer
+        self.timer          = None          # entry in the scheduler
+        self.lock           = threading.Lock()  # protect the entry for stop and postpone
+        self.postpone_to    = None          # deadline the next tick is pushed back to
+        self.auto_rearm     = True          # re-arm after the callback (fixed delay only)
+
+        # variables for fixed rate mode
+        self.fixed_rate     = False         # True for fixed rate mode
+        self.overrun        = "skip"        # overrun policy
+        self.next_time      = 0.0           # deadline of the next tick on the grid
+        self.counted_until  = 0.0           # deadline of the last tick counted as overrun
+        self.merged_ticks   = 0             # number of ticks merged in the current execution
+        self.reset_stat()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # switch to fixed rate mode
+    #   enable      - bool, True for fixed rate, False for fixed delay
+    #   overrun     - string, overrun policy, "skip", "catchup" or "merge"
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def set_fixed_rate(self, enable = True, overrun = "skip"):
+        if overrun not in RepeatedTimer.OVERRUN_POLICY:
+            print("ERROR: RepeatedTimer overrun policy {} not supported!".format(overrun))
+            return
+
+        self.fixed_rate = enable
+        self.overrun    = overrun
+        min_intv        = RepeatedTimer.MIN_INTV_FR if enable else RepeatedTimer.MIN_INTV
+        self.interval   = self.req_intv if self.req_intv >= min_intv else 1
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # timing statistics (only updated in fixed rate mode)
+    #   lateness    - time from the deadline to the execution, s
+    #   jitter      - deviation of the period between executions, s
+    #   overrun     - number of ticks missed as the execution is too long
+    #   merged      - number of missed ticks executed in merged executions
+    #   merged_last - ticks merged in the current (or last) execution, can
+    #                 be read by the callback to scale its work
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def reset_stat(self):
+        self.cnt_tick       = 0
+        self.cnt_overrun    = 0
+        self.cnt_merged     = 0
+        self.late_last      = 0.0
+        self.late_max       = 0.0
+        self.late_sum       = 0.0
+        self.jitter_last    = 0.0
+        self.jitter_max     = 0.0
+        self.jitter_sum     = 0.0
+        self.last_fire      = None
+
+    def get_stat(self):
+        return {"ticks":       self.cnt_tick,
+                "overrun":     self.cnt_overrun,
+                "merged":      self.cnt_merged,
+                "merged_last": self.merged_ticks,
+                "late_last":   self.late_last,
+                "late_max":    self.late_max,
+                "late_avg":    self.late_sum / self.cnt_tick if self.cnt_tick > 0 else 0.0,
+                "jitter_last": self.jitter_last,
+                "jitter_max":  self.jitter_max,
+                "jitter_avg":  self.jitter_sum / (self.cnt_tick - 1) if self.cnt_tick > 1 else 0.0}
+
+    def _update_stat(self, fire_time):
+        self.cnt_tick  += 1
+        self.late_last  = max(0.0, fire_time - self.next_time)
+        self.late_max   = max(self.late_max, self.late_last)
+        self.late_sum  += self.late_last
+
+        if self.last_fire is not None:
+            self.jitter_last = abs(fire_time - self.last_fire - self.interval)
+            self.jitter_max  = max(self.jitter_max, self.jitter_last)
+            self.jitter_sum += self.jitter_last
+        self.last_fire = fire_time
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # callback function
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~  
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
     def _timer_cb(self):
+        # the tick was pushed back, wait until the new deadline
+        with self.lock:
+            due, self.postpone_to = self.postpone_to, None
+            if due is not None and not self.cmd_stop and due > Clock.monotonic():
+                self.next_time = due
+                self.timer     = TimerScheduler.schedule(self._timer_cb, due)
+                return
+
         # when callback is called, means timer fired
         self.timer_waiting = False
+        if self.fixed_rate:
+            self._update_stat(Clock.monotonic())
+
+        # execute the callback function, re-arm the timer even if it raises
+        wdog = None
+        try:
+            if self.user_cb:
+                wdog = Watchdog.begin(None, getattr(self.user_cb, "__qualname__", "timer"), "timer") if Watchdog.enabled else None
+                if Tracer.enabled:
+                    with Tracer.span(getattr(self.user_cb, "__qualname__", "timer"), "timer"):
+                        self.user_cb(*self.args, **self.kwargs)
+                else:
+                    self.user_cb(*self.args, **self.kwargs)
+        finally:
+            Watchdog.end(wdog)
+            if not self.cmd_stop:
+                if self.fixed_rate:        self._rearm_fixed_rate()
+                elif self.auto_rearm:      self.start()
 
-        # execute the callback function
-        if self.user_cb:
-            self.user_cb(*self.args, **self.kwargs)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # re-arm the timer at the next tick of the grid (fixed rate mode)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _rearm_fixed_rate(self):
+        self.next_time   += self.interval
+        self.merged_ticks = 0
+        cur_time          = Clock.monotonic()
+
+        # handle the overrun
+        if cur_time > self.next_time:
+            missed            = int((cur_time - self.next_time) / self.interval) + 1
+            last_missed       = self.next_time + (missed - 1) * self.interval
+
+            # count the missed ticks only once (in catchup they are seen again)
+            if self.next_time > self.counted_until:
+                self.cnt_overrun += missed
+            elif last_missed > self.counted_until:
+                self.cnt_overrun += int(round((last_missed - self.counted_until) / self.interval))
+            self.counted_until = max(self.counted_until, last_missed)
+
+            if self.overrun == "skip" or missed > RepeatedTimer.MAX_CATCHUP:
+                self.next_time += missed * self.interval
+            elif self.overrun == "merge":
+                self.next_time   += (missed - 1) * self.interval
+                self.merged_ticks = missed
+                self.cnt_merged  += missed
 
-        # re-call the start function
-        if not self.cmd_stop:
-            self.start()
+        if not self.timer_waiting:
+            self.timer_waiting = True
+            self.timer         = TimerScheduler.schedule(self._timer_cb, self.next_time)
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # start the timer
-    # note: the "Timer" object only run once and the object will be discarded, 
-    #       we need to repeat defining new Timer object to continue. In this 
-    #       case, the timer is natrally only started after the user callback
-    #       function is finished (as in the _timer_cb routine)
+    # note: the scheduler entry only fires once, we need to schedule a new
+    #       entry to continue. In this case, the timer is natrally only
+    #       started after the user callback function is finished (as in
+    #       the _timer_cb routine)
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     def start(self, new_intv = None):
         # possibly update the interval
@@ -57,21 +208,48 @@ class RepeatedTimer():
         # re-arm the timer
         if not self.timer_waiting:
             self.timer_waiting = True
-            self.timer         = Timer(self.interval, self._timer_cb)
-            self.timer.start()
+            self.next_time     = Clock.monotonic() + self.interval
+            self.last_fire     = None
+            self.counted_until = 0.0
+            self.postpone_to   = None
+            self.timer         = TimerScheduler.schedule(self._timer_cb, self.next_time)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # push back the next tick to one interval from now, e.g. the work was
+    # done by other events. The entry in the scheduler is kept, when it 
+    # fires it is re-armed to the new deadline, so frequent calls are cheap
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def postpone(self):
+        with self.lock:
+            if self.timer_waiting and not self.cmd_stop:
+                self.postpone_to = Clock.monotonic() + self.interval
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # shift the times of the timer (called by TimerScheduler when the clock
+    # leaves the virtual mode)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _shift_time(self, delta):
+        self.next_time += delta
+        if self.counted_until > 0.0:
+            self.counted_until += delta
+        if self.postpone_to is not None:
+            self.postpone_to += delta
+        if self.last_fire is not None:
+            self.last_fire += delta
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # stop the repeated timer
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     def stop(self):
-        # stop the timer, and cancel the execution of the timer’s action. 
+        # stop the timer, and cancel the execution of the timer’s action.
         # this will only work if the timer is still in its waiting stage.
-        if self.timer:
-            self.timer.cancel()
-            self.timer_waiting = False
+        with self.lock:
+            if self.timer:
+                TimerScheduler.cancel(self.timer)
+                self.timer_waiting = False
 
-        # be sure the timer will be stopped
-        self.cmd_stop = True
+            # be sure the timer will be stopped
+            self.cmd_stop = True
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # reset the timer after stop
@@ -79,33 +257,3 @@ class RepeatedTimer():
     def reset(self):
         # clear the stop command
         self.cmd_stop = False
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
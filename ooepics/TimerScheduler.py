@@ -0,0 +1,191 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Central scheduler serving all timers of the soft IOC
+# Note:
+#   1. One thread waits for the earliest deadline in a heap, the fired
+#      callbacks are executed by a pool of worker threads. The workers
+#      are created on demand (up to MAX_WORKERS) and then reused, so the
+#      number of threads does not grow with the number of timers
+#   2. A cancelled entry stays in the heap and is discarded when fired
+#   3. The deadlines are based on Clock.monotonic(). In virtual mode, the
+#      scheduler thread does not fire, run_virtual() executes the entries
+#      in the calling thread (see Clock)
+# -------------------------------------------------
+import threading
+import heapq
+import queue
+import time
+
+from ooepics.Clock import *
+from ooepics.ExcAggregator import *
+
+class TimerScheduler:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    MAX_WORKERS = 16                    # max number of worker threads
+
+    cond        = threading.Condition() # protect the heap and wake up the scheduler thread
+    heap        = []                    # entries: [deadline, seq, callback, active]
+    seq         = 0                     # sequence number to keep order of same deadline
+    thread      = None                  # scheduler thread
+    readyQ      = queue.Queue()         # fired callbacks waiting for workers
+    workers     = []                    # worker threads
+    pending     = 0                     # callbacks dispatched and not finished
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # schedule a callback at the deadline (Clock.monotonic() based), return
+    # the entry which can be used to cancel it
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def schedule(cls, callback, deadline):
+        with cls.cond:
+            # start the scheduler thread if not yet
+            if cls.thread is None:
+                cls.thread = threading.Thread(target = cls._thrd_func,
+                                              daemon = True,
+                                              name   = "TRD-TimerScheduler")
+                cls.thread.start()
+
+            cls.seq += 1
+            entry = [deadline, cls.seq, callback, True]
+            heapq.heappush(cls.heap, entry)
+
+            # wake up the thread if the new entry is the earliest
+            if cls.heap[0] is entry:
+                cls.cond.notify()
+            return entry
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # cancel a scheduled entry, return False if it has already fired
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def cancel(cls, entry):
+        with cls.cond:
+            active   = entry[3]
+            entry[3] = False
+            return active
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # wake up the scheduler thread (e.g. the clock mode changed)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def wake_up(cls):
+        with cls.cond:
+            cls.cond.notify_all()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # execute the entries due in the next dt of the virtual time in the
+    # calling thread, return the number of executed entries
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def run_virtual(cls, dt = None, max_steps = None):
+        end_time = None if dt is None else Clock.monotonic() + dt
+        steps    = 0
+        while max_steps is None or steps < max_steps:
+            with cls.cond:
+                while cls.heap and not cls.heap[0][3]:
+                    heapq.heappop(cls.heap)
+                if not cls.heap or (end_time is not None and cls.heap[0][0] > end_time):
+                    break
+                entry    = heapq.heappop(cls.heap)
+                entry[3] = False
+            Clock._set_virtual_time(entry[0])
+            cls._run_callback(entry[2])
+            steps += 1
+
+        if end_time is not None and (max_steps is None or steps < max_steps):
+            Clock._set_virtual_time(end_time)
+        return steps
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # shift the deadlines of the pending entries and the times of their
+    # timers (must be called with cond, used by Clock when leaving the
+    # virtual mode)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def _shift(cls, delta):
+        for entry in cls.heap:
+            entry[0] += delta
+            owner = getattr(entry[2], "__self__", None)
+            if entry[3] and hasattr(owner, "_shift_time"):
+                owner._shift_time(delta)
+        heapq.heapify(cls.heap)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # number of threads used by the scheduler
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def thread_num(cls):
+        with cls.cond:
+            return len(cls.workers) + (0 if cls.thread is None else 1)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # dispatch a fired callback to the workers (called with cond). A new
+    # worker is created if all workers are busy or have work waiting. The
+    # count is released by the workers after the callbacks, so it is never
+    # lower than the real load during a burst holding cond
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def _dispatch(cls, callback):
+        cls.pending += 1
+        if cls.pending > len(cls.workers) and len(cls.workers) < cls.MAX_WORKERS:
+            wrk = threading.Thread(target = cls._worker_func,
+                                   daemon = True,
+                                   name   = "TRD-TimerWorker{}".format(len(cls.workers)))
+            cls.workers.append(wrk)
+            wrk.start()
+        cls.readyQ.put(callback)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # thread function of the scheduler
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def _thrd_func(cls):
+        with cls.cond:
+            while True:
+                # drop the cancelled entries on the top
+                while cls.heap and not cls.heap[0][3]:
+                    heapq.heappop(cls.heap)
+
+                # wait for the earliest deadline or new entries (in virtual
+                # mode, the entries are executed by run_virtual)
+                if not cls.heap or Clock.virtual:
+                    cls.cond.wait()
+                    continue
+
+                delay = cls.heap[0][0] - Clock.monotonic()
+                if delay > 0:
+                    cls.cond.wait(delay)
+                    continue
+
+                # fire the entry
+                entry    = heapq.heappop(cls.heap)
+                entry[3] = False
+                cls._dispatch(entry[2])
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # thread function of the workers
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def _worker_func(cls):
+        while True:
+            callback = cls.readyQ.get()
+            cls._run_callback(callback)
+            with cls.cond:
+                cls.pending -= 1
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # execute a callback
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def _run_callback(cls, callback):
+        try:
+            callback()
+        except:
+            func = getattr(getattr(callback, "__self__", None), "user_cb", callback)    # user callback of RepeatedTimer
+            ExcAggregator.report("timer callback " + getattr(func, "__qualname__", str(func)))
@@ -0,0 +1,131 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Tracer of the activities exported as Chrome trace JSON
+# Note:
+#   1. Nothing is recorded between stop() and the next start(), which 
+#      clears the events. The callers test Tracer.enabled once per traced
+#      call before taking any timestamp, so the spans cost nothing in a
+#      soft IOC which is not being traced
+#   2. The spans of the job executions (and their waiting in the queue),
+#      FSM entry/transit/exit, timer callbacks and RemotePV operations are
+#      recorded with the thread executing them. The latest max_events are
+#      kept
+#   3. Open the exported file with chrome://tracing or ui.perfetto.dev
+# -------------------------------------------------
+import threading
+import time
+import collections
+import json
+import os
+
+# =================================
+# span used with "with" statement
+# =================================
+class TraceSpan:
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat  = cat
+        self.args = args
+
+    def __enter__(self):
+        self.t0 = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        Tracer.add_span(self.name, self.cat, self.t0, time.monotonic(), self.args)
+        return False
+
+class TraceSpanNull:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+# =================================
+# class of the tracer
+# =================================
+class Tracer:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    enabled     = False
+    lock        = threading.Lock()
+    events      = collections.deque(maxlen = 1000000)
+    threads     = {}                    # thread id -> thread name
+    async_id    = 0                     # id of the async events
+    null_span   = TraceSpanNull()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # start/stop the tracing, start clears the recorded events
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def start(cls, max_events = 1000000):
+        with cls.lock:
+            cls.events  = collections.deque(maxlen = max_events if max_events >= 1 else 1000000)
+            cls.threads = {}
+            cls.enabled = True
+
+    @classmethod
+    def stop(cls):
+        cls.enabled = False
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # record a span
+    #   span()      - use as "with Tracer.span(name, cat):"
+    #   add_span()  - with the start and end time (time.monotonic()), s
+    #   add_async() - span not nested in the thread (e.g. waiting in queue)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def span(cls, name, cat = "app", args = None):
+        if not cls.enabled:
+            return cls.null_span
+        return TraceSpan(name, cat, args)
+
+    @classmethod
+    def add_span(cls, name, cat, t0, t1, args = None):
+        if not cls.enabled:
+            return
+        evt = {"name": name, "cat": cat, "ph": "X", "ts": t0 * 1e6, "dur": (t1 - t0) * 1e6,
+               "pid": os.getpid(), "tid": cls._thread_id()}
+        if args:
+            evt["args"] = args
+        cls.events.append(evt)
+
+    @classmethod
+    def add_async(cls, name, cat, t0, t1, args = None):
+        if not cls.enabled:
+            return
+        with cls.lock:
+            cls.async_id += 1
+            aid = cls.async_id
+        tid = cls._thread_id()
+        evt = {"name": name, "cat": cat, "ph": "b", "ts": t0 * 1e6, "id": aid, "pid": os.getpid(), "tid": tid}
+        if args:
+            evt["args"] = args
+        cls.events.append(evt)
+        cls.events.append({"name": name, "cat": cat, "ph": "e", "ts": t1 * 1e6, "id": aid, "pid": os.getpid(), "tid": tid})
+
+    @classmethod
+    def _thread_id(cls):
+        tid = threading.get_ident()
+        if tid not in cls.threads:
+            cls.threads[tid] = threading.current_thread().name
+        return tid
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # export the events to a Chrome trace JSON file
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def export(cls, fileName):
+        pid    = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in list(cls.threads.items())]
+        events += list(cls.events)
+        with open(fileName, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return len(events)
@@ -0,0 +1,197 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Watchdog of job executions, FSM steps and timer callbacks
+# Note:
+#   1. Watchdog.config() sets the budgets and starts the checking thread.
+#      Before that the Application, FSMLite and RepeatedTimer do not call
+#      begin()/end(), so unwatched activities are not recorded at all
+#   2. The begin and end of each activity is recorded with its thread.
+#      A thread checks the running activities periodically, if one runs
+#      longer than its budget, it is flagged as stalled and the stack of
+#      its thread is captured and printed (once for each stall)
+#   3. Each Application and FSM has the PVs WDOG-OK (0 if any of its
+#      activities is stalled) and WDOG-STALL (the stalled activity), two
+#      records added to the soft IOC even if the watchdog is not enabled.
+#      Set Watchdog.with_pvs = False before creating the objects to skip
+#      them. The owners are identified by the module and device name of
+#      the PVs, so two objects with the same names share them
+#   4. The watchdog uses its own thread, so it works even if all timer
+#      threads are blocked
+# -------------------------------------------------
+import threading
+import time
+import sys
+import traceback
+
+class Watchdog:
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # class variables
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    enabled     = False
+    with_pvs    = True                  # create the PVs of the owners
+    check_intv  = 1.0                   # interval to check the activities, s
+    budgets     = {"job": 10.0, "fsm": 5.0, "timer": 5.0}     # default budget of each kind, s
+    name_budget = {}                    # budget of specific activity name, s
+
+    lock        = threading.Lock()
+    active      = {}                    # id -> activity record
+    seq         = 0
+    owners      = {}                    # (modName, devName) -> {"ok": LocalPV, "stall": LocalPV}
+    stalls      = []                    # latest stall records (with stacks)
+    cnt_stall   = 0
+    thread      = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # configure and enable the watchdog
+    #   check_intv  - float, interval to check the activities, s
+    #   job_budget, fsm_budget, timer_budget - float, default budgets, s
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def config(cls, check_intv = 1.0, job_budget = 10.0, fsm_budget = 5.0, timer_budget = 5.0):
+        with cls.lock:
+            cls.check_intv = check_intv if check_intv > 0 else 1.0
+            cls.budgets    = {"job": job_budget, "fsm": fsm_budget, "timer": timer_budget}
+            cls.enabled    = True
+
+            # start the thread
+            if cls.thread is None:
+                cls.thread = threading.Thread(target = cls._thrd_func,
+                                              daemon = True,
+                                              name   = "TRD-Watchdog")
+                cls.thread.start()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # set the budget of a specific activity (e.g. "job NAME" or FSM step
+    # "FSM.STATE.entry"), None to use the default of its kind
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def set_budget(cls, name, budget):
+        with cls.lock:
+            if budget is None: cls.name_budget.pop(name, None)
+            else:              cls.name_budget[name] = budget
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the PVs of an owner (Application or FSM), called at creation,
+    # return the owner used for begin()
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def add_owner(cls, modName, devName):
+        from ooepics.LocalPV import LocalPV
+        owner = (modName, devName)
+        with cls.lock:
+            if owner in cls.owners or not cls.with_pvs:
+                return owner
+            cls.owners[owner] = {"ok":    LocalPV(modName, devName, "WDOG-OK",    "", "", 1,   "bi",            "no activity stalled"),
+                                 "stall": LocalPV(modName, devName, "WDOG-STALL", "", "", 128, "waveform-text", "stalled activity")}
+        return owner
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # record the begin and end of an activity
+    #   owner       - owner returned by add_owner() (None for no owner)
+    #   name        - string, name of the activity
+    #   kind        - string, "job", "fsm" or "timer"
+    # begin() returns the id used for end(), None if disabled
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def begin(cls, owner, name, kind):
+        if not cls.enabled:
+            return None
+        with cls.lock:
+            cls.seq += 1
+            cls.active[cls.seq] = {"owner":   owner,
+                                   "name":    name,
+                                   "kind":    kind,
+                                   "thread":  threading.get_ident(),
+                                   "tname":   threading.current_thread().name,
+                                   "start":   time.monotonic(),
+                                   "stalled": False}
+            return cls.seq
+
+    @classmethod
+    def end(cls, aid):
+        if aid is None:
+            return
+        with cls.lock:
+            rec = cls.active.pop(aid, None)
+        if rec is not None and rec["stalled"]:
+            print("Watchdog: {} recovered after {:.3f} s".format(rec["name"], time.monotonic() - rec["start"]))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # get the running activities and the latest stalls
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def get_active(cls):
+        cur_time = time.monotonic()
+        with cls.lock:
+            return [{"owner":   rec["owner"],
+                     "name":    rec["name"],
+                     "thread":  rec["tname"],
+                     "elapsed": cur_time - rec["start"],
+                     "stalled": rec["stalled"]} for rec in cls.active.values()]
+
+    @classmethod
+    def get_stalls(cls):
+        with cls.lock:
+            return list(cls.stalls)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # check the activities (called by the thread)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def check(cls):
+        cur_time = time.monotonic()
+        new      = []
+        stalled  = {}                   # owner -> text of the stalled activity
+        with cls.lock:
+            for rec in cls.active.values():
+                budget = cls.name_budget.get(rec["name"], cls.budgets.get(rec["kind"]))
+                if budget is None or cur_time - rec["start"] <= budget:
+                    continue
+                if not rec["stalled"]:
+                    rec["stalled"] = True
+                    new.append(rec)
+                stalled[rec["owner"]] = "{} in {}".format(rec["name"], rec["tname"])
+
+        # capture the stacks of the new stalls
+        frames = sys._current_frames() if new else {}
+        for rec in new:
+            frame = frames.get(rec["thread"])
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            stall = {"owner":   rec["owner"],
+                     "name":    rec["name"],
+                     "thread":  rec["tname"],
+                     "time":    time.time(),
+                     "stack":   stack}
+            with cls.lock:
+                cls.cnt_stall += 1
+                cls.stalls.append(stall)
+                del cls.stalls[:-100]
+
+            print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+            print("Watchdog: {} stalled in thread {} for {:.3f} s\n".format(rec["name"], rec["tname"], cur_time - rec["start"]))
+            print(stack)
+            print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n")
+
+        # publish the state of the owners (only the changed ones)
+        with cls.lock:
+            owners = list(cls.owners.items())
+        for owner, ent in owners:
+            ent["ok"].write_changed(0 if owner in stalled else 1)
+            ent["stall"].write_changed(stalled.get(owner, ''))
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # thread function
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    @classmethod
+    def _thrd_func(cls):
+        while True:
+            time.sleep(cls.check_intv)
+            if cls.enabled:
+                try:
+                    cls.check()
+                except:
+                    print("ERROR: watchdog check failed: {}".format(sys.exc_info()[1]))
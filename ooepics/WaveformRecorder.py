@@ -0,0 +1,290 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Job recording every update of waveform PVs to memory-mapped files
+# Note:
+#   1. Each monitored waveform is written in the monitor callback to a row
+#      of a preallocated memory-mapped .npy segment (numpy open_memmap),
+#      there is no pickling and no Python file I/O for the data. A parallel
+#      segment "_ts.npy" has for each row [timestamp, time received, number
+#      of elements], the rows not written have NaN timestamps
+#   2. A segment is rotated when it is full (seg_bytes). The next segment
+#      is prepared and the full one is flushed and closed by a background
+#      thread, so the callbacks only copy the data
+#   3. Register the job with the commands START, STOP and ROTATE, e.g.
+#           app.registJob(rec, ["START", "STOP", "ROTATE"])
+#      or call start()/stop() directly
+#   4. The count, the write rate (MB/s and Hz), the number of segments and
+#      the current file are published to PVs, get_stat() returns the
+#      sustained rate since start
+#   5. Read a segment with np.load(fileName, mmap_mode = 'r')
+# -------------------------------------------------
+import threading
+import queue
+import time
+import os
+import numpy as np
+
+from ooepics.Job import *
+from ooepics.RepeatedTimer import *
+from ooepics.ExcAggregator import *
+
+class WaveformRecorder(Job):
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the object
+    #
+    # inputs:
+    #   modName     - string, module name
+    #   jobName     - string, job name
+    #   pvNames     - list of string, waveform PVs to record
+    #   nelm        - int, max number of elements of the waveforms
+    #   folder      - string, folder of the segment files
+    #   seg_bytes   - int, max size of a data segment, bytes
+    #   dtype       - string, data type stored
+    #   pub_intv    - float, interval to publish the statistics, s
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def __init__(self, modName, jobName, pvNames, nelm = 2048, folder = "wfrec",
+                       seg_bytes = 268435456, dtype = "float32", pub_intv = 1.0):
+        Job.__init__(self, modName, jobName)
+        self.nelm       = nelm
+        self.folder     = folder
+        self.dtype      = np.dtype(dtype)
+        self.rows       = max(1, seg_bytes // (nelm * self.dtype.itemsize))   # rows of a segment
+        self.recording  = False
+        self.monitored  = False
+
+        # channels of the PVs
+        self.channels   = []
+        for pvName in pvNames:
+            self.channels.append({"rpv":    RemotePV(pvName),
+                                  "file":   pvName.replace(":", "_").replace("/", "_"),
+                                  "lock":   threading.Lock(),
+                                  "seq":    0,          # sequence number of the segment
+                                  "seg":    None,       # current segment [data, ts, fileName]
+                                  "spare":  None,       # next segment prepared by the thread
+                                  "row":    0})         # next row to write
+
+        # statistics
+        self.stat_lock  = threading.Lock()
+        self.cnt_evt    = 0
+        self.cnt_bytes  = 0
+        self.cnt_drop   = 0
+        self.cnt_seg    = 0
+        self.cnt_sync   = 0             # segments created in the callback (thread behind)
+        self.start_time = None
+        self.stop_time  = None
+        self.last_pub   = [time.monotonic(), 0, 0]  # time, events, bytes of the last publishing
+
+        # thread to prepare and close the segments
+        self.taskQ      = queue.Queue()
+        self.thread     = threading.Thread(target = self._thrd_func, daemon = True, name = "WFREC-" + jobName)
+        self.thread.start()
+
+        # local PVs
+        self.lpv_running = LocalPV(modName, jobName, "REC-RUNNING",  "", "",     1,   "bi",            "recording or not")
+        self.lpv_cnt     = LocalPV(modName, jobName, "REC-CNT",      "", "",     1,   "longin",        "number of recorded waveforms")
+        self.lpv_drop    = LocalPV(modName, jobName, "REC-DROP",     "", "",     1,   "longin",        "number of dropped waveforms")
+        self.lpv_segCnt  = LocalPV(modName, jobName, "REC-SEG-CNT",  "", "",     1,   "longin",        "number of segments")
+        self.lpv_rateMB  = LocalPV(modName, jobName, "REC-RATE",     "", "MB/s", 1,   "ai",            "write rate")
+        self.lpv_rateEvt = LocalPV(modName, jobName, "REC-EVT-RATE", "", "Hz",   1,   "ai",            "recorded waveforms per second")
+        self.lpv_file    = LocalPV(modName, jobName, "REC-FILE",     "", "",     128, "waveform-text", "current segment")
+
+        self.pubTimer = RepeatedTimer(pub_intv, self.publish)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # execute the job: 0 - start, 1 - stop, 2 - rotate
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def execute(self, cmdId = 0, dataBus = None):
+        if   cmdId == 0: return self.start()
+        elif cmdId == 1: return self.stop()
+        elif cmdId == 2: return self.rotate()
+        return False
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # start/stop the recording, rotate all segments
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def start(self):
+        if self.recording:
+            return True
+        try:
+            os.makedirs(self.folder, exist_ok = True)
+        except OSError:
+            print("ERROR: failed to create folder " + self.folder)
+            return False
+
+        with self.stat_lock:
+            self.cnt_evt    = 0
+            self.cnt_bytes  = 0
+            self.cnt_drop   = 0
+            self.start_time = time.monotonic()
+            self.stop_time  = None
+            self.last_pub   = [self.start_time, 0, 0]
+        self.recording = True
+
+        for ch in self.channels:
+            with ch["lock"]:
+                ch["seq"] += 1
+                ch["seg"]  = self._new_segment(ch["file"], ch["seq"])
+                ch["row"]  = 0
+            self.taskQ.put(["prepare", ch])
+
+        # monitor the PVs (only once)
+        if not self.monitored:
+            self.monitored = True
+            for ch in self.channels:
+                ch["rpv"].monitor(self._cb_mon, [ch], meta = True)
+            self.pubTimer.start()
+
+        self.lpv_running.write(1)
+        return True
+
+    def stop(self):
+        if not self.recording:
+            return True
+        self.recording = False
+        self.stop_time = time.monotonic()
+        for ch in self.channels:
+            with ch["lock"]:
+                seg, ch["seg"] = ch["seg"], None
+                spare, ch["spare"] = ch["spare"], None
+            self.taskQ.put(["close", seg])
+            if spare is not None:
+                self.taskQ.put(["remove", spare])
+        self.lpv_running.write(0)
+        self.publish()
+        return True
+
+    def rotate(self):
+        if not self.recording:
+            return False
+        for ch in self.channels:
+            with ch["lock"]:
+                self._rotate(ch)
+        return True
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # statistics
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def get_stat(self):
+        with self.stat_lock:
+            if self.start_time is None:
+                elapsed = 0.0
+            else:
+                elapsed = (self.stop_time or time.monotonic()) - self.start_time
+            return {"recording": self.recording,
+                    "waveforms": self.cnt_evt,
+                    "bytes":     self.cnt_bytes,
+                    "dropped":   self.cnt_drop,
+                    "segments":  self.cnt_seg,
+                    "sync_seg":  self.cnt_sync,
+                    "elapsed":   elapsed,
+                    "rate_MBps": self.cnt_bytes / elapsed / 1e6 if elapsed > 0 else 0.0,
+                    "rate_Hz":   self.cnt_evt / elapsed if elapsed > 0 else 0.0}
+
+    def publish(self):
+        cur_time = time.monotonic()
+        with self.stat_lock:
+            t0, evt0, bytes0 = self.last_pub
+            self.last_pub    = [cur_time, self.cnt_evt, self.cnt_bytes]
+            cnt_evt, cnt_bytes, cnt_drop, cnt_seg = self.cnt_evt, self.cnt_bytes, self.cnt_drop, self.cnt_seg
+        dt  = cur_time - t0
+        seg = self.channels[0]["seg"] if self.channels else None
+
+        self.lpv_cnt.write(cnt_evt)
+        self.lpv_drop.write(cnt_drop)
+        self.lpv_segCnt.write(cnt_seg)
+        self.lpv_rateMB.write((cnt_bytes - bytes0) / dt / 1e6 if dt > 0 else 0.0)
+        self.lpv_rateEvt.write((cnt_evt - evt0) / dt if dt > 0 else 0.0)
+        self.lpv_file.write(seg[2] if seg is not None else '')
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # monitor callback, copy the waveform to the next row
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _cb_mon(self, args):
+        ch = args[0]
+        value, ts, sevr_ok, status_ok = args[-1]
+        if not self.recording:
+            return
+        try:
+            wf = np.asarray(value, dtype = self.dtype).ravel()[:self.nelm]
+            with ch["lock"]:
+                if ch["seg"] is None:
+                    return
+                if ch["row"] >= self.rows:
+                    self._rotate(ch)
+                data, tsCol, fileName = ch["seg"]
+                row = ch["row"]
+                data[row, :wf.size] = wf
+                tsCol[row] = (ts if ts is not None else np.nan, time.time(), wf.size)
+                ch["row"] = row + 1
+            with self.stat_lock:
+                self.cnt_evt   += 1
+                self.cnt_bytes += wf.nbytes
+        except:
+            with self.stat_lock:
+                self.cnt_drop += 1
+            ExcAggregator.report("recorder " + self.jobName)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # segments (_rotate is called with the lock of the channel)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _rotate(self, ch):
+        old = ch["seg"]
+        if ch["spare"] is not None:
+            ch["seg"], ch["spare"] = ch["spare"], None
+        else:
+            ch["seq"] += 1
+            ch["seg"]  = self._new_segment(ch["file"], ch["seq"])
+            with self.stat_lock:
+                self.cnt_sync += 1
+        ch["row"] = 0
+        self.taskQ.put(["close", old])
+        self.taskQ.put(["prepare", ch])
+
+    def _new_segment(self, file, seq):
+        fileName = os.path.join(self.folder, "{}_{}_{:06d}".format(file, time.strftime("%Y%m%d-%H%M%S"), seq))
+        data     = np.lib.format.open_memmap(fileName + ".npy",    mode = "w+", dtype = self.dtype, shape = (self.rows, self.nelm))
+        tsCol    = np.lib.format.open_memmap(fileName + "_ts.npy", mode = "w+", dtype = np.float64, shape = (self.rows, 3))
+        tsCol[:] = np.nan
+        with self.stat_lock:
+            self.cnt_seg += 1
+        return [data, tsCol, fileName + ".npy"]
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # thread function: prepare the next segments, flush and close the full ones
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _thrd_func(self):
+        while True:
+            task, obj = self.taskQ.get()
+            try:
+                if task == "prepare":
+                    ch = obj
+                    with ch["lock"]:
+                        if not self.recording or ch["spare"] is not None:
+                            continue
+                        ch["seq"] += 1
+                        seq = ch["seq"]
+                    spare = self._new_segment(ch["file"], seq)
+                    with ch["lock"]:
+                        if self.recording and ch["spare"] is None:
+                            ch["spare"], spare = spare, None
+                    if spare is not None:
+                        self._close_segment(spare, remove = True)
+                elif obj is not None:
+                    self._close_segment(obj, remove = (task == "remove"))
+            except:
+                ExcAggregator.report("recorder " + self.jobName)
+
+    def _close_segment(self, seg, remove = False):
+        data, tsCol, fileName = seg
+        data.flush()
+        tsCol.flush()
+        del data, tsCol, seg
+        if remove:
+            os.remove(fileName)
+            os.remove(fileName[:-4] + "_ts.npy")
+            with self.stat_lock:
+                self.cnt_seg -= 1
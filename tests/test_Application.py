@@ -0,0 +1,84 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Tests of the periodic jobs of Application with the virtual clock
+# Note:
+#   1. The virtual time starts at an integer second and the periods are
+#      powers of 2, so the deadlines have no rounding error
+#   2. A long execution is simulated by moving the virtual clock in the
+#      job
+# -------------------------------------------------
+import math
+import pytest
+
+from ooepics.Application import *
+
+apps = []
+
+@pytest.fixture
+def vclock():
+    Clock.set_virtual(True)
+    Clock._set_virtual_time(math.ceil(Clock.monotonic()) + 1024.0)
+    yield Clock.monotonic()
+    while apps:
+        app = apps.pop()
+        for pjob in app.periodicJobList:
+            pjob["timer"].stop()
+        app.statTimer.stop()
+    Clock.set_virtual(False)
+
+# job recording the time (relative to t0) of each execution, the
+# executions listed in busy take the given time
+class TimedJob(Job):
+    def __init__(self, jobName, t0, busy = {}):
+        Job.__init__(self, "TEST", jobName)
+        self.t0    = t0
+        self.busy  = busy
+        self.fires = []
+
+    def execute(self, cmdId = 0, dataBus = None):
+        self.fires.append(Clock.monotonic() - self.t0)
+        if len(self.fires) in self.busy:
+            Clock._set_virtual_time(Clock.monotonic() + self.busy[len(self.fires)])
+        return True
+
+def make_app(name, t0, period_s, busy = {}, **kw):
+    app = Application(name, "TEST")
+    job = TimedJob(name, t0, busy)
+    app.registJobPeriodic(job, period_s, **kw)
+    app.letGoing()
+    apps.append(app)
+    return app, job
+
+def test_fixed_delay_follows_advance(vclock):
+    app, job = make_app("PJOB-DELAY", vclock, 1.0)
+    assert app.periodicQ is None                            # no thread with the virtual clock
+    Clock.advance(100.5)
+    assert len(job.fires) == 100
+    assert app.getJobStat(job).get_stat()["ok"] == 100
+
+def test_fixed_delay_includes_execution_time(vclock):
+    app, job = make_app("PJOB-DELAY-BUSY", vclock, 1.0, busy = {1: 0.5})
+    Clock.advance(4.25)
+    assert job.fires == [1.0, 2.5, 3.5]
+
+def test_fixed_rate_follows_advance(vclock):
+    app, job = make_app("PJOB-RATE", vclock, 0.25, fixed_rate = True)
+    Clock.advance(10.125)
+    assert job.fires == [k * 0.25 for k in range(1, 41)]
+
+@pytest.mark.parametrize("overrun, fires, drop, merge", [
+    ("skip",    [0.25, 1.0, 1.25, 1.5],             2, 0),
+    ("catchup", [0.25, 0.9375, 0.9375, 1.0, 1.25, 1.5], 0, 0),
+    ("merge",   [0.25, 0.9375, 1.0, 1.25, 1.5],     0, 1),
+])
+def test_fixed_rate_overrun(vclock, overrun, fires, drop, merge):
+    # the 1st execution takes 0.6875 s, the ticks at 0.5 and 0.75 are missed
+    app, job = make_app("PJOB-" + overrun.upper(), vclock, 0.25, fixed_rate = True, overrun = overrun, busy = {1: 0.6875})
+    Clock.advance(1.6)
+    assert job.fires == fires
+    stat = app.getJobStat(job).get_stat()
+    assert stat["drop"] == drop and stat["merge"] == merge
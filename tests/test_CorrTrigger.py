@@ -0,0 +1,139 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Tests of the timestamp-correlated trigger
+# Note:
+#   1. The Application is replaced by a minimal object with the queue,
+#      the counter PVs are written to the BenchPVServer of the benchmarks
+# -------------------------------------------------
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark"))
+
+from BenchPVServer import BenchPVServer
+from ooepics.CorrTrigger import *
+from ooepics.RemotePV import RemotePV
+
+class DummyJob:
+    def __init__(self, jobName):
+        self.jobName = jobName
+
+class DummyApp:
+    def __init__(self, queue_depth = 16):
+        self.modName = "TEST"
+        self.msgQ    = JobQueue(queue_depth)
+        self.drops   = 0                                    # DROP-CNT of the job
+
+    def getJobStat(self, job):
+        return self
+
+    def count_drop(self):
+        self.drops += 1
+
+def make_trig(name, nPVs = 2, tolerance = 0.001, bufDepth = 10, queue_depth = 16):
+    app  = DummyApp(queue_depth)
+    pvs  = [RemotePV("TEST-CORR:{}-{}".format(name, i)) for i in range(nPVs)]
+    trig = CorrTrigger(app, DummyJob(name), pvs, tolerance, bufDepth, cmdId = 2)
+    return trig, app
+
+def queued(app):
+    data = []
+    while not app.msgQ.empty():
+        ent = app.msgQ.get()
+        assert ent[1] == 2                                  # command id
+        data.append(ent[6])
+    return data
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# matching
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+def test_match_in_window():
+    trig, app = make_trig("IN")
+    trig.addEvent(0, 10.0, "a0")
+    assert queued(app) == []
+    trig.addEvent(1, 10.0005, "b0")
+    assert queued(app) == [{"timestamp": 10.0005,
+                            "values": {"TEST-CORR:IN-0": "a0", "TEST-CORR:IN-1": "b0"}}]
+    assert trig.get_stat() == {"match": 1, "drop": 0}
+
+def test_out_of_window_dropped():
+    trig, app = make_trig("OUT")
+    trig.addEvent(0, 10.0, "a0")
+    trig.addEvent(1, 10.01, "b0")                           # a0 can never be matched
+    assert queued(app) == []
+    assert trig.get_stat() == {"match": 0, "drop": 1}
+    trig.addEvent(0, 10.0095, "a1")
+    assert [d["values"]["TEST-CORR:OUT-0"] for d in queued(app)] == ["a1"]
+    assert trig.get_stat() == {"match": 1, "drop": 1}
+
+def test_buffered_events_matched_in_order():
+    trig, app = make_trig("ORDER", nPVs = 3)
+    for ts in [1.0, 2.0, 3.0]:
+        trig.addEvent(0, ts, "a{}".format(ts))
+        trig.addEvent(2, ts, "c{}".format(ts))
+    trig.addEvent(1, 2.0, "b2.0")
+    trig.addEvent(1, 3.0, "b3.0")
+    data = queued(app)
+    assert [d["timestamp"] for d in data] == [2.0, 3.0]
+    assert data[1]["values"] == {"TEST-CORR:ORDER-0": "a3.0", "TEST-CORR:ORDER-1": "b3.0", "TEST-CORR:ORDER-2": "c3.0"}
+    assert trig.get_stat() == {"match": 2, "drop": 2}       # a1.0 and c1.0
+
+def test_full_buffer_drops_oldest():
+    trig, app = make_trig("BUF", bufDepth = 3)
+    for i in range(5):
+        trig.addEvent(0, float(i), i)
+    assert [ev[1] for ev in trig.buffers[0]] == [2, 3, 4]
+    assert trig.get_stat()["drop"] == 2
+    trig.addEvent(1, 3.0, "b")
+    assert [d["values"]["TEST-CORR:BUF-0"] for d in queued(app)] == [3]
+
+def test_full_queue_drops_match():
+    trig, app = make_trig("QUEUE", queue_depth = 1)
+    for ts in [1.0, 2.0]:
+        trig.addEvent(0, ts, ts)
+        trig.addEvent(1, ts, ts)
+    assert [d["timestamp"] for d in queued(app)] == [1.0]   # not merged, the 2nd is dropped
+    assert trig.get_stat() == {"match": 2, "drop": 2}
+    assert app.drops == 1
+
+def test_monitor_callback_skips_invalid():
+    trig, app = make_trig("CB", nPVs = 1)
+    CorrTrigCbFunc([trig, 0, [1.0, 5.0, True, False]])     # bad status
+    CorrTrigCbFunc([trig, 0, [1.0, None, True, True]])     # no timestamp
+    assert queued(app) == []
+    CorrTrigCbFunc([trig, 0, [1.0, 5.0, True, True]])
+    assert queued(app) == [{"timestamp": 5.0, "values": {"TEST-CORR:CB-0": 1.0}}]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# publish
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+def test_publish_counters():
+    BenchPVServer.install()
+    try:
+        trig, app = make_trig("PUB")
+        trig.lpv_matchCnt.pv.create()
+        trig.lpv_dropCnt.pv.create()
+        trig.addEvent(0, 1.0, 0)
+        trig.addEvent(0, 2.0, 0)
+        trig.addEvent(1, 2.0, 0)
+        trig.publish()
+        assert BenchPVServer.get(trig.lpv_matchCnt.pvName)[0] == 1
+        assert BenchPVServer.get(trig.lpv_dropCnt.pvName)[0] == 1
+
+        # only the changed counters are written
+        BenchPVServer.put(trig.lpv_matchCnt.pvName, -1)
+        trig.addEvent(0, 3.0, 0)
+        trig.addEvent(0, 4.0, 0)
+        trig.addEvent(1, 4.0, 0)
+        trig.publish()
+        assert BenchPVServer.get(trig.lpv_matchCnt.pvName)[0] == 2
+        BenchPVServer.put(trig.lpv_matchCnt.pvName, -1)
+        trig.publish()
+        assert BenchPVServer.get(trig.lpv_matchCnt.pvName)[0] == -1
+        assert BenchPVServer.get(trig.lpv_dropCnt.pvName)[0] == 2
+    finally:
+        BenchPVServer.uninstall()
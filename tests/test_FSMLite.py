@@ -0,0 +1,84 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Tests of the events of FSMLite (ticks, triggers and status messages)
+# Note:
+#   1. The CA is the stand-in BenchPVServer of the benchmarks
+#   2. The timer interval is long, so only the triggers execute the FSM
+# -------------------------------------------------
+import os
+import sys
+import time
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark"))
+
+from BenchPVServer import BenchPVServer
+from ooepics.FSMLite import *
+from ooepics.RemotePV import RemotePV
+
+@pytest.fixture(scope = "module")
+def bench_ca():
+    BenchPVServer.install()
+    yield BenchPVServer
+    BenchPVServer.uninstall()
+
+class Counter:
+    def __init__(self, name):
+        self.transits = 0
+        state_tr = {'A': {'entry': None, 'exit': None, 'transit': self.transit}}
+        self.fsm = FSMLite("TEST", name, timer_intv = 5, states = ['A'], state_tr = state_tr,
+                           trig_pvs = [RemotePV("TEST-FSM:{}-TRIG".format(name))], fallback_intv = 10)
+
+    def transit(self):
+        self.transits += 1
+        return 'A'
+
+def queued(fsm):
+    msgs = []
+    while not fsm.msg_q.empty():
+        msgs.append(fsm.msg_q.get_nowait())
+    return msgs
+
+def test_trigger_behind_status_message(bench_ca):
+    cnt = Counter("BEHIND")
+    cnt.fsm.start()                                         # status message waiting
+    try:
+        cnt.fsm._cb_trig(None)
+        cnt.fsm._cb_trig(None)                              # merged with the waiting one
+        cnt.fsm._cb_timer()
+        assert queued(cnt.fsm) == [['FSM started.', True], []]
+        assert cnt.fsm.get_profile()["tick_merged"] == 1
+    finally:
+        cnt.fsm.stop()
+
+def test_trigger_after_execution(bench_ca):
+    cnt = Counter("AFTER")
+    cnt.fsm.start()
+    try:
+        cnt.fsm._cb_trig(None)
+        for msg in queued(cnt.fsm):
+            cnt.fsm._handle_msg(msg)
+        assert cnt.transits == 1
+        cnt.fsm._cb_trig(None)                              # not merged with the executed one
+        assert queued(cnt.fsm) == [[]]
+    finally:
+        cnt.fsm.stop()
+
+def test_trigger_executes_with_thread(bench_ca):
+    cnt = Counter("THREAD")
+    cnt.fsm.letGoing()
+    try:
+        for i in range(3):
+            cnt.fsm.reset()                                 # a status message before each trigger
+            cnt.fsm.start()
+            cnt.fsm._cb_trig(None)
+            deadline = time.monotonic() + 2.0
+            while cnt.transits <= i and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert cnt.transits == i + 1                    # not waiting for the fallback timer
+    finally:
+        cnt.fsm.stop()
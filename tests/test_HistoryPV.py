@@ -0,0 +1,118 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Tests of HistoryPV: the history of the written values, its timestamps
+# and the publishing to the waveform PVs
+# Note:
+#   1. The CA is the stand-in BenchPVServer of the benchmarks
+#   2. The clock is virtual, so the timestamps and the publishing timer
+#      follow Clock.advance()
+# -------------------------------------------------
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark"))
+
+from BenchPVServer import BenchPVServer
+from ooepics.HistoryPV import HistoryPV
+from ooepics.RepeatedTimer import *
+
+T0    = 5000.0                              # virtual wall time of the tests
+hpvs  = []
+
+@pytest.fixture
+def bench_ca():
+    BenchPVServer.install()
+    Clock.set_virtual(True, start_time = T0)
+    yield BenchPVServer
+    while hpvs:
+        hpvs.pop().pubTimer.stop()
+    Clock.set_virtual(False)
+    BenchPVServer.uninstall()
+
+def new_hist(valName, hist_len = 4, pub_intv = 1.0, create = True):
+    hpv = HistoryPV("TEST", "HIST", valName, "", "mA", "ai", "current", hist_len = hist_len, pub_intv = pub_intv)
+    if create:
+        for lpv in [hpv, hpv.lpv_hist, hpv.lpv_histTs]:
+            lpv.pv.create()
+    hpvs.append(hpv)
+    return hpv
+
+def published(hpv):
+    val = BenchPVServer.get(hpv.lpv_hist.pvName)[0]
+    ts  = BenchPVServer.get(hpv.lpv_histTs.pvName)[0]
+    return [list(val), list(ts)]
+
+def test_written_values_with_their_time(bench_ca):
+    hpv = new_hist("WRITE")
+    for i in range(6):
+        assert hpv.write(float(i))
+        Clock.advance(0.25)
+    val, ts = hpv.get_history()
+    assert list(val) == [2.0, 3.0, 4.0, 5.0]                # the last hist_len, oldest first
+    assert list(ts)  == [T0 + 0.5, T0 + 0.75, T0 + 1.0, T0 + 1.25]
+
+def test_failed_write_not_in_history(bench_ca):
+    hpv = new_hist("NOT-WRITTEN", create = False)
+    assert not hpv.write(1.0)
+    assert len(hpv.get_history()[0]) == 0
+    assert not hpv.pubTimer.timer_waiting                   # started at the first update
+
+def test_published_by_timer_aligned(bench_ca):
+    hpv = new_hist("PUB")
+    hpv.append(1.0, ts = 10.0)
+    hpv.append(2.0, ts = 11.0)
+    BenchPVServer.put(hpv.lpv_hist.pvName, [])
+    Clock.advance(0.5)
+    assert BenchPVServer.get(hpv.lpv_hist.pvName)[0] == []  # at most once per pub_intv
+    Clock.advance(0.5)
+    assert published(hpv) == [[1.0, 2.0], [10.0, 11.0]]     # only the valid entries
+
+    # wrapped: each time stays with its value
+    for i in range(3, 8):
+        hpv.append(float(i), ts = 10.0 + i - 1)
+    Clock.advance(1.0)
+    val, ts = published(hpv)
+    assert val == [4.0, 5.0, 6.0, 7.0]
+    assert [t - v for t, v in zip(ts, val)] == [9.0] * 4
+
+    # no new updates, not written again
+    BenchPVServer.put(hpv.lpv_hist.pvName, [])
+    Clock.advance(1.0)
+    assert BenchPVServer.get(hpv.lpv_hist.pvName)[0] == []
+
+def test_times_written_before_values(bench_ca):
+    hpv    = new_hist("ORDER")
+    writes = []
+    for lpv in [hpv.lpv_hist, hpv.lpv_histTs]:
+        lpv.write = lambda value, lpv = lpv, write = lpv.write: writes.append(lpv.pvName) or write(value)
+    hpv.append(1.0, ts = 1.0)
+    hpv.publish()
+    assert writes == [hpv.lpv_histTs.pvName, hpv.lpv_hist.pvName]
+
+def test_failed_publish_retried(bench_ca):
+    hpv = new_hist("RETRY")
+    hpv.lpv_hist.write = lambda value: False
+    hpv.append(1.0, ts = 1.0)
+    hpv.publish()
+    assert hpv.hist_dirty
+    del hpv.lpv_hist.write                                  # back to LocalPV.write
+    hpv.publish()
+    assert published(hpv) == [[1.0], [1.0]]
+    assert not hpv.hist_dirty
+
+def test_cleared_history_published_at_next_update(bench_ca):
+    hpv = new_hist("CLEAR")
+    hpv.append(1.0, ts = 1.0)
+    hpv.publish()
+    hpv.clear()
+    hpv.publish()
+    assert published(hpv) == [[1.0], [1.0]]
+    hpv.append(2.0, ts = 2.0)
+    hpv.publish()
+    assert published(hpv) == [[2.0], [2.0]]
@@ -0,0 +1,141 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Tests of the result cache of jobs
+# Note:
+#   1. The PVs are replaced by minimal objects with read() and write()
+# -------------------------------------------------
+import numpy as np
+
+from ooepics.JobCache import *
+
+class DummyPV:
+    def __init__(self, value = 0.0, ts = 1.0):
+        self.value      = value
+        self.ts         = ts
+        self.ok         = True
+        self.writes     = []
+        self.last_write = None
+
+    def read(self, use_monitor = False):
+        return [self.value, self.ts, True, self.ok]
+
+    def write(self, value):
+        self.value      = value
+        self.last_write = value
+        self.writes.append(value)
+        return True
+
+# run a job through the cache as Application.executeJob(), the job writes
+# 10 times the input to the output, return [result, executed]
+def run_job(cache, inPV, outPV, cmdId = 0):
+    key = cache.input_key(cmdId)
+    hit, ret = cache.lookup(key)
+    if hit:
+        return [ret, False]
+    ret = "result {}".format(inPV.value)
+    outPV.write(inPV.value * 10)
+    cache.store(key, ret)
+    return [ret, True]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# keys
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+def test_key_timestamp_and_value():
+    inPV = DummyPV(np.arange(3.0), ts = 5.0)
+    assert JobCache([inPV]).input_key(1) == (1, 5.0)
+
+    cache = JobCache([inPV], mode = "value")
+    key   = cache.input_key(1)
+    inPV.ts = 6.0
+    assert cache.input_key(1) == key                        # only the value counts
+    inPV.value = np.arange(3.0) + 1
+    assert cache.input_key(1) != key
+
+def test_failed_input_always_executes():
+    inPV  = DummyPV()
+    cache = JobCache([inPV])
+    inPV.ok = False
+    assert cache.input_key(0) is None
+    assert cache.lookup(None) == [False, None]
+    assert cache.get_stat() == {"hit": 0, "miss": 0, "size": 0}
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# hits and misses
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+def test_same_inputs_skipped():
+    inPV, outPV = DummyPV(1.0), DummyPV()
+    cache       = JobCache([inPV], [outPV])
+    assert run_job(cache, inPV, outPV) == ["result 1.0", True]
+    assert run_job(cache, inPV, outPV) == ["result 1.0", False]
+    assert outPV.writes == [10.0]                           # outputs kept as they are
+    assert cache.get_stat() == {"hit": 1, "miss": 1, "size": 1}
+
+def test_earlier_inputs_restore_outputs():
+    inPV, outPV = DummyPV(1.0, ts = 1.0), DummyPV()
+    cache       = JobCache([inPV], [outPV])
+    run_job(cache, inPV, outPV)
+    inPV.value, inPV.ts = 2.0, 2.0
+    run_job(cache, inPV, outPV)
+
+    inPV.value, inPV.ts = 1.0, 1.0                          # back to the first inputs
+    assert run_job(cache, inPV, outPV) == ["result 1.0", False]
+    assert outPV.writes == [10.0, 20.0, 10.0]
+    assert cache.get_stat() == {"hit": 1, "miss": 2, "size": 2}
+
+def test_command_id_in_key():
+    inPV, outPV = DummyPV(1.0), DummyPV()
+    cache       = JobCache([inPV], [outPV])
+    run_job(cache, inPV, outPV, cmdId = 0)
+    assert run_job(cache, inPV, outPV, cmdId = 1)[1]
+
+def test_cached_outputs_are_copies():
+    inPV, outPV = DummyPV(np.ones(4), ts = 1.0), DummyPV()
+    cache       = JobCache([inPV], [outPV])
+    run_job(cache, inPV, outPV)
+    outPV.last_write[:] = -1                                # changed in place later
+    inPV.ts = 2.0
+    run_job(cache, inPV, outPV)
+    inPV.ts = 1.0
+    run_job(cache, inPV, outPV)
+    assert np.array_equal(outPV.writes[-1], np.ones(4) * 10)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# eviction and capacity
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+def test_evicts_least_recently_used():
+    inPV, outPV = DummyPV(), DummyPV()
+    cache       = JobCache([inPV], [outPV], cache_size = 2)
+    for ts in [1.0, 2.0, 1.0, 3.0]:                         # 1.0 used again before 3.0
+        inPV.ts = ts
+        run_job(cache, inPV, outPV)
+    assert list(cache.lru) == [(0, 1.0), (0, 3.0)]
+    inPV.ts = 2.0
+    assert run_job(cache, inPV, outPV)[1]                   # evicted
+    inPV.ts = 3.0
+    assert not run_job(cache, inPV, outPV)[1]
+
+def test_capacity_one():
+    inPV, outPV = DummyPV(), DummyPV()
+    cache       = JobCache([inPV], [outPV], cache_size = 1)
+    for ts, executed in [(1.0, True), (1.0, False), (2.0, True), (1.0, True), (1.0, False)]:
+        inPV.ts = ts
+        assert run_job(cache, inPV, outPV)[1] == executed
+    assert cache.get_stat()["size"] == 1
+
+def test_capacity_zero_disables():
+    inPV, outPV = DummyPV(), DummyPV()
+    cache       = JobCache([inPV], [outPV], cache_size = 0)
+    assert run_job(cache, inPV, outPV)[1]
+    assert run_job(cache, inPV, outPV)[1]
+    assert cache.get_stat() == {"hit": 0, "miss": 2, "size": 0}
+
+def test_clear():
+    inPV, outPV = DummyPV(), DummyPV()
+    cache       = JobCache([inPV], [outPV])
+    run_job(cache, inPV, outPV)
+    cache.clear()
+    assert run_job(cache, inPV, outPV)[1]
@@ -0,0 +1,59 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Tests of the process pool offload of jobs
+# Note:
+#   1. The compute functions must be module-level to be pickled
+# -------------------------------------------------
+import concurrent.futures
+import os
+import time
+import numpy as np
+import pytest
+
+from ooepics.JobOffload import *
+
+def scale_wf(cmdId, inputs):
+    return {"wf": inputs["wf"] * inputs["gain"], "cmd": cmdId}
+
+def slow_wf(cmdId, inputs):
+    time.sleep(inputs["delay"])
+    return {"wf": np.ones(1024)}
+
+def shm_names():
+    return set(name for name in os.listdir("/dev/shm") if name.startswith("psm_"))
+
+@pytest.fixture(scope = "module")
+def pool():
+    OffloadPool.start(workers = 1)
+    yield OffloadPool
+    OffloadPool.shutdown()
+
+def test_not_started():
+    if OffloadPool.executor is None:
+        with pytest.raises(RuntimeError):
+            OffloadPool.run(scale_wf, {"wf": np.zeros(4), "gain": 1.0})
+
+def test_arrays_via_shm(pool):
+    wf  = np.arange(100, dtype = np.float32)
+    out = pool.run(scale_wf, {"wf": wf, "gain": 2.0}, cmdId = 3)
+    assert out["cmd"] == 3
+    assert out["wf"].dtype == np.float32
+    assert np.array_equal(out["wf"], wf * 2)
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason = "no /dev/shm")
+def test_late_result_released(pool):
+    before = shm_names()
+    with pytest.raises(concurrent.futures.TimeoutError):
+        pool.run(slow_wf, {"delay": 0.5, "pad": np.zeros(16)}, timeout = 0.05)
+
+    # the next run waits for the single worker, so the late result is ready
+    # then, its output must not stay in /dev/shm
+    assert np.array_equal(pool.run(scale_wf, {"wf": np.ones(2), "gain": 3.0})["wf"], [3.0, 3.0])
+    deadline = time.monotonic() + 5.0
+    while time.monotonic() < deadline and shm_names() - before:
+        time.sleep(0.05)
+    assert shm_names() - before == set()
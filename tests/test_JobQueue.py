@@ -0,0 +1,108 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Tests of the command queue of the Application
+# Note:
+#   1. Run with "python -m pytest -q" in the top folder
+# -------------------------------------------------
+from ooepics.JobQueue import JobQueue
+
+class DummyJob:
+    pass
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# merging
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+def test_merge_replaces_dataBus():
+    q   = JobQueue(depth = 4)
+    job = DummyJob()
+    assert q.put(job, 0, None, dataBus = "old") == [JobQueue.QUEUED, None]
+    assert q.put(job, 0, None, priority = 3, dataBus = "new") == [JobQueue.MERGED, None]
+    assert q.qsize() == 1
+
+    ent = q.get()
+    assert ent[3] == 3                  # the higher priority is kept
+    assert ent[6] == "new"
+
+def test_merge_only_same_job_and_command():
+    q    = JobQueue(depth = 4)
+    job1 = DummyJob()
+    job2 = DummyJob()
+    q.put(job1, 0, None)
+    assert q.put(job1, 1, None)[0] == JobQueue.QUEUED
+    assert q.put(job2, 0, None)[0] == JobQueue.QUEUED
+    assert q.qsize() == 3
+
+def test_no_merge_after_get():
+    q   = JobQueue(depth = 4)
+    job = DummyJob()
+    q.put(job, 0, None)
+    q.get()
+    assert q.put(job, 0, None)[0] == JobQueue.QUEUED
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# full queue
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+def test_full_evicts_lowest_priority():
+    q    = JobQueue(depth = 2)
+    jobs = [DummyJob() for i in range(3)]
+    q.put(jobs[0], 0, None, priority = 1)
+    q.put(jobs[1], 0, None, priority = 0)
+    assert q.full()
+
+    result, evicted = q.put(jobs[2], 0, None, priority = 2)
+    assert result == JobQueue.QUEUED
+    assert evicted[0] is jobs[1]
+    assert q.qsize() == 2
+    assert [q.get()[0], q.get()[0]] == [jobs[2], jobs[0]]
+
+def test_full_evicts_newest_of_lowest_priority():
+    q    = JobQueue(depth = 2)
+    jobs = [DummyJob() for i in range(3)]
+    q.put(jobs[0], 0, None)
+    q.put(jobs[1], 0, None)
+    result, evicted = q.put(jobs[2], 0, None, priority = 1)
+    assert result == JobQueue.QUEUED
+    assert evicted[0] is jobs[1]
+
+def test_full_same_priority_drops_new():
+    q    = JobQueue(depth = 2)
+    jobs = [DummyJob() for i in range(3)]
+    q.put(jobs[0], 0, None, priority = 1)
+    q.put(jobs[1], 0, None, priority = 1)
+    assert q.put(jobs[2], 0, None, priority = 1) == [JobQueue.DROPPED, None]
+    assert q.put(jobs[2], 0, None, priority = 0) == [JobQueue.DROPPED, None]
+    assert [q.get()[0], q.get()[0]] == [jobs[0], jobs[1]]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# order
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+def test_fifo_within_priority():
+    q    = JobQueue(depth = 8)
+    jobs = [DummyJob() for i in range(6)]
+    for i, job in enumerate(jobs):
+        q.put(job, 0, None, priority = i % 2)
+    order = [q.get()[0] for i in range(len(jobs))]
+    assert order == [jobs[1], jobs[3], jobs[5], jobs[0], jobs[2], jobs[4]]
+
+def test_task_done_counter():
+    q   = JobQueue(depth = 2)
+    job = DummyJob()
+    q.put(job, 0, None)
+    assert q.unfinished == 1
+    q.get()
+    q.task_done()
+    assert q.unfinished == 0
+    assert q.empty()
+
+def test_no_merge_flag():
+    q   = JobQueue(depth = 4)
+    job = DummyJob()
+    assert q.put(job, 0, None, dataBus = 1, merge = False)[0] == JobQueue.QUEUED
+    assert q.put(job, 0, None, dataBus = 2, merge = False)[0] == JobQueue.QUEUED
+    assert q.put(job, 0, None, dataBus = 3)[0] == JobQueue.QUEUED       # not merged with the above
+    assert q.put(job, 0, None, dataBus = 4)[0] == JobQueue.MERGED
+    assert [q.get()[6] for i in range(3)] == [1, 2, 4]
@@ -0,0 +1,58 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Tests of the change-only writes of LocalPV
+# Note:
+#   1. The CA is the stand-in BenchPVServer of the benchmarks
+# -------------------------------------------------
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark"))
+
+from BenchPVServer import BenchPVServer
+from ooepics.LocalPV import LocalPV
+
+@pytest.fixture(scope = "module")
+def bench_ca():
+    BenchPVServer.install()
+    yield BenchPVServer
+    BenchPVServer.uninstall()
+
+def make_lpv(valName, pno = 1, recType = "longin"):
+    lpv = LocalPV("TEST", "LPV", valName, "", "", pno, recType, "test")
+    lpv.pv.create()
+    return lpv
+
+# check if write_changed() writes the PV
+def written(bench_ca, lpv, value):
+    sentinel = object()
+    bench_ca.put(lpv.pvName, sentinel)
+    assert lpv.write_changed(value)
+    return bench_ca.get(lpv.pvName)[0] is not sentinel
+
+def test_scalar(bench_ca):
+    lpv = make_lpv("SCALAR")
+    assert written(bench_ca, lpv, 0)                        # never written before
+    assert not written(bench_ca, lpv, 0)
+    assert written(bench_ca, lpv, 1)
+    lpv.write(5)                                            # plain writes count too
+    assert not written(bench_ca, lpv, 5)
+
+def test_waveform(bench_ca):
+    lpv = make_lpv("WF", pno = 4, recType = "waveform")
+    assert written(bench_ca, lpv, np.zeros(4))
+    assert not written(bench_ca, lpv, np.zeros(4))
+    assert not written(bench_ca, lpv, [0.0, 0.0, 0.0, 0.0])
+    assert written(bench_ca, lpv, np.ones(4))
+    assert written(bench_ca, lpv, [1, 2])
+
+def test_failed_write_retried():
+    lpv = LocalPV("TEST", "LPV", "NOT-CONNECTED", "", "", 1, "longin", "test")
+    assert not lpv.write_changed(3)
+    assert lpv.last_write is None
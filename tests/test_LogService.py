@@ -0,0 +1,89 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Tests of LogService: the text of the PV, the severity filter and the
+# file sink
+# Note:
+#   1. The CA is the stand-in BenchPVServer of the benchmarks, the
+#      timer is not started (publish() is called by the tests)
+# -------------------------------------------------
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark"))
+
+from BenchPVServer import BenchPVServer
+from ooepics.LogService import LogService
+
+@pytest.fixture(scope = "module")
+def bench_ca():
+    BenchPVServer.install()
+    yield BenchPVServer
+    BenchPVServer.uninstall()
+
+def new_service(name, msg_num = 4, msg_len = 60, **kw):
+    srv = LogService("TEST", "T", valName = name, msg_num = msg_num, msg_len = msg_len, echo = False, **kw)
+    srv.lpv_monLogMsg.pv.create()
+    return srv
+
+# the messages without the time stamp
+def bodies(srv):
+    return [line.split("] ", 1)[1] for line in srv.get_messages()]
+
+def test_pv_text_is_lines_without_padding(bench_ca):
+    srv = new_service("PV-TEXT")
+    assert not srv.timer.timer_waiting                      # publishing starts with letGoing
+    srv.postMessage("job", "INFO", "first")
+    srv.postMessage("job", "WARN", "second")
+    srv.publish()
+    text = bench_ca.get(srv.lpv_monLogMsg.pvName)[0]
+    assert "\0" not in text and text == srv.get_text()
+    assert text.endswith("\n")
+    assert [line.split("] ", 1)[1] for line in text.splitlines()] == ["T|WARN: job: second", "T|INFO: job: first"]
+
+    # published only if there are new messages
+    bench_ca.put(srv.lpv_monLogMsg.pvName, "")
+    srv.publish()
+    assert bench_ca.get(srv.lpv_monLogMsg.pvName)[0] == ""
+
+def test_newlines_kept_in_one_line():
+    srv = LogService("TEST", "T", valName = "NEWLINE", msg_num = 4, msg_len = 60, echo = False)
+    srv.postMessage("job", "ERROR", "failed:\nline 2\r\nline 3")
+    srv.postMessage("job", "INFO", "next")
+    assert bodies(srv) == ["T|INFO: job: next", "T|ERROR: job: failed: line 2 line 3"]
+
+def test_long_message_truncated():
+    srv = LogService("TEST", "T", valName = "LONG", msg_num = 4, msg_len = 40, echo = False)
+    srv.postMessage("job", "INFO", "x" * 100)
+    lines = srv.get_text().split("\n")
+    assert len(lines[0]) == 39 and lines[0].endswith("x") and lines[1] == ""
+
+def test_severity_filter():
+    srv = LogService("TEST", "T", valName = "SEVR", msg_num = 8, echo = False, min_severity = "WARN")
+    for sevr in ["DEBUG", "INFO", "WARN", "ERROR", "NOTE"]:
+        srv.postMessage("job", sevr, "msg")
+    assert [b.split(":")[0] for b in bodies(srv)] == ["T|NOTE", "T|ERROR", "T|WARN"]
+    srv.set_min_severity(None)
+    srv.postMessage("job", "DEBUG", "msg")
+    assert bodies(srv)[0] == "T|DEBUG: job: msg"
+
+def test_file_sink_rotates(tmp_path):
+    fileName = str(tmp_path / "ioc.log")
+    srv = LogService("TEST", "T", valName = "SINK", msg_num = 2, msg_len = 60, echo = False)
+    srv.set_file_sink(fileName, max_bytes = 200, backup_cnt = 2)
+    for i in range(10):
+        srv.postMessage("job", "INFO", "line {}\nmore".format(i))
+    srv.close()
+
+    # oldest first in the files, all the messages (not only the ring) kept
+    lines = []
+    for name in [fileName + ".2", fileName + ".1", fileName]:
+        with open(name) as f:
+            lines += f.read().splitlines()
+    assert [line.split(": ", 2)[2] for line in lines][-4:] == ["line {} more".format(i) for i in range(6, 10)]
+    assert all(os.path.getsize(name) <= 200 for name in [fileName, fileName + ".1"])
+    assert len(srv.get_messages()) == 2
@@ -0,0 +1,119 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Tests of the record and replay of monitor events
+# Note:
+#   1. The CA is the stand-in BenchPVServer of the benchmarks
+# -------------------------------------------------
+import os
+import sys
+import struct
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark"))
+
+from BenchPVServer import BenchPVServer
+from ooepics.MonRecorder import *
+from ooepics.RemotePV import RemotePV
+
+@pytest.fixture(scope = "module")
+def bench_ca():
+    BenchPVServer.install()
+    yield BenchPVServer
+    BenchPVServer.uninstall()
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# encode/decode
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+@pytest.mark.parametrize("value", [None, 0, -7, 2 ** 40, True, np.int16(3), 1.5, np.float32(0.25),
+                                   "", "text", b"\x00\x01", np.arange(5, dtype = np.float64),
+                                   np.zeros(0, dtype = np.int32), [1.0, 2.0]])
+def test_value_round_trip(value):
+    kind, data = encode_value(value)
+    buf        = b"xx" + data + b"yy"
+    dec, pos   = decode_value(kind, buf, 2)
+    assert pos == len(buf) - 2
+    if isinstance(value, (np.ndarray, list)):
+        assert np.array_equal(dec, np.asarray(value))
+        assert dec.dtype == np.asarray(value).dtype
+    elif isinstance(value, bool):
+        assert dec == int(value)
+    else:
+        assert dec == value
+
+def test_unknown_kind():
+    with pytest.raises(ValueError):
+        decode_value(b'z', b"", 0)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# record and replay
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+def test_record_replay(bench_ca, tmp_path):
+    got = {"a": [], "a2": [], "wf": []}
+    rpv_a  = RemotePV("TEST-MON:A")
+    rpv_wf = RemotePV("TEST-MON:WF")
+    rpv_a.monitor (lambda args: got["a"].append(args[-1]))
+    rpv_a.monitor (lambda args: got["a2"].append(args[-1]))      # recorded once, replayed to both
+    rpv_wf.monitor(lambda args: got["wf"].append(args[-1][0]), meta = True)
+
+    fileName = str(tmp_path / "mon.log")
+    assert MonRecorder.start(fileName)
+    values = [1.5, 2, "on"]
+    for val in values:
+        bench_ca.put("TEST-MON:A", val)
+    bench_ca.put("TEST-MON:WF", np.arange(4, dtype = np.float32))
+    bench_ca.flush()
+    MonRecorder.stop()
+    assert MonRecorder.get_stat()["events"] == 4
+
+    rep = MonReplay(fileName)
+    sm  = rep.summary()
+    assert sm["events"] == 4
+    assert sm["pvs"] == {"TEST-MON:A": 3, "TEST-MON:WF": 1}
+
+    for key in got:
+        got[key].clear()
+    stat = rep.replay(speed = None)
+    assert stat["events"] == 4
+    assert stat["fed"] == 7                 # each callback fed
+    assert stat["missing"] == []
+    assert got["a"] == values
+    assert got["a2"] == values
+    assert np.array_equal(got["wf"][0], np.arange(4, dtype = np.float32))
+
+    # only the selected PVs
+    got["a"].clear()
+    assert rep.replay(speed = None, pvs = ["TEST-MON:WF"])["events"] == 1
+    assert got["a"] == []
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# damaged logs
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+def write_log(path, body):
+    with open(path, "wb") as f:
+        f.write(MON_HEADER.pack(MON_MAGIC, 0.0) + body)
+    return str(path)
+
+def test_truncated_log(tmp_path):
+    name  = b"TEST-MON:T"
+    body  = MON_NAME.pack(REC_NAME, 0, len(name)) + name
+    for i in range(3):
+        body += MON_EVENT.pack(REC_EVENT, 0, 1.0, float(i), 0, 0, b'd') + MON_FLOAT.pack(i * 1.0)
+    fileName = write_log(tmp_path / "trunc.log", body[:-3])
+    assert [evt[1] for evt in MonReplay(fileName).events()] == [0.0, 1.0]
+
+def test_unknown_pv_id(tmp_path):
+    body     = MON_EVENT.pack(REC_EVENT, 5, 1.0, 0.0, 0, 0, b'q') + MON_INT.pack(1)
+    fileName = write_log(tmp_path / "bad.log", body)
+    assert list(MonReplay(fileName).events()) == []
+
+def test_not_a_log(tmp_path):
+    fileName = str(tmp_path / "other.log")
+    with open(fileName, "wb") as f:
+        f.write(struct.pack("<8sd", b"NOTALOG!", 0.0))
+    with pytest.raises(ValueError):
+        list(MonReplay(fileName).events())
@@ -0,0 +1,175 @@
+#####################################################################
+#  Copyright (c) 2023 by Paul Scherrer Institute, Switzerland
+#  All rights reserved.
+#  Authors: Zheqiao Geng
+#####################################################################
+# -------------------------------------------------
+# Tests of the RepeatedTimer modes and the TimerScheduler
+# Note:
+#   1. The timers are driven by Clock in virtual mode, so the counts are
+#      exact. The virtual time starts at an integer second and the
+#      intervals are powers of 2, so the deadlines have no rounding error
+#   2. A long execution is simulated by moving the virtual clock in the
+#      callback
+# -------------------------------------------------
+import math
+import threading
+import time
+import pytest
+
+from ooepics.RepeatedTimer import *
+
+timers = []
+
+@pytest.fixture
+def vclock():
+    Clock.set_virtual(True)
+    Clock._set_virtual_time(math.ceil(Clock.monotonic()) + 1024.0)
+    yield Clock.monotonic()
+    while timers:
+        timers.pop().stop()
+    Clock.set_virtual(False)
+
+# timer recording the time (relative to t0) of each execution, the
+# executions listed in busy take the given time
+def make_timer(t0, interval, fixed_rate = None, busy = {}):
+    fires  = []
+    merged = []
+    def cb():
+        fires.append(Clock.monotonic() - t0)
+        merged.append(tm.merged_ticks)
+        if len(fires) in busy:
+            Clock._set_virtual_time(Clock.monotonic() + busy[len(fires)])
+    tm = RepeatedTimer(interval, cb)
+    if fixed_rate is not None:
+        tm.set_fixed_rate(True, fixed_rate)
+    tm.start()
+    timers.append(tm)
+    return tm, fires, merged
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# fixed delay and fixed rate
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+def test_fixed_delay_includes_execution_time(vclock):
+    tm, fires, merged = make_timer(vclock, 0.125, busy = {1: 0.3125})
+    Clock.advance(1.01)
+    tm.stop()
+    assert fires == [0.125, 0.5625, 0.6875, 0.8125, 0.9375]
+    assert tm.get_stat()["ticks"] == 0                  # statistics only in fixed rate
+
+def test_fixed_rate_sub_100ms(vclock):
+    tm, fires, merged = make_timer(vclock, 1 / 64, fixed_rate = "skip")
+    assert tm.interval == 1 / 64
+    Clock.advance(1.001)
+    tm.stop()
+    assert fires == [k / 64 for k in range(1, 65)]
+    stat = tm.get_stat()
+    assert stat["ticks"] == 64 and stat["overrun"] == 0
+    assert stat["late_max"] == 0.0 and stat["jitter_max"] == 0.0
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# overrun policies: the 1st execution takes 0.3125 s, so the ticks at 0.25
+# and 0.375 are missed
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+def test_overrun_skip(vclock):
+    tm, fires, merged = make_timer(vclock, 0.125, fixed_rate = "skip", busy = {1: 0.3125})
+    Clock.advance(1.01)
+    tm.stop()
+    assert fires == [0.125, 0.5, 0.625, 0.75, 0.875, 1.0]
+    stat = tm.get_stat()
+    assert stat["ticks"] == 6 and stat["overrun"] == 2 and stat["merged"] == 0
+    assert stat["late_max"] == 0.0
+
+def test_overrun_catchup(vclock):
+    tm, fires, merged = make_timer(vclock, 0.125, fixed_rate = "catchup", busy = {1: 0.3125})
+    Clock.advance(1.01)
+    tm.stop()
+    assert fires == [0.125, 0.4375, 0.4375, 0.5, 0.625, 0.75, 0.875, 1.0]
+    stat = tm.get_stat()
+    assert stat["ticks"] == 8 and stat["overrun"] == 2      # the caught up ticks counted once
+    assert stat["late_max"] == 0.1875
+
+def test_overrun_merge(vclock):
+    tm, fires, merged = make_timer(vclock, 0.125, fixed_rate = "merge", busy = {1: 0.3125})
+    Clock.advance(1.01)
+    tm.stop()
+    assert fires  == [0.125, 0.4375, 0.5, 0.625, 0.75, 0.875, 1.0]
+    assert merged == [0, 2, 0, 0, 0, 0, 0]                  # seen by the merged execution
+    stat = tm.get_stat()
+    assert stat["ticks"] == 7 and stat["overrun"] == 2 and stat["merged"] == 2
+    assert stat["merged_last"] == 0
+
+def test_overrun_too_long_is_skipped(vclock):
+    busy = (RepeatedTimer.MAX_CATCHUP + 10) * 0.125
+    tm, fires, merged = make_timer(vclock, 0.125, fixed_rate = "catchup", busy = {1: busy})
+    Clock.advance(busy + 0.25)
+    tm.stop()
+    assert fires == [0.125, busy + 0.25]                    # no burst of catch up executions
+    assert tm.get_stat()["overrun"] == RepeatedTimer.MAX_CATCHUP + 10
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# postpone
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+def test_postpone(vclock):
+    tm, fires, merged = make_timer(vclock, 0.25)
+    Clock.advance(0.125)
+    tm.postpone()                                           # due at 0.375 instead of 0.25
+    Clock.advance(0.125)
+    assert fires == []
+    Clock.advance(0.25)
+    assert fires == [0.375]
+    for i in range(4):                                      # pushed back again and again
+        tm.postpone()
+        Clock.advance(0.125)
+    assert fires == [0.375]
+    Clock.advance(0.25)
+    tm.stop()
+    assert fires == [0.375, 1.125]
+
+def test_postpone_stopped(vclock):
+    tm, fires, merged = make_timer(vclock, 0.25)
+    tm.stop()
+    tm.postpone()
+    Clock.advance(1.0)
+    assert fires == [] and tm.postpone_to is None
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+# scheduler
+# ~~~~~~~~~~~~~~~~~~~~~~~~~
+def test_virtual_order_and_cancel(vclock):
+    order = []
+    t     = Clock.monotonic() + 1.0
+    TimerScheduler.schedule(lambda: order.append("b"), t + 0.5)
+    for name in "xyz":
+        TimerScheduler.schedule(lambda name = name: order.append(name), t)
+    entry = TimerScheduler.schedule(lambda: order.append("cancelled"), t)
+    assert TimerScheduler.cancel(entry)
+    assert Clock.advance(2.0) == 4
+    assert order == ["x", "y", "z", "b"]
+    assert not TimerScheduler.cancel(entry)
+
+def test_shared_workers_bounded():
+    nTimers = TimerScheduler.MAX_WORKERS + 8
+    release = threading.Event()
+    fired   = []
+    def cb(i):
+        fired.append(i)
+        release.wait(2.0)                                   # keep all workers busy
+    busyTimers = [RepeatedTimer(0.1, cb, i) for i in range(nTimers)]
+    for tm in busyTimers:
+        tm.start()
+    deadline = time.monotonic() + 2.0
+    while len(fired) < TimerScheduler.MAX_WORKERS and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(TimerScheduler.workers) == TimerScheduler.MAX_WORKERS
+    assert TimerScheduler.thread_num() == TimerScheduler.MAX_WORKERS + 1
+    for tm in busyTimers:
+        tm.stop()
+    release.set()
+
+    # the waiting callbacks are executed by the same workers
+    deadline = time.monotonic() + 2.0
+    while len(fired) < nTimers and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(fired) == list(range(nTimers))
+    assert len(TimerScheduler.workers) == TimerScheduler.MAX_WORKERS